@@ -0,0 +1,84 @@
+import threading
+
+import profiling
+
+
+class LoadCancelled(Exception):
+    """
+    この例外は読み込みが取り消されたときに、読み込み関数の中から送出します。
+    """
+
+
+class BackgroundLoad:
+    """
+    このクラスは1つのファイルの読み込みを別のスレッドで行います。
+    Streamlitの再実行は読み込みの完了を待たずに終わるため、読み込み中もサイドバーの操作にすぐに応答できます。
+    最初に粗いプレビューを作成し、次にファイル全体を読み込みます。再実行のたびにpreviewとprogressを確認し、
+    doneになったらresultで結果を受け取ります。
+    計測を有効にした場合は、スレッドの中で専用のProfilerを使い、終わった後にrecordsで計測結果を受け取ります。
+    """
+
+    def __init__(self, key, load, preview=None, profile=False):
+        """
+        :param key: 読み込むデータセットを表すキー。
+        :param load: このBackgroundLoadを受け取って結果を返す関数。cancelledを確認し、取り消されたらLoadCancelledを送出します。
+        :param preview: 引数なしでプレビューを返す関数。Noneの場合はプレビューを作成しません。
+        :param profile: スレッドの中の各段階を計測するかどうか。
+        """
+        self.key = key
+        self.cancelled = threading.Event()
+        self.preview = None
+        # 読み込んだ割合（0から1）。load関数が更新します。分からない場合はNoneです。
+        self.progress = None
+        self._result = None
+        self._error = None
+        # スレッドの中で計測した段階ごとの結果。読み込みが終わった後に設定します。
+        self.records = []
+        self._thread = threading.Thread(target=self._run, args=(load, preview, profile), name=f'load-{key}',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, load, preview, profile):
+        # Profilerはスレッドごとに保持されるため、再実行のスレッドのProfilerはこのスレッドからは見えません。
+        # このスレッドのProfilerを作り、読み込み関数の中でprofiling.current()が返すようにします。
+        profiler = profiling.begin(profile)
+        try:
+            if preview is not None:
+                with profiler.stage('preview'):
+                    self.preview = preview()
+            if not self.cancelled.is_set():
+                self._result = load(self)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self._error = e
+        finally:
+            profiler.close()
+            self.records = profiler.records
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """
+        この関数は読み込みが終わるまで、最大timeout秒待ちます。
+        :return: 読み込みが終わったかどうか。
+        """
+        self._thread.join(timeout)
+        return self.done
+
+    def cancel(self):
+        """
+        この関数は読み込みの取り消しを要求します。load関数が次にcancelledを確認した時点で中断されます。
+        """
+        self.cancelled.set()
+
+    def result(self):
+        """
+        この関数は読み込みの結果を返します。読み込み中に例外が発生した場合は、その例外を送出します。
+        :return: load関数が返した値。取り消された場合はNone。
+        """
+        if self._error is not None:
+            raise self._error
+        return self._result
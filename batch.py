@@ -0,0 +1,144 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+# プレビューの横幅（ピクセル）。間引きの区間数にも使います。
+PREVIEW_WIDTH = 1000
+
+
+def find_captures(patterns):
+    """
+    この関数はディレクトリまたはglobパターンから処理するCSVファイルの一覧を作成します。
+    :param patterns: ディレクトリ、ファイル、またはglobパターンのリスト。
+    :return: 重複を除いて並べ替えたファイルパスのリスト。
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                if name.lower().endswith('.csv'):
+                    paths.add(os.path.abspath(os.path.join(pattern, name)))
+        else:
+            paths.update(os.path.abspath(p) for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(paths)
+
+
+def preview_paths(paths, out_dir, fmt):
+    """
+    この関数は各CSVファイルのプレビューを書き出すパスを決めます。
+    オシロスコープのファイル名はほとんどがTEK0000N.CSVなので、ファイル名だけでは別のディレクトリのファイルと重なります。
+    そこで、すべてのファイルに共通するディレクトリからの相対パスを、出力先のディレクトリの下に再現します。
+    :param paths: CSVファイルへの絶対パスのリスト。
+    :param out_dir: プレビューを書き出すディレクトリ。
+    :param fmt: プレビューの形式（htmlまたはpng）。
+    :return: CSVファイルのパスをキー、プレビューのパスを値とする辞書。
+    :raises ValueError: 大文字と小文字しか違わないなど、プレビューのパスが重なる場合。
+    """
+    root = os.path.commonpath([os.path.dirname(p) for p in paths])
+    previews = {}
+    seen = {}
+    for path in paths:
+        preview = os.path.join(out_dir, os.path.relpath(path, root) + '.' + fmt)
+        # 大文字と小文字を区別しないファイルシステムでも上書きしないように、比較は小文字で行います。
+        other = seen.setdefault(os.path.normcase(preview).lower(), path)
+        if other != path:
+            raise ValueError(f'プレビューのファイル名が重なります: {other} と {path}')
+        previews[path] = preview
+    return previews
+
+
+def process_capture(path, preview, fmt):
+    """
+    この関数は1つのCSVファイルを処理します。ワーカープロセスで実行されます。
+    サイドカーへの変換、統計量と波形の測定値の計算、間引いたプレビューの書き出しを行います。
+    :param path: CSVファイルへのパス。
+    :param preview: プレビューを書き出すパス。
+    :param fmt: プレビューの形式（htmlまたはpng）。
+    :return: チャンネルごとの統計量と測定値の行のリスト。
+    """
+    # Streamlitなどの重いモジュールは、ワーカープロセスの中でだけ読み込みます。
+    from decimation import build_pyramids
+    from demo8E import plot_data
+    from measurements import measurement_table
+    from sidecar import read_capture
+    from stats_index import build_stats
+
+    # ファイルごとにプロセスで並列にしているので、1つのファイルの解析は1つのスレッドで行います。
+    store = read_capture(path, workers=1)
+    stats = build_stats(store.channels)
+    pyramids = build_pyramids(store)
+
+    fig = plot_data(store, store.names, None, None, None, pyramids=pyramids)
+    fig.update_layout(title_text=os.path.basename(path), width=PREVIEW_WIDTH)
+    os.makedirs(os.path.dirname(preview), exist_ok=True)
+    if fmt == 'html':
+        fig.write_html(preview, include_plotlyjs='cdn')
+    else:
+        fig.write_image(preview)
+
+    # 周波数や立ち上がり時間などの測定値も、ファイル全体について計算します。
+    measured = measurement_table(store, stats, store.names)
+    duration = float(store.time[-1] - store.time[0]) if len(store) else 0.0
+    rows = []
+    for i, (name, total) in enumerate(zip(store.names, stats.totals)):
+        rows.append({'file': path, 'preview': preview, 'channel': name, 'rows': len(store), 'duration': duration,
+                     **total, **measured.iloc[i].to_dict()})
+    return rows
+
+
+def main(argv=None):
+    """
+    メイン関数。複数のCSVファイルをプロセスプールで並列に処理します。
+    :param argv: コマンドライン引数。Noneの場合はsys.argvを使います。
+    :return: 終了コード。失敗したファイルがあれば1。
+    """
+    parser = argparse.ArgumentParser(description='オシロスコープのCSVファイルをまとめて処理します。')
+    parser.add_argument('inputs', nargs='+', help='ディレクトリ、ファイル、またはglobパターン（例: "data/TEK*.CSV"）')
+    parser.add_argument('-o', '--out', default='batch_output', help='プレビューと集計結果を書き出すディレクトリ')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='ワーカープロセスの数')
+    parser.add_argument('--format', choices=['html', 'png'], default='html', help='プレビューの形式（pngにはkaleidoが必要です）')
+    args = parser.parse_args(argv)
+
+    paths = find_captures(args.inputs)
+    if not paths:
+        print('処理するファイルが見つかりませんでした。', file=sys.stderr)
+        return 1
+    try:
+        previews = preview_paths(paths, args.out, args.format)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    rows = []
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_capture, path, previews[path], args.format): path for path in paths}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                rows.extend(future.result())
+                status = 'ok'
+            except Exception as e:
+                # 壊れたファイルがあっても、残りのファイルの処理は続けます。
+                failures.append({'file': path, 'error': repr(e), 'traceback': traceback.format_exc()})
+                status = f'失敗: {e}'
+            print(f'[{done}/{len(paths)}] {path}: {status}', flush=True)
+
+    pd.DataFrame(rows).to_csv(os.path.join(args.out, 'summary.csv'), index=False)
+    if failures:
+        pd.DataFrame(failures).to_csv(os.path.join(args.out, 'failures.csv'), index=False)
+    elapsed = time.perf_counter() - start
+    print(f'{len(paths) - len(failures)}/{len(paths)} 件のファイルを {elapsed:.1f} 秒で処理しました。')
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
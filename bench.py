@@ -0,0 +1,206 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+# 合成データの前置き部分。実際のTektronixのCSVと同じくShift-JISで書き込みます。
+PREAMBLE = [
+    'モデル,MDO34',
+    'ファームウェア バージョン,1.000',
+    '',
+    'ポイント・フォーマット,Y',
+    '水平単位,s',
+    '水平スケール,1E-03',
+    'サンプル間隔,{dt}',
+    'フィルタ周波数,2E+08',
+    'レコード長,{n_rows}',
+    'ゲート,0.0%,100.0%',
+    'プローブ減衰,1,1,1,1',
+    '垂直単位,V,V,V,V',
+    '垂直オフセット,0,0,0,0',
+    '垂直スケール,1,0.5,2,1',
+    '垂直位置,0,0,0,0',
+]
+
+# 1回に書き込む行数。大きなファイルでもメモリを使いすぎないようにします。
+WRITE_CHUNK_ROWS = 1_000_000
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# 合成CSVファイルの形式のバージョン。形式を変えたときは数字を上げ、古いファイルは作り直します。
+CAPTURE_VERSION = 2
+
+
+def time_format(n_rows, dt):
+    """
+    この関数はTIME列の書式を返します。有効数字は、最も大きな時刻でもサンプル間隔の1/10まで表せる桁数にします。
+    桁数が足りないと、連続する行が同じ時刻になり、実際の波形データと異なってしまいます。
+    :param n_rows: データの行数。
+    :param dt: サンプル間隔（秒）。
+    """
+    t_max = max(n_rows // 2, 1) * dt
+    digits = max(math.ceil(math.log10(t_max / (dt / 10))), 7)
+    return f'%.{digits - 1}e'
+
+
+def write_capture(path, n_rows, header_row=16, dt=1e-8, seed=0):
+    """
+    この関数はデモが想定する形式の合成CSVファイルを書き込みます。
+    :param path: 書き込むファイルのパス。
+    :param n_rows: データの行数。
+    :param header_row: TIMEのヘッダー行の行番号（1始まり）。
+    :param dt: サンプル間隔（秒）。
+    :param seed: 乱数のシード。
+    """
+    preamble = [line.format(dt=dt, n_rows=n_rows) for line in PREAMBLE]
+    preamble = (preamble + [''] * header_row)[:header_row - 1]
+    rng = np.random.default_rng(seed)
+    fmt = [time_format(n_rows, dt), '%.4f', '%.4f', '%.4f', '%.4f']
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(('\r\n'.join(preamble) + '\r\n').encode('shift-jis'))
+        f.write(b'TIME,CH1,CH2,CH3,CH4\r\n')
+        for offset in range(0, n_rows, WRITE_CHUNK_ROWS):
+            i = np.arange(offset, min(offset + WRITE_CHUNK_ROWS, n_rows))
+            t = (i - n_rows // 2) * dt
+            data = np.column_stack([
+                t,
+                np.sign(np.sin(2 * np.pi * 1e4 * t)) + rng.normal(0, 0.02, len(i)),
+                np.sin(2 * np.pi * 5e3 * t),
+                2 * np.cos(2 * np.pi * 2e3 * t),
+                rng.normal(0, 0.1, len(i)),
+            ])
+            np.savetxt(f, data, fmt=fmt, delimiter=',', newline='\r\n')
+    os.replace(tmp, path)
+
+
+def capture_path(data_dir, n_rows, header_row):
+    """
+    この関数は合成CSVファイルのパスを返します。なければ作成します。
+    :param data_dir: 合成CSVファイルを置くディレクトリ。
+    :param n_rows: データの行数。
+    :param header_row: TIMEのヘッダー行の行番号（1始まり）。
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'bench_{n_rows}_h{header_row}_v{CAPTURE_VERSION}.csv')
+    if not os.path.exists(path):
+        print(f'{path} を作成しています...', flush=True)
+        write_capture(path, n_rows, header_row)
+    return path
+
+
+def timed(func, *args, **kwargs):
+    """
+    この関数は関数を実行し、結果と経過時間（秒）を返します。
+    """
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def bench_size(path, repeat=3, workers=None):
+    """
+    この関数は読み込みからプロットまでの各段階を別々に計測します。
+    各段階はrepeat回実行し、最も速い時間を使います。
+    :param path: 合成CSVファイルのパス。
+    :param repeat: 繰り返し回数。
+    :param workers: read_channel_storeの解析に使うスレッドの数。Noneの場合はCPUの数です。
+    :return: 段階ごとの時間（秒）とデータの大きさの辞書。
+    """
+    from decimation import build_pyramids
+    from demo8E import plot_data
+    from stats_index import build_stats
+    from tek_loader import read_channel_store, read_csv_file
+    from time_window import split_window, window_indices
+
+    results = {'file_bytes': os.path.getsize(path)}
+    timings = {}
+
+    def record(name, func, *args, **kwargs):
+        best = None
+        for _ in range(repeat):
+            result, elapsed = timed(func, *args, **kwargs)
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        return result
+
+    record('read_csv_file', read_csv_file, path)
+    record('read_channel_store_serial', read_channel_store, path, workers=1)
+    store = record('read_channel_store', read_channel_store, path, workers=workers)
+    results['rows'] = len(store)
+    pyramids = record('build_pyramids', build_pyramids, store)
+    record('build_stats', build_stats, store.channels)
+
+    t_mid = float(store.time[len(store) // 2])
+    record('window_indices', window_indices, store.time, t_mid, t_mid + 1e-5)
+    window = record('split_window', split_window, store.time, 3, 1)
+
+    fig = record('plot_data', plot_data, store, store.names, 'CH4', None, None, 'MinMax', None, window, pyramids)
+    payload = record('to_json', fig.to_json)
+    results['payload_bytes'] = len(payload)
+    results['points'] = sum(len(trace.x) for trace in fig.data)
+    results['timings_s'] = timings
+    return results
+
+
+def environment():
+    """
+    この関数は結果を比較するための実行環境の情報を返します。
+    """
+    import pandas as pd
+    import plotly
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    """
+    メイン関数。合成データで読み込みからプロットまでを計測し、結果をJSONファイルに書き出します。
+    :param argv: コマンドライン引数。Noneの場合はsys.argvを使います。
+    """
+    parser = argparse.ArgumentParser(description='読み込みからプロットまでの処理時間を合成データで計測します。')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='データの行数（例: 10000 50000000）')
+    parser.add_argument('--header-row', type=int, choices=[14, 16], default=16, help='TIMEのヘッダー行の行番号')
+    parser.add_argument('--repeat', type=int, default=3, help='各段階の繰り返し回数')
+    parser.add_argument('--workers', type=int, default=None, help='CSVの解析に使うスレッドの数（省略時はCPUの数）')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tek_bench'),
+                        help='合成CSVファイルを置くディレクトリ')
+    parser.add_argument('-o', '--out', default='bench_results.json', help='結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment(), 'header_row': args.header_row, 'results': []}
+    for n_rows in args.sizes:
+        path = capture_path(args.data_dir, n_rows, args.header_row)
+        result = bench_size(path, args.repeat, args.workers)
+        report['results'].append(result)
+        stages = ', '.join(f'{k}={v * 1e3:.1f}ms' for k, v in result['timings_s'].items())
+        print(f"{n_rows:>12,} rows: {stages}, payload={result['payload_bytes'] / 1e3:.0f}kB", flush=True)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f'結果を {args.out} に書き出しました。')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import numpy as np
+
+from channel_store import ChannelStore
+from demo8E import plot_data
+from figure_cache import ENCODINGS, payload_size
+
+
+def make_store(n_rows):
+    """
+    この関数はベンチマーク用の4チャンネルのデータを作成します。
+    :param n_rows: 行数。
+    :return: CH1〜CH4を持つChannelStore。
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(n_rows) * 1e-8
+    channels = [
+        np.sign(np.sin(2 * np.pi * 1e4 * t)) + rng.normal(0, 0.02, n_rows),
+        np.sin(2 * np.pi * 5e3 * t),
+        2 * np.cos(2 * np.pi * 2e3 * t),
+        rng.normal(0, 0.1, n_rows),
+    ]
+    return ChannelStore(t, [ch.astype(np.float32) for ch in channels], ['CH1', 'CH2', 'CH3', 'CH4'])
+
+
+def bench(n_rows, renderer, encoding='Float64', repeat=3):
+    """
+    この関数は間引きなしでplot_dataを実行し、図の作成時間とブラウザに送るデータの大きさを測ります。
+    :param n_rows: 行数。
+    :param renderer: 描画方法（SVGまたはWebGL）。
+    :param encoding: トレースの配列の送り方（Float64, Compact）。
+    :param repeat: 繰り返し回数。最も速い結果を使います。
+    :return: 結果の辞書。
+    """
+    store = make_store(n_rows)
+    build_times = []
+    json_times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fig = plot_data(store, store.names, 'CH4', (-2, 2), (-1, 1), method='None', renderer=renderer,
+                        encoding=encoding)
+        t1 = time.perf_counter()
+        payload_bytes, json_s = payload_size(fig)
+        build_times.append(t1 - t0)
+        json_times.append(json_s)
+    return {
+        'rows': n_rows,
+        'renderer': renderer,
+        'encoding': encoding,
+        'trace_type': fig.data[0].type,
+        'build_s': min(build_times),
+        'to_json_s': min(json_times),
+        'payload_bytes': payload_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='描画方法とトレースの配列の送り方について、図の作成時間とデータの大きさを比較します。')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--encodings', nargs='+', choices=ENCODINGS, default=ENCODINGS)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'renderer':>8} {'encoding':>8} {'type':>10} {'build[s]':>9} {'to_json[s]':>11} "
+          f"{'payload[MB]':>12}")
+    for n_rows in args.rows:
+        for renderer in ['SVG', 'WebGL']:
+            for encoding in args.encodings:
+                r = bench(n_rows, renderer, encoding, args.repeat)
+                print(f"{r['rows']:>10,} {r['renderer']:>8} {r['encoding']:>8} {r['trace_type']:>10} "
+                      f"{r['build_s']:>9.3f} {r['to_json_s']:>11.3f} {r['payload_bytes'] / 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
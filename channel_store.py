@@ -0,0 +1,224 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 保存形式のバージョン。形式を変えたときは数字を上げ、古いファイルは読み直します。
+STORE_VERSION = 2
+
+# チャンネルはADCの分解能(8〜12bit)に対して十分な精度を持つfloat32で保持します。
+# TIMEは小さなサンプル間隔を大きなオフセットに足すため、float64のままにします。
+CHANNEL_DTYPE = np.float32
+TIME_DTYPE = np.float64
+
+
+class UniformTime:
+    """
+    このクラスは等間隔にサンプリングされたTIME列を、配列を持たずにt0 + i * dtとして表します。
+    NumPy配列と同じようにインデックスやスライスで値を取り出せ、np.searchsortedは計算で求めます。
+    スライスしても元のiとt0, dtから計算するため、元の配列と同じ値になります。
+    """
+
+    dtype = np.dtype(TIME_DTYPE)
+    ndim = 1
+    nbytes = 0
+
+    def __init__(self, t0, dt, n, start=0, step=1):
+        """
+        :param t0: 最初のサンプルの時刻（秒）。
+        :param dt: サンプル間隔（秒）。
+        :param n: サンプル数。
+        :param start: スライスしたときの、元のTIME列での最初のサンプルの番号。
+        :param step: スライスしたときの、元のTIME列でのサンプル番号の間隔。
+        """
+        self.t0 = float(t0)
+        self.dt = float(dt)
+        self.n = int(n)
+        self.start = int(start)
+        self.step = int(step)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n,)
+
+    def _values(self, i):
+        # iはこのオブジェクトでのサンプル番号。元のTIME列での番号に直してから時刻を計算します。
+        return self.t0 + (self.start + i * self.step) * self.dt
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            r = range(self.n)[key]
+            return UniformTime(self.t0, self.dt, len(r), self.start + r.start * self.step, r.step * self.step)
+        if isinstance(key, (int, np.integer)):
+            return TIME_DTYPE(self._values(range(self.n)[key]))
+        idx = np.asarray(key)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        idx = np.where(idx < 0, idx + self.n, idx)
+        return self._values(idx.astype(np.int64)).astype(TIME_DTYPE)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._values(np.arange(self.n, dtype=np.int64)).astype(TIME_DTYPE)
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def searchsorted(self, v, side='left', sorter=None):
+        """
+        この関数はnp.searchsortedと同じ結果を、配列を作らずに計算で求めます。
+        計算誤差で1つずれることがあるため、前後の値と比べて補正します。
+        """
+        v = np.asarray(v, dtype=TIME_DTYPE)
+        if self.n == 0 or self.dt * self.step <= 0:
+            return np.searchsorted(np.asarray(self), v, side)
+        x = np.clip((v - self._values(0)) / (self.dt * self.step), -1, self.n + 1)
+        x = np.where(np.isnan(v), self.n, x)
+        if side == 'left':
+            # time[i] >= vとなる最初のi。
+            i = np.clip(np.ceil(x), 0, self.n).astype(np.int64)
+            i = np.where((i > 0) & (self._values(i - 1) >= v), i - 1, i)
+            i = np.where((i < self.n) & (self._values(i) < v), i + 1, i)
+        else:
+            # time[i] > vとなる最初のi。
+            i = np.clip(np.floor(x) + 1, 0, self.n).astype(np.int64)
+            i = np.where((i > 0) & (self._values(i - 1) > v), i - 1, i)
+            i = np.where((i < self.n) & (self._values(i) <= v), i + 1, i)
+        return i if i.ndim else i.item()
+
+
+class ChannelStore:
+    """
+    このクラスはTIMEと各チャンネルのデータを、列ごとのコンパクトなNumPy配列として保持します。
+    配列はメモリ上にあっても、メモリマップされたファイルでも構いません。
+    チャンネルの表示名は画面側で持つため、名前の変更でデータがコピーされることはありません。
+    """
+
+    def __init__(self, time, channels, names, meta=None):
+        """
+        :param time: TIMEの配列、またはUniformTime。
+        :param channels: 各チャンネルの配列のリスト。
+        :param names: 各チャンネルの元の列名（CH1など）のリスト。
+        :param meta: ヘッダーなどのメタデータの辞書。
+        """
+        self.time = time
+        self.channels = list(channels)
+        self.names = list(names)
+        self.meta = dict(meta or {})
+
+    @classmethod
+    def from_frame(cls, df, dtype=CHANNEL_DTYPE, meta=None):
+        """
+        この関数はread_csv_fileが返したDataFrameからChannelStoreを作成します。
+        :param df: 先頭の列がTIMEのDataFrame。
+        :param dtype: チャンネルのデータ型。
+        :param meta: ヘッダーなどのメタデータの辞書。
+        """
+        time = df.iloc[:, 0].to_numpy(dtype=TIME_DTYPE)
+        channels = [df[col].to_numpy(dtype=dtype) for col in df.columns[1:]]
+        return cls(time, channels, df.columns[1:], meta)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + sum(ch.nbytes for ch in self.channels)
+
+    @property
+    def columns(self):
+        return ['TIME'] + self.names
+
+    def slice(self, start, stop):
+        """
+        この関数は[start, stop)の行だけを持つChannelStoreを返します。
+        配列のスライスはビューなので、データはコピーされません。
+        :param start: 範囲の最初のインデックス。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        """
+        return ChannelStore(self.time[start:stop], [ch[start:stop] for ch in self.channels], self.names, self.meta)
+
+    def to_frame(self, labels=None):
+        """
+        この関数はデータをコピーせずにDataFrameとして返します。
+        :param labels: チャンネルの表示名のリスト。Noneの場合は元の列名を使います。
+        """
+        labels = self.names if labels is None else labels
+        columns = {'TIME': np.asarray(self.time)}
+        columns.update(zip(labels, self.channels))
+        return pd.DataFrame(columns, copy=False)
+
+    def save(self, directory, **extra_meta):
+        """
+        この関数は列ごとの.npyファイルとmeta.jsonをディレクトリに書き込みます。
+        :param directory: 書き込むディレクトリ。なければ作成します。
+        :param extra_meta: meta.jsonに追加で書き込む値。
+        """
+        os.makedirs(directory, exist_ok=True)
+        # 等間隔のTIMEは配列を書き込まず、t0とdtだけをmeta.jsonに書き込みます。
+        uniform = isinstance(self.time, UniformTime)
+        if not uniform:
+            np.save(os.path.join(directory, '0.npy'), self.time)
+        for i, channel in enumerate(self.channels, start=1):
+            np.save(os.path.join(directory, f'{i}.npy'), channel)
+        meta = {
+            'version': STORE_VERSION,
+            'columns': self.columns,
+            'dtypes': [self.time.dtype.name] + [ch.dtype.name for ch in self.channels],
+            'rows': len(self),
+            'uniform_time': vars(self.time) if uniform else None,
+            'meta': self.meta,
+            **extra_meta,
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        この関数はsaveで書き込んだディレクトリを読み込みます。
+        mmapがTrueの場合、データは必要になったときにディスクから読み込まれます。
+        :param directory: saveで書き込んだディレクトリ。
+        :param mmap: メモリマップで開くかどうか。
+        :return: ChannelStore。ファイルがない場合や形式が古い場合はNone。
+        """
+        meta = read_store_meta(directory)
+        if meta is None:
+            return None
+        mmap_mode = 'r' if mmap else None
+        channels = [
+            np.load(os.path.join(directory, f'{i}.npy'), mmap_mode=mmap_mode)
+            for i in range(1, len(meta['columns']))
+        ]
+        uniform = meta.get('uniform_time')
+        if uniform:
+            time = UniformTime(**uniform)
+        else:
+            time = np.load(os.path.join(directory, '0.npy'), mmap_mode=mmap_mode)
+        return cls(time, channels, meta['columns'][1:], meta.get('meta'))
+
+    def spill(self, directory):
+        """
+        この関数はデータをディレクトリに書き込み、メモリマップで開き直したChannelStoreを返します。
+        多くのセッションで同時に使うとき、プロセスのメモリ使用量を抑えられます。
+        :param directory: 書き込むディレクトリ。
+        """
+        self.save(directory)
+        return ChannelStore.load(directory, mmap=True)
+
+
+def read_store_meta(directory):
+    """
+    この関数はsaveで書き込んだディレクトリのmeta.jsonを読み込みます。
+    :param directory: saveで書き込んだディレクトリ。
+    :return: メタデータの辞書。ファイルがない場合や形式が古い場合はNone。
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != STORE_VERSION:
+        return None
+    return meta
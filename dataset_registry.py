@@ -0,0 +1,295 @@
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from channel_store import ChannelStore
+from decimation import decimation_cache, pyramid_cache, rebind_pyramids
+from events import event_cache
+from figure_cache import trace_cache
+from filters import filter_cache
+from measurements import measurement_cache
+from spectrum import spectrum_cache
+from stats_index import rebind_stats, stats_cache
+from tek_cache import DEFAULT_MAX_MB
+
+# 登録と追い出しの状況を出力するロガー。
+logger = logging.getLogger('tek.registry')
+
+
+# データセットのキーを含むキーで、データセットから計算した結果を保持するキャッシュ。
+# データセットを追い出すときは、これらのキャッシュからも取り除き、メモリを確実に解放します。
+DERIVED_CACHES = [pyramid_cache, stats_cache, filter_cache, event_cache, measurement_cache, decimation_cache,
+                  trace_cache, spectrum_cache]
+
+
+def resident_nbytes(store):
+    """
+    この関数はChannelStoreのうち、プロセスのメモリ上にある配列のバイト数を返します。
+    メモリマップで開いた配列と、UniformTimeは含めません。
+    """
+    arrays = [store.time] + list(store.channels)
+    return sum(a.nbytes for a in arrays if isinstance(a, np.ndarray) and not isinstance(a, np.memmap))
+
+
+def _make_read_only(store):
+    # 複数のセッションで共有するため、配列を書き換えられないようにします。
+    for array in [store.time] + list(store.channels):
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+
+
+class DatasetHandle:
+    """
+    このクラスは1つのセッションが使っているデータセットを表します。
+    ハンドルが有効な間は参照カウントに数えられ、データセットはレジストリから削除されません。
+    セッションが終了してハンドルがガベージコレクションされた場合も、参照カウントから外れます。
+    """
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    @property
+    def store(self):
+        """
+        この関数は共有されている読み取り専用のChannelStoreを返します。
+        メモリの上限を超えてディスクに書き出された後は、メモリマップで開いたものを返します。
+        """
+        return self.registry.get(self.key)
+
+    def close(self):
+        self.registry.release(self)
+
+
+class _Entry:
+    def __init__(self, store):
+        self.store = store
+        self.nbytes = resident_nbytes(store)
+        self.handles = weakref.WeakSet()
+        # ディスクに書き出し中かどうかと、書き出したディレクトリ。
+        self.spilling = False
+        self.directory = None
+
+
+class DatasetRegistry:
+    """
+    このクラスはプロセス全体で共有するデータセットのレジストリです。内容のハッシュをキーとし、
+    同じファイルを開いた複数のセッションは、1つの読み取り専用のChannelStoreを共有します。
+    メモリ上のデータの合計が上限を超えると、最も長く使われていないデータセットから、
+    spill_dirがあればディスクに書き出してメモリマップで開き直し、なければ使っているセッションがないものを削除します。
+    """
+
+    def __init__(self, max_mb=DEFAULT_MAX_MB, spill_dir=None):
+        """
+        :param max_mb: メモリ上に保持するデータの合計サイズの上限（MB）。
+        :param spill_dir: 追い出したデータセットを書き出すディレクトリ。Noneの場合は書き出しません。
+        """
+        self.max_bytes = max_mb * 1024 * 1024
+        self.spill_dir = spill_dir
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        # キーごとの読み込み中のロック。同じファイルを同時に開いたセッションが、二重に解析しないようにします。
+        self._loading = {}
+        self._counts = {'hits': 0, 'misses': 0, 'spills': 0, 'evictions': 0}
+        # 書き出すディレクトリはプロセスごとに分け、終了時に削除します。
+        self._spill_root = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def resident_bytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def open(self, key, loader):
+        """
+        この関数はデータセットのハンドルを返します。登録されていなければloaderで読み込んで登録します。
+        :param key: データセットを表すキー（内容のハッシュ）。
+        :param loader: 引数なしでChannelStoreを返す関数。
+        :return: DatasetHandle。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._counts['hits'] += 1
+                return self._attach(key, entry)
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # 解析は時間がかかるので、全体のロックを外して、キーごとのロックだけを持って行います。
+        with loading:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # 他のセッションが先に読み込みました。
+                    self._counts['hits'] += 1
+                    return self._attach(key, entry)
+            try:
+                store = loader()
+                _make_read_only(store)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            # 読み込み中のロックを外すのと登録を同時に行い、その間に他のセッションが解析を始めないようにします。
+            with self._lock:
+                self._loading.pop(key, None)
+                self._counts['misses'] += 1
+                entry = self._entries[key] = _Entry(store)
+                handle = self._attach(key, entry)
+                pending = self._evict()
+        self._spill(pending)
+        return handle
+
+    def _attach(self, key, entry):
+        self._entries.move_to_end(key)
+        handle = DatasetHandle(self, key)
+        entry.handles.add(handle)
+        return handle
+
+    def get(self, key):
+        """
+        この関数はキーに対応するChannelStoreを返し、最近使ったものとして記録します。見つからない場合はNoneです。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.store
+
+    def release(self, handle):
+        """
+        この関数はハンドルを参照カウントから外します。メモリの上限を超えていれば追い出します。
+        """
+        with self._lock:
+            entry = self._entries.get(handle.key)
+            if entry is not None:
+                entry.handles.discard(handle)
+            pending = self._evict()
+        self._spill(pending)
+
+    def refcount(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return 0 if entry is None else len(entry.handles)
+
+    def _drop(self, key, entry):
+        """
+        この関数はデータセットをレジストリから削除します。ロックを持った状態で呼び出します。
+        ピラミッドや統計インデックスはチャンネルの配列を参照し、フィルタの結果などはデータセットと同じくらい大きいので、
+        データセットから計算した結果もキャッシュから一緒に削除します。
+        """
+        del self._entries[key]
+        for cache in DERIVED_CACHES:
+            cache.discard_dataset(key)
+        if entry.directory is not None:
+            shutil.rmtree(entry.directory, ignore_errors=True)
+        self._counts['evictions'] += 1
+        logger.info('evicted %s (%d bytes)', key, entry.nbytes)
+
+    def _evict(self):
+        """
+        この関数はメモリ上のデータの合計が上限以下になるまで、古い順にデータセットを追い出します。
+        使っているセッションがあるデータセットは、ディスクに書き出せる場合だけ追い出します。
+        書き出したデータセットは、使っているセッションがなくなった時点で削除します。
+        ロックを持った状態で呼び出し、書き出しはロックを外してから_spillで行います。
+        :return: 書き出すデータセットの(キー, エントリ, ChannelStore)のリスト。
+        """
+        for key, entry in list(self._entries.items()):
+            if entry.directory is not None and not entry.handles:
+                self._drop(key, entry)
+
+        pending = []
+        resident = sum(entry.nbytes for entry in self._entries.values() if not entry.spilling)
+        for key, entry in list(self._entries.items()):
+            if resident <= self.max_bytes:
+                break
+            if entry.nbytes == 0 or entry.spilling:
+                continue
+            if self.spill_dir is not None:
+                entry.spilling = True
+                pending.append((key, entry, entry.store))
+                resident -= entry.nbytes
+            elif not entry.handles:
+                self._drop(key, entry)
+                resident -= entry.nbytes
+        return pending
+
+    def _spill(self, pending):
+        """
+        この関数はデータセットを列ごとのファイルに書き出し、メモリマップで開き直します。
+        書き出しはデータの大きさに比例して時間がかかるため、ロックを外して行い、他のセッションを待たせません。
+        キャッシュにあるピラミッドと統計インデックスも新しい配列を参照するように切り替えるため、元の配列は、
+        まだ使っている再実行が終わった時点で解放されます。
+        :param pending: _evictが返したリスト。
+        """
+        for key, entry, store in pending:
+            directory = os.path.join(self._spill_directory(), key)
+            try:
+                store.save(directory)
+                spilled = ChannelStore.load(directory, mmap=True)
+            except OSError:
+                logger.exception('failed to spill %s to %s', key, directory)
+                shutil.rmtree(directory, ignore_errors=True)
+                with self._lock:
+                    entry.spilling = False
+                continue
+            with self._lock:
+                entry.spilling = False
+                if self._entries.get(key) is not entry:
+                    # 書き出している間に削除されました。
+                    shutil.rmtree(directory, ignore_errors=True)
+                    continue
+                nbytes = entry.nbytes
+                entry.store = spilled
+                entry.nbytes = resident_nbytes(spilled)
+                entry.directory = directory
+                self._counts['spills'] += 1
+            rebind_pyramids(spilled, key)
+            rebind_stats(spilled.channels, key)
+            logger.info('spilled %s (%d bytes) to %s', key, nbytes, directory)
+
+    def _spill_directory(self):
+        with self._lock:
+            if self._spill_root is None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self._spill_root = tempfile.mkdtemp(prefix=f'registry-{os.getpid()}-', dir=self.spill_dir)
+            return self._spill_root
+
+    def close(self):
+        """
+        この関数はこのプロセスが書き出したファイルをすべて削除します。プロセスの終了時に呼ばれます。
+        """
+        with self._lock:
+            if self._spill_root is not None:
+                shutil.rmtree(self._spill_root, ignore_errors=True)
+                self._spill_root = None
+
+    def metrics(self):
+        """
+        この関数はレジストリの状況を返します。
+        :return: ヒット・ミス・書き出し・削除の回数、データセットの数、参照しているセッションの数、メモリ上のバイト数の辞書。
+        """
+        with self._lock:
+            return {
+                **self._counts,
+                'datasets': len(self._entries),
+                'on_disk': sum(1 for entry in self._entries.values() if entry.directory is not None),
+                'sessions': sum(len(entry.handles) for entry in self._entries.values()),
+                'resident_mb': self.resident_bytes / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+            }
+
+
+# Streamlitの再実行ではインポート済みのモジュールは再読み込みされないため、
+# このインスタンスはプロセス内のすべてのセッションで共有されます。
+# TEK_STORE_DIRを指定すると、上限を超えたデータセットをそのディレクトリに書き出します。
+dataset_registry = DatasetRegistry(spill_dir=os.environ.get('TEK_STORE_DIR'))
+atexit.register(dataset_registry.close)
@@ -0,0 +1,323 @@
+import numpy as np
+
+from channel_store import UniformTime
+from tek_cache import ParseCache
+
+# 間引きの方法。
+METHODS = ['MinMax', 'LTTB', 'None']
+
+# 間引き後のインデックスを保持するキャッシュ。インデックスは小さいので上限も小さくします。
+decimation_cache = ParseCache(max_mb=64)
+
+# チャンネルごとのMinMaxPyramidを保持するキャッシュ。
+pyramid_cache = ParseCache(max_mb=256)
+
+
+def minmax_indices(y, n_buckets):
+    """
+    この関数はデータをn_buckets個の区間に分け、各区間の最小値と最大値の位置を返します。
+    ピークやグリッチは必ずどこかの区間の最小値か最大値になるため、失われません。
+    :param y: 間引くデータ（1次元のNumPy配列）。
+    :param n_buckets: 区間の数（通常はグラフの幅のピクセル数）。
+    :return: 残す点のインデックス（昇順）。
+    """
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    # 割り切れる部分は2次元配列に変形して、区間ごとの最小・最大を一度に求めます。
+    size = n // n_buckets
+    m = size * n_buckets
+    blocks = y[:m].reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    parts = [offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1), [0, n - 1]]
+
+    # 割り切れずに残った部分は最後の区間として扱います。
+    if m < n:
+        tail = y[m:]
+        parts.append([m + tail.argmin(), m + tail.argmax()])
+
+    return np.unique(np.concatenate(parts))
+
+
+def lttb_indices(x, y, n_out):
+    """
+    この関数はLargest-Triangle-Three-Buckets法で残す点の位置を返します。
+    各区間で、前に選んだ点と次の区間の平均点とで作る三角形の面積が最大になる点を選びます。
+    :param x: X軸のデータ（1次元のNumPy配列）。
+    :param y: Y軸のデータ（1次元のNumPy配列）。
+    :param n_out: 間引き後の点の数。
+    :return: 残す点のインデックス（昇順）。
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # 最初と最後の点を除いた部分をn_out - 2個の区間に分けます。
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, stops = edges[:-1], edges[1:]
+
+    # 各区間の平均点は累積和を使ってまとめて計算します。
+    cx = np.concatenate([[0.0], np.cumsum(x, dtype=np.float64)])
+    cy = np.concatenate([[0.0], np.cumsum(y, dtype=np.float64)])
+    counts = stops - starts
+    avg_x = (cx[stops] - cx[starts]) / counts
+    avg_y = (cy[stops] - cy[starts]) / counts
+    # 最後の区間の「次の点」は最後のデータ点です。
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    # 前の区間で選んだ点に依存するため区間ごとに処理しますが、区間内の計算はベクトル化しています。
+    for i in range(n_out - 2):
+        bx = x[starts[i]:stops[i]]
+        by = y[starts[i]:stops[i]]
+        area = np.abs((x[a] - next_x[i]) * (by - y[a]) - (x[a] - bx) * (next_y[i] - y[a]))
+        a = starts[i] + int(area.argmax())
+        selected[i + 1] = a
+
+    return selected
+
+
+def decimate_indices(x, y, n_buckets, method='MinMax'):
+    """
+    この関数は指定した方法で残す点の位置を返します。
+    :param x: X軸のデータ。
+    :param y: Y軸のデータ。
+    :param n_buckets: 区間の数（通常はグラフの幅のピクセル数）。
+    :param method: 間引きの方法（METHODSのいずれか）。
+    :return: 残す点のインデックス（昇順）。
+    """
+    if method == 'MinMax':
+        return minmax_indices(y, n_buckets)
+    if method == 'LTTB':
+        # MinMaxと同じ点数になるように、区間ごとに2点分を割り当てます。
+        return lttb_indices(np.asarray(x), y, 2 * n_buckets)
+    if method == 'None':
+        return np.arange(len(y))
+    raise ValueError(f'不明な間引きの方法です: {method}')
+
+
+def decimate(x, y, n_buckets, method='MinMax', cache_key=None):
+    """
+    この関数はデータを間引いて、表示用のX軸とY軸のデータを返します。
+    cache_keyを指定した場合、間引いた結果のインデックスをキャッシュします。
+    :param x: X軸のデータ（pandasのSeries、NumPy配列、またはUniformTime）。
+    :param y: Y軸のデータ（pandasのSeriesまたはNumPy配列）。
+    :param n_buckets: 区間の数（通常はグラフの幅のピクセル数）。
+    :param method: 間引きの方法（METHODSのいずれか）。
+    :param cache_key: (データセット, 表示範囲, チャンネル)を表すキャッシュのキー。
+    :return: 間引いたX軸とY軸のNumPy配列。
+    """
+    # UniformTimeは残す点の時刻だけを計算するため、配列にしません。
+    if not isinstance(x, UniformTime):
+        x = np.asarray(x)
+    y = np.asarray(y)
+
+    key = None if cache_key is None else (cache_key, n_buckets, method)
+    idx = None if key is None else decimation_cache.get(key)
+    if idx is None:
+        idx = decimate_indices(x, y, n_buckets, method)
+        if key is not None:
+            decimation_cache.put(key, idx)
+
+    return x[idx], y[idx]
+
+
+class MinMaxPyramid:
+    """
+    このクラスは1つのチャンネルの最小値・最大値のピラミッド（多重解像度の要約）です。
+    レベルkでは、BASE_BLOCK * FACTOR**k サンプルごとの区間について、
+    最小値と最大値をとるサンプルの位置を保持します。
+    表示範囲に合ったレベルを選ぶことで、ズームのたびの計算量はサンプル数ではなくピクセル数に比例します。
+    """
+
+    # 最も細かいレベルの区間のサンプル数。
+    BASE_BLOCK = 64
+    # レベルが1つ上がるごとに区間が何倍になるか。
+    FACTOR = 4
+
+    def __init__(self, y):
+        """
+        :param y: チャンネルのデータ（1次元のNumPy配列）。
+        """
+        self.y = np.asarray(y)
+        self.block_sizes = []
+        self.min_idx = []
+        self.max_idx = []
+        self._build()
+
+    def extend(self, y):
+        """
+        この関数は末尾にデータが追加されたチャンネルに合わせてピラミッドを更新します。
+        新しく完成した区間だけを計算するため、計算量は追加されたサンプル数に比例します。
+        :param y: 追加後のチャンネルのデータ。追加前のデータと先頭部分が同じである必要があります。
+        """
+        self.y = np.asarray(y)
+        self._build()
+
+    def truncate(self, n):
+        """
+        この関数はn番目以降のサンプルを含む区間を取り除きます。
+        末尾のデータが書き換えられたチャンネルでは、truncateしてからextendすると、書き換えられた部分だけを計算し直せます。
+        :param n: 書き換えられていない先頭部分のサンプル数。
+        """
+        for level, size in enumerate(self.block_sizes):
+            keep = n // size
+            self.min_idx[level] = self.min_idx[level][:keep]
+            self.max_idx[level] = self.max_idx[level][:keep]
+
+    def _build(self):
+        # 各レベルで、まだ計算していない完成した区間だけを計算します。
+        n = len(self.y)
+        dtype = np.int32 if n < 2**31 else np.int64
+
+        # 最も細かいレベルは生のデータから作ります。
+        done = len(self.min_idx[0]) if self.min_idx else 0
+        n_blocks = n // self.BASE_BLOCK
+        if n_blocks > done:
+            blocks = self.y[done * self.BASE_BLOCK:n_blocks * self.BASE_BLOCK].reshape(-1, self.BASE_BLOCK)
+            offsets = np.arange(done, n_blocks, dtype=dtype) * self.BASE_BLOCK
+            self._add_blocks(0, offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1))
+
+        # 上のレベルは1つ下のレベルのFACTOR個の区間をまとめて作ります。
+        level = 0
+        while level < len(self.min_idx) and len(self.min_idx[level]) >= self.FACTOR:
+            done = len(self.min_idx[level + 1]) if level + 1 < len(self.min_idx) else 0
+            n_blocks = len(self.min_idx[level]) // self.FACTOR
+            if n_blocks > done:
+                lo = self.min_idx[level][done * self.FACTOR:n_blocks * self.FACTOR].reshape(-1, self.FACTOR)
+                hi = self.max_idx[level][done * self.FACTOR:n_blocks * self.FACTOR].reshape(-1, self.FACTOR)
+                rows = np.arange(n_blocks - done)
+                self._add_blocks(
+                    level + 1,
+                    lo[rows, self.y[lo].argmin(axis=1)],
+                    hi[rows, self.y[hi].argmax(axis=1)],
+                )
+            level += 1
+
+    def _add_blocks(self, level, min_idx, max_idx):
+        if level == len(self.block_sizes):
+            self.block_sizes.append(self.BASE_BLOCK * self.FACTOR**level)
+            self.min_idx.append(min_idx)
+            self.max_idx.append(max_idx)
+        else:
+            self.min_idx[level] = np.concatenate([self.min_idx[level], min_idx])
+            self.max_idx[level] = np.concatenate([self.max_idx[level], max_idx])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.min_idx) + sum(a.nbytes for a in self.max_idx)
+
+    def to_arrays(self):
+        """
+        この関数はファイルに保存するために、各レベルの最小値・最大値の位置の配列を辞書で返します。
+        :return: min_0, max_0, min_1, ... をキーとする配列の辞書。
+        """
+        arrays = {}
+        for level, (min_idx, max_idx) in enumerate(zip(self.min_idx, self.max_idx)):
+            arrays[f'min_{level}'] = min_idx
+            arrays[f'max_{level}'] = max_idx
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, y, arrays):
+        """
+        この関数はto_arraysで保存した配列からピラミッドを復元します。区間の計算はやり直しません。
+        :param y: チャンネルのデータ。
+        :param arrays: to_arraysが返した辞書、またはそれを保存した.npzファイル。
+        :return: MinMaxPyramid。
+        """
+        pyramid = cls.__new__(cls)
+        pyramid.y = np.asarray(y)
+        levels = len(arrays) // 2
+        pyramid.block_sizes = [cls.BASE_BLOCK * cls.FACTOR**level for level in range(levels)]
+        pyramid.min_idx = [arrays[f'min_{level}'] for level in range(levels)]
+        pyramid.max_idx = [arrays[f'max_{level}'] for level in range(levels)]
+        return pyramid
+
+    def _collect(self, level, start, stop, out):
+        """
+        この関数は[start, stop)の範囲を、指定したレベルの区間とその両端の細かい区間で覆います。
+        """
+        if stop <= start:
+            return
+        if level < 0:
+            # 最も細かいレベルより短い部分は生のデータをそのまま使います。
+            out.append(np.arange(start, stop))
+            return
+        size = self.block_sizes[level]
+        first = -(-start // size)
+        last = min(stop // size, len(self.min_idx[level]))
+        if first >= last:
+            self._collect(level - 1, start, stop, out)
+            return
+        self._collect(level - 1, start, first * size, out)
+        out.append(self.min_idx[level][first:last])
+        out.append(self.max_idx[level][first:last])
+        self._collect(level - 1, last * size, stop, out)
+
+    def query(self, start, stop, n_buckets):
+        """
+        この関数は[start, stop)の範囲を約n_buckets個の区間で要約した点の位置を返します。
+        :param start: 範囲の最初のインデックス。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        :param n_buckets: 区間の数（通常はグラフの幅のピクセル数）。
+        :return: 残す点のインデックス（昇順）。
+        """
+        start = max(int(start), 0)
+        stop = min(int(stop), len(self.y))
+        if stop - start <= 2 * n_buckets:
+            return np.arange(start, max(stop, start))
+
+        # 範囲内の区間の数がn_bucketsの2倍以下になる、最も細かいレベルを選びます。
+        level = len(self.block_sizes) - 1
+        for k, size in enumerate(self.block_sizes):
+            if (stop - start) // size <= 2 * n_buckets:
+                level = k
+                break
+
+        # 最も細かいレベルでも区間が多すぎない範囲は、生のデータから直接求めます。
+        if level == 0 and (stop - start) // self.block_sizes[0] < n_buckets // 2:
+            return start + minmax_indices(self.y[start:stop], n_buckets)
+
+        out = [np.array([start, stop - 1])]
+        self._collect(level, start, stop, out)
+        return np.unique(np.concatenate(out))
+
+
+def build_pyramids(store, cache_key=None, prebuilt=None):
+    """
+    この関数は各チャンネルについてMinMaxPyramidを作成します。
+    cache_keyを指定した場合、作成したピラミッドをキャッシュします。
+    :param store: ChannelStore。
+    :param cache_key: データセットを表すキー。
+    :param prebuilt: 読み込みながら作成したピラミッドの辞書。指定すると作り直さずにキャッシュに登録します。
+    :return: チャンネルの位置（0始まり）をキーとするMinMaxPyramidの辞書。
+    """
+    pyramids = {}
+    for i, channel in enumerate(store.channels):
+        key = None if cache_key is None else ('pyramid', cache_key, i)
+        pyramid = None if key is None else pyramid_cache.get(key)
+        if pyramid is None:
+            pyramid = MinMaxPyramid(channel) if prebuilt is None else prebuilt[i]
+            if key is not None:
+                pyramid_cache.put(key, pyramid)
+        pyramids[i] = pyramid
+    return pyramids
+
+
+def rebind_pyramids(store, cache_key):
+    """
+    この関数はキャッシュにあるピラミッドが、storeの配列を参照するように切り替えます。
+    データをディスクに書き出してメモリマップで開き直したときに、元の配列のメモリを解放するために使います。
+    :param store: 同じデータを持つChannelStore。
+    :param cache_key: データセットを表すキー。
+    """
+    for i, channel in enumerate(store.channels):
+        pyramid = pyramid_cache.get(('pyramid', cache_key, i))
+        if pyramid is not None:
+            pyramid.extend(channel)
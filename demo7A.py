@@ -1,29 +1,8 @@
-import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
-from plotly.subplots import make_subplots
-
-def read_csv_file(file):
-    """
-    この関数は特定の構造を持つCSVファイルを読み込みます。
-    :param file: CSVファイルへのパス。
-    :return: CSVファイルの内容を含むpandasのDataFrame。
-    """
-    # ヘッダー行を探します。
-    lines = file.getvalue().decode('shift-jis').splitlines()
-    for i, line in enumerate(lines, start=1):
-        if line.startswith('TIME'):
-            header_row = i - 1  # Pythonのインデックスは0から始まるため、1を引きます。
-            print(f'ヘッダー行は {i} 行目です。')
-            break
-    else:
-        raise ValueError('ヘッダー行が見つかりませんでした。')
-
-    # CSVファイルを読み込みます。
-    file.seek(0)
-    df = pd.read_csv(file, encoding="shift-jis", skiprows=range(header_row), header=0)
 
-    return df
+from tek_loader import read_csv_file
+from plotly.subplots import make_subplots
 
 def plot_data(df):
     """
@@ -1,30 +1,8 @@
-import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 
-def read_csv_file(file):
-    """
-    この関数は特定の構造を持つCSVファイルを読み込みます。
-    :param file: CSVファイルへのパス。
-    :return: CSVファイルの内容を含むpandasのDataFrame。
-    """
-    # ヘッダー行を探します。
-    lines = file.getvalue().decode('shift-jis').splitlines()
-    for i, line in enumerate(lines, start=1):
-        if line.startswith('TIME'):
-            header_row = i - 1  # Pythonのインデックスは0から始まるため、1を引きます。
-            print(f'ヘッダー行は {i} 行目です。')
-            break
-    else:
-        raise ValueError('ヘッダー行が見つかりませんでした。')
-
-    # CSVファイルを読み込みます。
-    file.seek(0)
-    df = pd.read_csv(file, encoding="shift-jis", skiprows=range(header_row), header=0)
-
-    print(df.head())
-
-    return df
+from tek_loader import read_csv_file
+from time_window import part_labels, split_window
 
 def plot_data(df, secondary_y):
     """
@@ -64,21 +42,15 @@ def main():
         df = read_csv_file(file)
         
         if df is not None:  # dfがNoneでないことを確認します。
-            # データを前半と後半に分割します。
-            df_first_half = df.iloc[:len(df)//2]
-            df_second_half = df.iloc[len(df)//2:]
-            
             # ユーザーが表示するデータを選択できるようにします。
-            data_choice = st.sidebar.selectbox("Choose the data to display", ["First half", "Second half"])
+            data_choice = st.sidebar.selectbox("Choose the data to display", part_labels(2))
             
             # ユーザーが2つ目のY軸にプロットするデータを選択できるようにします。
             secondary_y = st.sidebar.selectbox("Choose the data for the secondary Y axis", ['CH1', 'CH2', 'CH3', 'CH4'])
             
-            # 選択に基づいて表示するデータを変更します。
-            if data_choice == "First half":
-                fig = plot_data(df_first_half, secondary_y)
-            else:
-                fig = plot_data(df_second_half, secondary_y)
+            # 選択された部分の範囲をTIMEの二分探索で求め、その範囲だけを取り出します。
+            start, stop = split_window(df['TIME'].to_numpy(), 2, part_labels(2).index(data_choice))
+            fig = plot_data(df.iloc[start:stop], secondary_y)
 
             # プロットを表示します。
             st.plotly_chart(fig)
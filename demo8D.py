@@ -1,60 +1,48 @@
-import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 
-def read_csv_file(file):
-    """
-    この関数は特定の構造を持つCSVファイルを読み込みます。
-    :param file: CSVファイルへのパス。
-    :return: CSVファイルの内容を含むpandasのDataFrame。
-    """
-    # ヘッダー行を探します。
-    lines = file.getvalue().decode('shift-jis').splitlines()
-    for i, line in enumerate(lines, start=1):
-        if line.startswith('TIME'):
-            header_row = i - 1  # Pythonのインデックスは0から始まるため、1を引きます。
-            print(f'ヘッダー行は {i} 行目です。')
-            break
-    else:
-        raise ValueError('ヘッダー行が見つかりませんでした。')
-
-    # CSVファイルを読み込みます。
-    file.seek(0)
-    df = pd.read_csv(file, encoding="shift-jis", skiprows=range(header_row), header=0)
+from decimation import decimate
+from figure_cache import assemble, cached_traces
+from stats_index import build_stats
+from tek_cache import parse_cache
+from tek_loader import read_csv_file
+from time_window import part_labels, split_window
 
-    print(df.head())
+# グラフの幅（ピクセル）。間引きの区間数にも使います。
+PLOT_WIDTH = 800
 
-    return df
-
-def plot_data(df, secondary_y, y1_range, y2_range):
+def plot_data(df, secondary_y, y1_range, y2_range, cache_key=None):
     """
     この関数はDataFrameからデータをプロットします。
     :param df: プロットするデータを含むDataFrame。
     :param secondary_y: 2つ目のY軸に表示する列の名前。
     :param y1_range: 1つ目のY軸の表示範囲。
     :param y2_range: 2つ目のY軸の表示範囲。
+    :param cache_key: (データセット, 表示する部分)を表すキー。指定するとトレースをキャッシュし、
+                      軸の範囲や列の名前だけを変えた再実行ではトレースを作り直しません。
     """
-    # プロットオブジェクトを作成します。
-    fig = go.Figure()
+    columns = list(df.columns[1:])  # TIME以外の全ての列をプロットします。
 
-    # 各列のデータをプロットします。
-    for col in df.columns[1:]:  # TIME以外の全ての列をプロットします。
-        fig.add_trace(
-            go.Scatter(
-                x=df['TIME'], 
-                y=df[col], 
-                mode='lines', 
-                name=col,
-                yaxis='y2' if col == secondary_y else 'y1'
-            )
-        )
+    # 各列のデータを区間ごとの最小値・最大値に間引いてから、トレースを作成します。
+    # 間引かずにキャッシュすると、大きなファイルでは1つのエントリがキャッシュの上限を超えて保持されず、
+    # 再実行のたびに作り直すことになります。間引いたトレースはグラフの幅に比例した大きさなので、常に保持できます。
+    # 列の名前は変更できるので、トレースは列の位置で区別します。
+    def build():
+        traces = []
+        for i in range(len(columns)):
+            x, y = decimate(df['TIME'], df.iloc[:, i + 1], PLOT_WIDTH)
+            traces.append(go.Scatter(x=x, y=y, mode='lines'))
+        return traces
+
+    traces = cached_traces(cache_key, build)
 
     # グラフのサイズと2つ目のY軸を設定します。
-    fig.update_layout(
+    return assemble(
+        traces, columns, ['y2' if col == secondary_y else 'y' for col in columns],
         autosize=False,
-        width=800,  # 幅
+        width=PLOT_WIDTH,  # 幅
         height=400,  # 高さ
-        yaxis1=dict(
+        yaxis=dict(
             range=y1_range,  # 1つ目のY軸の表示範囲を設定します。
         ),
         yaxis2=dict(
@@ -64,14 +52,18 @@ def plot_data(df, secondary_y, y1_range, y2_range):
         )
     )
 
-    return fig
-
 def main():
     st.sidebar.title('CSV File Upload')
     file = st.sidebar.file_uploader("Upload your input CSV file", type=["csv"])
     if file is not None:
         # CSVファイルからデータを読み込み、DataFrameに格納します。
-        df = read_csv_file(file)
+        # 同じ内容のファイルは再実行のたびに解析せず、キャッシュから取り出します。
+        settings = dict(encoding='shift-jis', header_marker='TIME')
+        df = parse_cache.load(file, read_csv_file, **settings)
+
+        # 読み込み後に一度だけ、各チャンネルの統計インデックスを作成します。
+        dataset_key = parse_cache.key_for(file, **settings)
+        stats = build_stats([df[col].to_numpy() for col in df.columns[1:]], dataset_key)
         
         if df is not None:  # dfがNoneでないことを確認します。
             # ユーザーがCH1, CH2, CH3, CH4の名前を変更できるようにします。
@@ -81,24 +73,26 @@ def main():
             ch4_name = st.sidebar.text_input("Enter the name for CH4", "CH4")
             
             # DataFrameの列名を更新します。
-            df.rename(columns={'CH1': ch1_name, 'CH2': ch2_name, 'CH3': ch3_name, 'CH4': ch4_name}, inplace=True)
+            # キャッシュされたDataFrameを書き換えないように、inplaceは使いません。
+            df = df.rename(columns={'CH1': ch1_name, 'CH2': ch2_name, 'CH3': ch3_name, 'CH4': ch4_name})
             
             # ユーザーが2つ目のY軸にプロットするデータを選択できるようにします。
             secondary_y = st.sidebar.selectbox("Choose the data for the secondary Y axis", df.columns[1:])
             
-            # データを前半と後半に分割します。
-            df_first_half = df.iloc[:len(df)//2]
-            df_second_half = df.iloc[len(df)//2:]
-            
             # ユーザーが表示するデータを選択できるようにします。
-            data_choice = st.sidebar.selectbox("Choose the data to display", ["First half", "Second half"])
+            data_choice = st.sidebar.selectbox("Choose the data to display", part_labels(2))
             
+            # 1つ目のY軸と2つ目のY軸に表示するチャンネルの最小値と最大値を統計インデックスから求めます。
+            y2_index = list(df.columns[1:]).index(secondary_y)
+            y1_min, y1_max = stats.value_range([i for i in range(len(df.columns) - 1) if i != y2_index])
+            y2_min, y2_max = stats.value_range([y2_index])
+
             # スライダーから値を取得します。
             y1_range = st.sidebar.slider(
                 "Range of Y1 axis", 
-                float(df[df.columns.difference([secondary_y])].min().min()) - 0.5 * (float(df[df.columns.difference([secondary_y])].max().max()) - float(df[df.columns.difference([secondary_y])].min().min())), 
-                1.5 * float(df[df.columns.difference([secondary_y])].max().max()), 
-                (float(df[df.columns.difference([secondary_y])].min().min()), float(df[df.columns.difference([secondary_y])].max().max()))
+                y1_min - 0.5 * (y1_max - y1_min), 
+                1.5 * y1_max, 
+                (y1_min, y1_max)
             )
 
             # y1_rangeがタプルではない場合（つまり単一の値の場合）、それを範囲に変換します。
@@ -108,18 +102,17 @@ def main():
             # 同様にY2軸の範囲を設定します。
             y2_range = st.sidebar.slider(
                 "Range of Y2 axis", 
-                float(df[secondary_y].min()) - 0.5 * (float(df[secondary_y].max()) - float(df[secondary_y].min())), 
-                1.5 * float(df[secondary_y].max()), 
-                (float(df[secondary_y].min()), float(df[secondary_y].max()))
+                y2_min - 0.5 * (y2_max - y2_min), 
+                1.5 * y2_max, 
+                (y2_min, y2_max)
             )
             if not isinstance(y2_range, tuple):
                 y2_range = (y2_range, y2_range)
             
-            # 選択に基づいて表示するデータを変更します。
-            if data_choice == "First half":
-                fig = plot_data(df_first_half, secondary_y, y1_range, y2_range)
-            else:
-                fig = plot_data(df_second_half, secondary_y, y1_range, y2_range)
+            # 選択された部分の範囲をTIMEの二分探索で求め、その範囲だけを取り出します。
+            part = part_labels(2).index(data_choice)
+            start, stop = split_window(df['TIME'].to_numpy(), 2, part)
+            fig = plot_data(df.iloc[start:stop], secondary_y, y1_range, y2_range, (dataset_key, part))
 
             # プロットを表示します。
             st.plotly_chart(fig)
@@ -1,65 +1,126 @@
-import pandas as pd
+import io
+
 import plotly.graph_objects as go
 import streamlit as st
 
-def read_csv_file(file):
+import profiling
+from background_load import BackgroundLoad, LoadCancelled
+from dataset_registry import dataset_registry
+from decimation import METHODS, build_pyramids, decimate
+from disk_cache import disk_cache
+from events import EVENT_KINDS, build_events, nearest
+from figure_cache import ENCODINGS, assemble, cached_traces, payload_size, trace_arrays
+from filters import FILTER_KINDS, apply_filter
+from live_tail import TailReader
+from measurements import measurement_table
+from rendering import DEFAULT_GL_THRESHOLD, RENDERERS, scatter_class
+from spectrum import NFFT_CHOICES, SPECTRUM_KINDS, WINDOW_FUNCTIONS, compute_spectrum, sample_rate
+from stats_index import build_stats
+from streaming import ChunkedLoader, read_preview
+from tek_cache import parse_cache
+from tek_loader import ParseCancelled, read_channel_store
+from tek_preamble import Preamble
+from time_window import part_labels, split_window, window_indices
+
+# グラフの幅（ピクセル）。間引きの区間数にも使います。
+PLOT_WIDTH = 800
+
+# 読み込みを始めてから、プレビューを出さずに完了を待つ時間（秒）。
+LOAD_WAIT = 0.2
+# 読み込み中に、進み具合の表示を更新して完了を確認する間隔（秒）。
+LOAD_POLL = 0.5
+
+def plot_traces(store, method='MinMax', cache_key=None, window=None, pyramids=None, renderer='Auto',
+                gl_threshold=DEFAULT_GL_THRESHOLD, filtered=None, filtered_pyramids=None, encoding='Float64'):
     """
-    この関数は特定の構造を持つCSVファイルを読み込みます。
-    :param file: CSVファイルへのパス。
-    :return: CSVファイルの内容を含むpandasのDataFrame。
+    この関数は各チャンネルを間引いたトレースを作成します。
+    cache_keyを指定した場合、作成したトレースを(データセット, 表示範囲, 間引きと描画の設定, フィルタ)ごとにキャッシュします。
+    表示名とY軸は含まないので、軸の範囲や名前だけを変えた再実行ではトレースを作り直しません。
+    引数はplot_dataと同じです。
+    :return: (トレースの辞書のリスト, 各トレースの元のチャンネルの位置のリスト, 各トレースの表示名に付ける文字列のリスト)
     """
-    # ヘッダー行を探します。
-    lines = file.getvalue().decode('shift-jis').splitlines()
-    for i, line in enumerate(lines, start=1):
-        if line.startswith('TIME'):
-            header_row = i - 1  # Pythonのインデックスは0から始まるため、1を引きます。
-            print(f'ヘッダー行は {i} 行目です。')
-            break
-    else:
-        raise ValueError('ヘッダー行が見つかりませんでした。')
+    start, stop = window if window is not None else (0, len(store))
+    time = store.time
 
-    # CSVファイルを読み込みます。
-    file.seek(0)
-    df = pd.read_csv(file, encoding="shift-jis", skiprows=range(header_row), header=0)
+    # 表示するチャンネルの一覧を作ります。フィルタを掛けたチャンネルは元のチャンネルと同じY軸に表示します。
+    # (元のチャンネルの位置, 表示名に付ける文字列, データ, ピラミッド, 間引きのキャッシュのキー)
+    sources = [(i, '', y, None if pyramids is None else pyramids[i], cache_key)
+               for i, y in enumerate(store.channels)]
+    filter_id = None
+    if filtered is not None:
+        name = filtered.meta.get('filter', 'filtered')
+        # フィルタの結果は末尾にデータが追加されると変わるため、キーに行数を含めます。
+        filter_id = (name, len(filtered))
+        key = None if cache_key is None else (cache_key,) + filter_id
+        sources += [(i, f' ({name})', y, None if filtered_pyramids is None else filtered_pyramids[i], key)
+                    for i, y in enumerate(filtered.channels)]
 
-    print(df.head())
+    def build():
+        # 各チャンネルのデータを間引きます。
+        decimated = []
+        for i, (_, _, y, pyramid, key) in enumerate(sources):
+            if method == 'MinMax' and pyramid is not None:
+                # ピラミッドから表示範囲に合ったレベルの点を取り出します。
+                idx = pyramid.query(start, stop, PLOT_WIDTH)
+                decimated.append((time[idx], y[idx]))
+            else:
+                # 表示名は変更できるので、チャンネルは位置で区別します。
+                key = None if key is None else (key, (start, stop), i)
+                decimated.append(decimate(time[start:stop], y[start:stop], PLOT_WIDTH, method, key))
+
+        # ポイント数に応じてSVGかWebGLのどちらで描画するかを決めます。
+        scatter = scatter_class(max((len(x) for x, _ in decimated), default=0), renderer, gl_threshold)
+        # TIMEはサンプル間隔の半分までの誤差であれば、float32にしたり等間隔とみなしたりします。
+        tolerance = 0.5 / sample_rate(time)
+        return [scatter(**trace_arrays(x, y, encoding, tolerance), mode='lines') for x, y in decimated]
 
-    return df
+    key = None if cache_key is None else (cache_key, (start, stop), method, renderer, gl_threshold, filter_id,
+                                          encoding)
+    traces = cached_traces(key, build)
+    return traces, [i for i, _, _, _, _ in sources], [suffix for _, suffix, _, _, _ in sources]
 
-def plot_data(df, secondary_y, y1_range, y2_range):
+def plot_data(store, labels, secondary_y, y1_range, y2_range, method='MinMax', cache_key=None, window=None,
+              pyramids=None, renderer='Auto', gl_threshold=DEFAULT_GL_THRESHOLD, filtered=None,
+              filtered_pyramids=None, encoding='Float64'):
     """
-    この関数はDataFrameからデータをプロットします。
-    :param df: プロットするデータを含むDataFrame。
-    :param secondary_y: 2つ目のY軸に表示する列の名前。
+    この関数はChannelStoreからデータをプロットします。
+    間引いたトレースはplot_tracesでキャッシュし、表示名、Y軸の割り当て、軸の範囲やフォントなどのレイアウトだけを
+    再実行のたびに当てはめます。
+    :param store: プロットするデータを含むChannelStore。
+    :param labels: 各チャンネルの表示名のリスト。
+    :param secondary_y: 2つ目のY軸に表示するチャンネルの表示名。
     :param y1_range: 1つ目のY軸の表示範囲。
     :param y2_range: 2つ目のY軸の表示範囲。
+    :param method: 間引きの方法。
+    :param cache_key: データセットを表すキー。指定すると間引いた結果とトレースをキャッシュします。
+    :param window: 表示する行の範囲(start, stop)。Noneの場合は全体を表示します。
+    :param pyramids: build_pyramidsで作成したピラミッド。MinMaxの間引きに使います。
+    :param renderer: 描画方法（Auto, SVG, WebGL）。
+    :param gl_threshold: AutoのときにWebGLに切り替えるトレースのポイント数。
+    :param filtered: apply_filterで作成したChannelStore。指定すると元のトレースに加えて表示します。
+    :param filtered_pyramids: apply_filterが返したfilteredのピラミッド。
+    :param encoding: トレースの配列の送り方（Float64, Compact）。
     """
-    # プロットオブジェクトを作成します。
-    fig = go.Figure()
-
-    # 各列のデータをプロットします。
-    for col in df.columns[1:]:  # TIME以外の全ての列をプロットします。
-        fig.add_trace(
-            go.Scatter(
-                x=df['TIME'], 
-                y=df[col], 
-                mode='lines', 
-                name=col,
-                yaxis='y2' if col == secondary_y else 'y1'
-            )
-        )
+    traces, channels, suffixes = plot_traces(store, method, cache_key, window, pyramids, renderer, gl_threshold,
+                                             filtered, filtered_pyramids, encoding)
+    names = [labels[i] + suffix for i, suffix in zip(channels, suffixes)]
+    yaxes = ['y2' if labels[i] == secondary_y else 'y' for i in channels]
 
     # グラフのサイズと2つ目のY軸を設定します。
-    fig.update_layout(
+    return assemble(
+        traces, names, yaxes,
         autosize=False,
-        width=800,  # 幅
+        width=PLOT_WIDTH,  # 幅
         height=400,  # 高さ
+        dragmode='select',  # ドラッグで範囲を選択してズームします。
+        selectdirection='h',
         xaxis=dict(
             title_text="TIME",  # X軸のラベルを設定します。
             title_font=dict(size=18),  # X軸のラベルのフォントサイズを設定します。
             tickfont=dict(size=18),  # X軸の目盛りのフォントサイズを設定します。
         ),
         yaxis=dict(
+            title_text=', '.join([col for col in labels if col != secondary_y]),  # 1つ目のY軸のラベルを設定します。
             range=y1_range,  # 1つ目のY軸の表示範囲を設定します。
             tickfont=dict(size=18),  # 1つ目のY軸の目盛りのフォントサイズを設定します。
         ),
@@ -76,73 +137,508 @@ def plot_data(df, secondary_y, y1_range, y2_range):
         )
     )
 
+def plot_spectrum(store, labels, kind, nfft, window_fn='hann', cache_key=None, window=None, channel=0):
+    """
+    この関数は選択された時間範囲の周波数領域の表示をプロットします。
+    :param store: プロットするデータを含むChannelStore。
+    :param labels: 各チャンネルの表示名のリスト。
+    :param kind: 表示の種類（FFT, Welch PSD, Spectrogram）。
+    :param nfft: 1区間のサンプル数。
+    :param window_fn: 窓関数の名前。
+    :param cache_key: データセットを表すキー。指定すると計算結果をキャッシュします。
+    :param window: 表示する行の範囲(start, stop)。Noneの場合は全体を使います。
+    :param channel: Spectrogramで表示するチャンネルの位置。
+    """
+    start, stop = window if window is not None else (0, len(store))
+    fs = sample_rate(store.time[start:stop])
+
+    def spectrum(i):
+        key = None if cache_key is None else (cache_key, (start, stop), i)
+        return compute_spectrum(store.channels[i][start:stop], fs, kind, nfft, window_fn, key)
+
+    fig = go.Figure()
+    if kind == 'Spectrogram':
+        # 1つのチャンネルの時間と周波数ごとのパワーをヒートマップで表示します。
+        freqs, centers, db = spectrum(channel)
+        fig.add_trace(go.Heatmap(x=store.time[start + centers], y=freqs, z=db, colorbar=dict(title='dB')))
+        fig.update_layout(xaxis_title='TIME', yaxis_title='Frequency [Hz]', title_text=labels[channel])
+    else:
+        # 各チャンネルのスペクトルを対数軸で重ねて表示します。
+        results = [spectrum(i) for i in range(len(labels))]
+        scatter = scatter_class(max((len(f) for f, _ in results), default=0))
+        for col, (freqs, values) in zip(labels, results):
+            fig.add_trace(scatter(x=freqs, y=values, mode='lines', name=col))
+        fig.update_layout(
+            xaxis=dict(title_text='Frequency [Hz]', type='log'),
+            yaxis=dict(title_text='Amplitude [V]' if kind == 'FFT' else 'PSD [V²/Hz]', type='log'),
+        )
+
+    fig.update_layout(autosize=False, width=PLOT_WIDTH, height=400)
     return fig
 
+def load_dataset(job, data, dataset_key, settings, streaming):
+    """
+    この関数は読み込みのスレッドで、ファイル全体を読み込んでピラミッドと統計インデックスを作成します。
+    Streamlitの関数は呼ばず、進み具合はjob.progressに書き込みます。
+    サーバーの再起動前に解析したファイルは、ディスクのキャッシュから配列とピラミッド、統計インデックスを開きます。
+    :param job: BackgroundLoad。
+    :param data: アップロードされたファイルの内容。
+    :param dataset_key: データセットを表すキー。
+    :param settings: 読み込みの設定（encoding, header_marker）の辞書。
+    :param streaming: 一定の大きさずつ読み込むかどうか。
+    :return: DatasetHandle。
+    """
+    parsed = []
+    prebuilt = []
+    # このスレッドのProfiler。BackgroundLoadが計測を有効にした場合だけ記録します。
+    profiler = profiling.current()
+
+    def load():
+        with profiler.stage('disk cache load'):
+            cached = disk_cache.load(dataset_key)
+        if cached is not None:
+            prebuilt.append(cached[1:])
+            return cached[0]
+        parsed.append(True)
+        if streaming:
+            # チャンクごとに取り消されていないかを確認します。
+            loader = ChunkedLoader(io.BytesIO(data), **settings)
+            while not loader.done:
+                if job.cancelled.is_set():
+                    loader.close()
+                    raise LoadCancelled()
+                loader.read()
+                job.progress = loader.progress
+            prebuilt.append((loader.pyramids, loader.stats))
+            return loader.finish()
+        # 取り消されたら、解析の途中でもすぐにやめて、次のファイルの読み込みとメモリを取り合わないようにします。
+        try:
+            return read_channel_store(io.BytesIO(data), **settings, should_stop=job.cancelled.is_set)
+        except ParseCancelled:
+            raise LoadCancelled()
+
+    handle = dataset_registry.open(dataset_key, load)
+    prebuilt_pyramids, prebuilt_stats = prebuilt[0] if prebuilt else (None, None)
+
+    # 読み込み後に一度だけ、各チャンネルの最小値・最大値のピラミッドと統計インデックスを作成します。
+    # 少しずつ読み込んだ場合やディスクのキャッシュから開いた場合は、それを使います。
+    store = handle.store
+    with profiler.stage('pyramid') as record:
+        pyramids = build_pyramids(store, dataset_key, prebuilt_pyramids)
+        record['points'] = len(store)
+    with profiler.stage('statistics'):
+        stats = build_stats(store.channels, dataset_key, prebuilt_stats)
+    if parsed:
+        with profiler.stage('disk cache save'):
+            disk_cache.save(dataset_key, store, pyramids, stats)
+    return handle
+
+def start_load(file, dataset_key, settings, streaming, profile=False):
+    """
+    この関数はアップロードされたファイルの読み込みを別のスレッドで始めます。
+    最初に等間隔に抜き出した行でプレビューを作り、次にファイル全体を読み込みます。
+    :param file: アップロードされたファイル。
+    :param dataset_key: データセットを表すキー。
+    :param settings: 読み込みの設定（encoding, header_marker）の辞書。
+    :param streaming: 一定の大きさずつ読み込むかどうか。
+    :param profile: 読み込みのスレッドの各段階を計測するかどうか。
+    :return: BackgroundLoad。
+    """
+    # スレッドは再実行とファイルの読み込み位置を共有しないように、内容をコピーせずに参照する別のファイルオブジェクトで読みます。
+    data = file.getvalue()
+    return BackgroundLoad(
+        dataset_key,
+        lambda job: load_dataset(job, data, dataset_key, settings, streaming),
+        lambda: read_preview(io.BytesIO(data), **settings),
+        profile,
+    )
+
+def cancel_load():
+    """
+    この関数はこのセッションで読み込み中のファイルがあれば、読み込みを取り消します。
+    """
+    job = st.session_state.pop('load_job', None)
+    if job is not None:
+        job.cancel()
+
+def release_dataset():
+    """
+    この関数はこのセッションが使っていた共有のデータセットを手放します。
+    """
+    handle = st.session_state.pop('dataset', None)
+    if handle is not None:
+        handle.close()
+
+def show_loading(job, preview_rows):
+    """
+    この関数は読み込み中であることと進み具合を表示し、読み込みが終わった場合や
+    プレビューができた場合だけスクリプト全体を再実行します。
+    st.fragmentとして一定時間ごとに実行するため、進み具合を更新する間もスクリプトは止まらず、
+    サイドバーの操作にすぐに応答できます。
+    :param job: BackgroundLoad。
+    :param preview_rows: 表示しているプレビューの行数。プレビューを表示していない場合はNone。
+    """
+    if job.done or (preview_rows is None and job.preview is not None):
+        st.rerun()
+    # 読み込み中であることと、表示しているのがプレビューであることを示します。
+    note = "" if preview_rows is None else f" Showing a preview of {preview_rows:,} sampled rows."
+    if job.progress is None:
+        st.info(f"Loading...{note}")
+    else:
+        st.progress(job.progress, text=f"Loading... {job.progress:.0%}.{note}")
+
+def poll_tail(tail):
+    """
+    この関数は監視中のファイルに追加された行を読み込み、行が追加された場合だけスクリプト全体を再実行します。
+    st.fragmentとして一定時間ごとに実行するため、次の読み込みを待つ間もスクリプトは止まらず、
+    サイドバーの操作にすぐに応答できます。行が追加されていない場合は、グラフなどを作り直しません。
+    :param tail: TailReader。
+    """
+    generation = tail.generation
+    try:
+        added = tail.poll()
+    except (OSError, ValueError) as e:
+        # フラグメントの外に例外を出すと、再実行のたびにページ全体がエラーになります。
+        # 新しいエラーのときだけスクリプト全体を再実行してサイドバーに表示し、前回までのデータを表示し続けます。
+        if st.session_state.get('tail_error') != str(e):
+            st.rerun()
+        return
+    if added or tail.generation != generation:
+        st.rerun()
+
+def on_zoom():
+    """
+    この関数はグラフで範囲が選択されたときに呼ばれ、選択されたX軸の範囲を保存します。
+    """
+    box = st.session_state['waveform'].selection.box
+    if box:
+        st.session_state['x_range'] = tuple(sorted(box[-1]['x']))
+
+def jump_to(t, span):
+    """
+    この関数はボタンが押されたときに呼ばれ、表示範囲を指定した時刻を中心とする範囲にします。
+    :param t: 中心の時刻（秒）。
+    :param span: 表示範囲の幅（秒）。
+    """
+    st.session_state['window_mode'] = "Zoom"
+    st.session_state['x_range'] = (t - span / 2, t + span / 2)
+
 def main():
     st.sidebar.title('CSV File Upload')
-    file = st.sidebar.file_uploader("Upload your input CSV file", type=["csv"])
-    if file is not None:
-        # CSVファイルからデータを読み込み、DataFrameに格納します。
-        df = read_csv_file(file)
+
+    # 計測を有効にすると、再実行ごとの各段階の時間とメモリをサイドバーとログに出力します。
+    profiler = profiling.begin(st.sidebar.checkbox("Enable profiling"))
+
+    # データの読み込み方法を選択します。書き込み中のファイルは、追加された行だけを定期的に読み込みます。
+    source = st.sidebar.radio("Choose the data source", ["Upload", "Watch file"], horizontal=True)
+    store = None
+    tail = None
+    loading = None
+    if source == "Upload":
+        file = st.sidebar.file_uploader("Upload your input CSV file", type=["csv"])
+        # 少しずつ読み込むと、解析の一時的なメモリ使用量がファイルの大きさによらず一定になり、途中経過も表示できます。
+        streaming = st.sidebar.toggle("Streaming ingestion")
+        if file is not None:
+            # CSVファイルからデータを読み込み、ChannelStoreに格納します。
+            # 同じ内容のファイルは再実行のたびに解析せず、キャッシュから取り出します。
+            settings = dict(encoding='shift-jis', header_marker='TIME')
+            with profiler.stage('upload read'):
+                dataset_key = parse_cache.key_for(file, **settings)
+
+            zoom_key = dataset_key
+
+            # 読み込みは別のスレッドで行い、再実行は完了を待たずに進めるので、読み込み中もサイドバーを操作できます。
+            # 同じ内容のファイルを開いた他のセッションとは、1つの読み取り専用のChannelStoreを共有します。
+            # セッションはハンドルを持っている間だけ参照カウントに数えられ、別のファイルを開くと手放します。
+            handle = st.session_state.get('dataset')
+            failed = st.session_state.get('load_error')
+            if failed is not None and failed[0] == dataset_key:
+                # 読み込めなかったファイルは、別のファイルがアップロードされるまで読み込み直しません。
+                handle = None
+                st.error(failed[1])
+            elif handle is None or handle.key != dataset_key:
+                st.session_state.pop('load_error', None)
+                release_dataset()
+                job = st.session_state.get('load_job')
+                if job is None or job.key != dataset_key:
+                    # 別のファイルがアップロードされたら、読み込み中のものは取り消します。
+                    cancel_load()
+                    job = st.session_state['load_job'] = start_load(file, dataset_key, settings, streaming,
+                                                                   profiler.enabled)
+                # キャッシュにあるファイルや小さなファイルは、プレビューを出さずにそのまま表示します。
+                if job.wait(LOAD_WAIT):
+                    del st.session_state['load_job']
+                    # 読み込みのスレッドで計測した段階を、読み込みが終わった再実行の結果に加えます。
+                    profiler.merge(job.records, 'load: ')
+                    try:
+                        handle = st.session_state['dataset'] = job.result()
+                    except (OSError, ValueError) as e:
+                        # 形式が異なるファイルなどは、エラーを表示して別のファイルをアップロードできるようにします。
+                        handle = None
+                        message = f"Cannot load {file.name}: {e}"
+                        st.session_state['load_error'] = (dataset_key, message)
+                        st.error(message)
+                else:
+                    loading = job
+
+            if loading is not None:
+                if loading.preview is not None:
+                    # 読み込みが終わるまでは、等間隔に抜き出した行の粗いプレビューを表示します。
+                    store = loading.preview
+                    dataset_key = ('preview', dataset_key)
+                    pyramids = build_pyramids(store, dataset_key)
+                    stats = build_stats(store.channels, dataset_key)
+            elif handle is not None:
+                # ピラミッドと統計インデックスは読み込みのスレッドで作成済みなので、キャッシュから取り出します。
+                store = handle.store
+                with profiler.stage('pyramid'):
+                    pyramids = build_pyramids(store, dataset_key)
+                with profiler.stage('statistics'):
+                    stats = build_stats(store.channels, dataset_key)
+        else:
+            cancel_load()
+            release_dataset()
+            st.session_state.pop('load_error', None)
+    else:
+        path = st.sidebar.text_input("Path of the CSV file being written")
+        refresh = st.sidebar.number_input("Refresh interval [s]", min_value=0.5, value=2.0, step=0.5)
+        follow = st.sidebar.toggle("Auto refresh", value=True)
+        cancel_load()
+        release_dataset()
+        if path:
+            # 監視の状態はセッションごとに保持し、パスが変わったときだけ作り直します。
+            tail = st.session_state.get('tail')
+            if tail is None or tail.path != path:
+                tail = st.session_state['tail'] = TailReader(path)
+            with profiler.stage('tail poll') as record:
+                try:
+                    record['points'] = tail.poll()
+                    st.session_state.pop('tail_error', None)
+                except OSError as e:
+                    st.session_state['tail_error'] = str(e)
+                    st.sidebar.error(f"Cannot read {path}: {e}")
+                except ValueError as e:
+                    # 壊れた行が追加された場合は、前回までに読み込んだデータを表示し続けます。
+                    st.session_state['tail_error'] = str(e)
+                    st.sidebar.warning(f"Cannot parse the rows appended to {path}: {e}")
+            if tail.store is not None:
+                store, pyramids, stats, dataset_key = tail.store, tail.pyramids, tail.stats, tail.key
+                zoom_key = dataset_key
+
+    if loading is not None:
+        # 読み込み中は一定時間ごとに進み具合を更新し、読み込みが終わったら全体のデータの表示に切り替えます。
+        st.fragment(run_every=LOAD_POLL)(show_loading)(loading, None if store is None else len(store))
+
+    if store is not None:  # storeがNoneでないことを確認します。
+        # プリアンブルから読み取った記録条件を表示します。
+        preamble = Preamble.parse(store.meta.get('preamble', ''))
+        if preamble.sample_interval:
+            st.sidebar.caption(f"{len(store):,} points, sample interval {preamble.sample_interval:.3g} s")
+
+        # ユーザーがCH1, CH2, CH3, CH4の名前を変更できるようにします。
+        # 表示名はデータとは別に持つため、名前を変更してもデータはコピーされません。
+        with profiler.stage('rename'):
+            labels = [st.sidebar.text_input(f"Enter the name for {name}", name) for name in store.names]
+        
+        # ユーザーが2つ目のY軸にプロットするデータを選択できるようにします。
+        secondary_y = st.sidebar.selectbox("Choose the data for the secondary Y axis", labels)
         
-        if df is not None:  # dfがNoneでないことを確認します。
-            # ユーザーがCH1, CH2, CH3, CH4の名前を変更できるようにします。
-            ch1_name = st.sidebar.text_input("Enter the name for CH1", "CH1")
-            ch2_name = st.sidebar.text_input("Enter the name for CH2", "CH2")
-            ch3_name = st.sidebar.text_input("Enter the name for CH3", "CH3")
-            ch4_name = st.sidebar.text_input("Enter the name for CH4", "CH4")
-            
-            # DataFrameの列名を更新します。
-            df.rename(columns={'CH1': ch1_name, 'CH2': ch2_name, 'CH3': ch3_name, 'CH4': ch4_name}, inplace=True)
-            
-            # ユーザーが2つ目のY軸にプロットするデータを選択できるようにします。
-            secondary_y = st.sidebar.selectbox("Choose the data for the secondary Y axis", df.columns[1:])
-            
-            # データを3つの部分に分割します。
-            df_first_part = df.iloc[:len(df)//3]
-            df_second_part = df.iloc[len(df)//3:(2*len(df))//3]
-            df_third_part = df.iloc[(2*len(df))//3:]
-            
-            # ユーザーが表示するデータを選択できるようにします。
-            data_choice = st.sidebar.selectbox("Choose the data to display", ["First part", "Second part", "Third part"])
-            
-            # スライダーから値を取得します。
-            y1_range = st.sidebar.slider(
-                "Range of Y1 axis", 
-                float(df[df.columns.difference([secondary_y])].min().min()) - 0.5 * (float(df[df.columns.difference([secondary_y])].max().max()) - float(df[df.columns.difference([secondary_y])].min().min())), 
-                1.5 * float(df[df.columns.difference([secondary_y])].max().max()), 
-                (float(df[df.columns.difference([secondary_y])].min().min()), float(df[df.columns.difference([secondary_y])].max().max()))
-            )
-
-            # y1_rangeがタプルではない場合（つまり単一の値の場合）、それを範囲に変換します。
-            if not isinstance(y1_range, tuple):
-                y1_range = (y1_range, y1_range)
-
-            # 同様にY2軸の範囲を設定します。
-            y2_range = st.sidebar.slider(
-                "Range of Y2 axis", 
-                float(df[secondary_y].min()) - 0.5 * (float(df[secondary_y].max()) - float(df[secondary_y].min())), 
-                1.5 * float(df[secondary_y].max()), 
-                (float(df[secondary_y].min()), float(df[secondary_y].max()))
-            )
-            if not isinstance(y2_range, tuple):
-                y2_range = (y2_range, y2_range)
-            
-            # 選択に基づいて表示するデータを変更します。
-            if data_choice == "First part":
-                fig = plot_data(df_first_part, secondary_y, y1_range, y2_range)
-            elif data_choice == "Second part":
-                fig = plot_data(df_second_part, secondary_y, y1_range, y2_range)
+        # ユーザーが表示する時間範囲の選び方を選択できるようにします。
+        # どの方法でもTIMEの二分探索で行の範囲を求めるだけなので、データはコピーされません。
+        window_mode = st.sidebar.radio("Choose how to select the time window", ["Zoom", "Parts", "Time"],
+                                       horizontal=True, key='window_mode')
+        with profiler.stage('slicing'):
+            if window_mode == "Parts":
+                # 時間軸をN個の等しい長さに分けて、その1つを表示します。
+                n_parts = int(st.sidebar.number_input("Number of parts", min_value=1, value=3))
+                part = st.sidebar.selectbox("Choose the data to display", range(n_parts),
+                                            format_func=lambda i: part_labels(n_parts)[i])
+                window = split_window(store.time, n_parts, part)
+            elif window_mode == "Time":
+                # 開始時刻と終了時刻を秒で指定します。
+                t_start = st.sidebar.number_input("Start time [s]", value=float(store.time[0]), format="%.6e")
+                t_stop = st.sidebar.number_input("Stop time [s]", value=float(store.time[-1]), format="%.6e")
+                window = window_indices(store.time, t_start, t_stop)
             else:
-                fig = plot_data(df_third_part, secondary_y, y1_range, y2_range)
+                # グラフで選択された範囲を表示します。別のファイルを開いたときは全体に戻します。
+                if st.session_state.get('x_range_key') != zoom_key:
+                    st.session_state['x_range_key'] = zoom_key
+                    st.session_state.pop('x_range', None)
+                if st.sidebar.button("Reset zoom"):
+                    st.session_state.pop('x_range', None)
+                window = window_indices(store.time, *st.session_state.get('x_range', (None, None)))
+
+        # 1つ目のY軸と2つ目のY軸に表示するチャンネルの最小値と最大値を統計インデックスから求めます。
+        # スライダーの範囲は全体の値から、初期値は表示範囲の値から決めます。
+        with profiler.stage('axis ranges'):
+            y2_index = labels.index(secondary_y)
+            y1_indices = [i for i in range(len(labels)) if i != y2_index]
+            y1_min, y1_max = stats.value_range(y1_indices)
+            y2_min, y2_max = stats.value_range([y2_index])
+            y1_auto = stats.value_range(y1_indices, *window)
+            y2_auto = stats.value_range([y2_index], *window)
+
+        # エッジやラントなどのイベントの位置に、表示範囲を移動できるようにします。
+        # イベントインデックスはチャンネルとしきい値ごとに一度だけ作成し、前後のイベントは二分探索で探します。
+        event_kind = 'Off'
+        with st.sidebar.expander("Events"):
+            event_kind = st.selectbox("Event type", ['Off'] + EVENT_KINDS)
+            if event_kind != 'Off' and len(store) > 1:
+                event_channel = st.selectbox("Channel for events", range(len(labels)),
+                                             format_func=lambda i: labels[i])
+                total = stats.totals[event_channel]
+                middle = (total['min'] + total['max']) / 2
+                hysteresis = 0.1 * (total['max'] - total['min'])
+                low = st.number_input("Low threshold", value=middle - hysteresis, format="%.4g")
+                high = st.number_input("High threshold", value=middle + hysteresis, format="%.4g")
+                min_width = max_width = None
+                if event_kind == 'Pulse width':
+                    min_width = st.number_input("Minimum pulse width [s] (0: no limit)", min_value=0.0, value=0.0,
+                                                format="%.3e") or None
+                    max_width = st.number_input("Maximum pulse width [s] (0: no limit)", min_value=0.0, value=0.0,
+                                                format="%.3e") or None
+
+                with profiler.stage('events') as record:
+                    # 監視中のファイルは、キャッシュしたインデックスを追加された行の分だけ更新します。
+                    events = build_events(store.channels[event_channel], low, high, (dataset_key, event_channel))
+                    positions = events.positions(event_kind, store.time, min_width, max_width)
+                    record['points'] = len(positions)
+                st.caption(f"{len(positions):,} events")
+
+                dt = (float(store.time[-1]) - float(store.time[0])) / (len(store) - 1)
+                span = st.number_input("Time span around the event [s]", min_value=0.0, value=1000 * dt,
+                                       format="%.3e")
+                if len(positions):
+                    center = (window[0] + window[1]) // 2
+                    previous = nearest(positions, center, -1)
+                    following = nearest(positions, center, 1)
+                    left, right = st.columns(2)
+                    left.button("◀ Previous", disabled=previous is None, on_click=jump_to,
+                                args=(float(store.time[positions[previous or 0]]), span))
+                    right.button("Next ▶", disabled=following is None, on_click=jump_to,
+                                 args=(float(store.time[positions[following or 0]]), span))
+                    number = int(st.number_input("Event number", min_value=0, max_value=len(positions) - 1,
+                                                 value=0))
+                    st.button("Go to event", on_click=jump_to, args=(float(store.time[positions[number]]), span))
+
+        # スライダーから値を取得します。
+        y1_range = st.sidebar.slider(
+            "Range of Y1 axis", 
+            y1_min - 0.5 * (y1_max - y1_min), 
+            1.5 * y1_max, 
+            y1_auto
+        )
+
+        # y1_rangeがタプルではない場合（つまり単一の値の場合）、それを範囲に変換します。
+        if not isinstance(y1_range, tuple):
+            y1_range = (y1_range, y1_range)
+
+        # 同様にY2軸の範囲を設定します。
+        y2_range = st.sidebar.slider(
+            "Range of Y2 axis", 
+            y2_min - 0.5 * (y2_max - y2_min), 
+            1.5 * y2_max, 
+            y2_auto
+        )
+        if not isinstance(y2_range, tuple):
+            y2_range = (y2_range, y2_range)
+
+        # ユーザーが間引きの方法を選択できるようにします。
+        method = st.sidebar.selectbox("Choose the decimation method", METHODS)
+
+        # ユーザーが描画方法（SVGまたはWebGL）を選択できるようにします。
+        renderer = st.sidebar.selectbox("Choose the rendering mode", RENDERERS)
+        gl_threshold = st.sidebar.number_input(
+            "WebGL threshold (points per trace)", min_value=1, value=DEFAULT_GL_THRESHOLD, step=10_000
+        )
+
+        # ユーザーがトレースの配列の送り方を選択できるようにします。
+        encoding = st.sidebar.selectbox("Choose the trace encoding", ENCODINGS)
+        
+        # ユーザーがフィルタを選択できるようにします。フィルタを掛けたトレースは元のトレースに加えて表示します。
+        filter_kind = st.sidebar.selectbox("Choose a filter", ['Off'] + FILTER_KINDS)
+        filtered = filtered_pyramids = None
+        if filter_kind != 'Off':
+            cutoff, order, length = None, 4, 101
+            if filter_kind == 'Low-pass':
+                cutoff = st.sidebar.number_input("Cut-off frequency [Hz]", min_value=0.0,
+                                                 value=sample_rate(store.time) / 100, format="%.6g")
+                order = st.sidebar.slider("Filter order", 1, 8, 4)
+            elif filter_kind == 'Moving average':
+                length = int(st.sidebar.number_input("Moving average length [samples]", min_value=1, value=101))
+            # 監視中のファイルで行が増えた場合は、apply_filterが追加された部分だけにフィルタを掛けます。
+            try:
+                with profiler.stage('filter'):
+                    filtered, filtered_pyramids = apply_filter(store, filter_kind, cutoff, order, length,
+                                                               dataset_key)
+            except ValueError as e:
+                st.sidebar.error(str(e))
+
+        # 選択された範囲だけをプロットします。
+        # 軸の範囲や名前だけを変えた場合は、キャッシュしたトレースにレイアウトを当てはめるだけです。
+        with profiler.stage('plot_data') as record:
+            fig = plot_data(store, labels, secondary_y, y1_range, y2_range, method, dataset_key, window,
+                            pyramids, renderer, gl_threshold, filtered, filtered_pyramids, encoding)
+            n_shown = sum(len(trace.y) for trace in fig.data)
+            record['points'] = n_shown
+
+        # 間引きの比率を表示します。
+        n_total = (window[1] - window[0]) * len(fig.data)
+        st.sidebar.caption(f"Decimation: {n_total:,} → {n_shown:,} points ({n_total / max(n_shown, 1):.1f}x)")
+        st.sidebar.caption(f"Rendering: {'WebGL' if fig.data and fig.data[0].type == 'scattergl' else 'SVG'}")
+        if profiler.enabled:
+            # 計測中は、ブラウザに送るデータの大きさとJSONへの変換時間を表示します。
+            n_bytes, seconds = payload_size(fig)
+            st.sidebar.caption(f"Payload: {n_bytes / 1024:,.1f} KB ({encoding}, to_json {seconds * 1000:.1f} ms)")
+
+        # プロットを表示します。範囲を選択するとその範囲を拡大して再描画します。
+        with profiler.stage('st.plotly_chart') as record:
+            st.plotly_chart(fig, key='waveform', on_select=on_zoom, selection_mode='box')
+            record['points'] = n_shown
+
+        # 表示範囲の各チャンネルの統計量を表示します。
+        st.dataframe(stats.table(labels, *window))
+
+        # 表示範囲の各チャンネルの周波数や立ち上がり時間などの測定値を表示します。
+        # 監視中のファイルは、レベルとエッジを追加された行の分だけ更新します。
+        with profiler.stage('measurements'):
+            measurements = measurement_table(store, stats, labels, *window, cache_key=dataset_key)
+        st.dataframe(measurements.style.format('{:.4g}'))
+
+        # イベントの一覧を表示します。
+        if event_kind != 'Off' and len(store) > 1:
+            with st.expander(f"{event_kind} events on {labels[event_channel]}"):
+                st.dataframe(events.table(event_kind, store.time, min_width, max_width), hide_index=True)
+
+        # 選択された時間範囲の周波数領域の表示を、時間領域のグラフの下に表示します。
+        # 計算結果は範囲とパラメータごとにキャッシュするため、軸の範囲を変えても計算し直しません。
+        spectrum_kind = st.sidebar.selectbox("Choose the spectrum view", ['Off'] + SPECTRUM_KINDS)
+        if spectrum_kind != 'Off':
+            window_fn = st.sidebar.selectbox("Window function", WINDOW_FUNCTIONS)
+            nfft = st.sidebar.selectbox("NFFT", NFFT_CHOICES, index=NFFT_CHOICES.index(4096))
+            channel = 0
+            if spectrum_kind == 'Spectrogram':
+                channel = st.sidebar.selectbox("Channel for the spectrogram", range(len(labels)),
+                                               format_func=lambda i: labels[i])
+            with profiler.stage('spectrum'):
+                spectrum_fig = plot_spectrum(store, labels, spectrum_kind, nfft, window_fn, dataset_key, window,
+                                             channel)
+            st.plotly_chart(spectrum_fig, key='spectrum')
 
-            
-            # 1つ目のY軸のタイトルを設定します。
-            y1_title = ', '.join([col for col in df.columns[1:] if col != secondary_y])
-            fig.update_layout(yaxis1=dict(title_text=y1_title))
+    # 計測結果をサイドバーに表示します。
+    timings = profiler.finish()
+    if timings is not None:
+        with st.sidebar.expander("Profiling", expanded=True):
+            st.dataframe(timings, hide_index=True)
+            st.caption(f"Total: {timings['wall_ms'].sum():.1f} ms")
+            # プロセス全体で共有しているデータセットの状況を表示します。
+            st.dataframe([dataset_registry.metrics()], hide_index=True)
+            if disk_cache.enabled:
+                st.dataframe([disk_cache.metrics()], hide_index=True)
 
-            # プロットを表示します。
-            st.plotly_chart(fig)
+    # 監視中は一定時間ごとに追加された行を確認し、追加された場合だけ全体を再実行します。
+    if tail is not None and follow:
+        st.fragment(run_every=refresh)(poll_tail)(tail)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from channel_store import STORE_VERSION, ChannelStore, read_store_meta
+from decimation import MinMaxPyramid
+from stats_index import StatsIndex
+
+# キャッシュの形式のバージョン。保存する内容を変えたときは数字を上げます。
+# バージョンごとに別のディレクトリに保存するため、古い形式のエントリは読まれず、追い出しのときに削除されます。
+CACHE_VERSION = 1
+
+# ディスクに保持するエントリの合計サイズの上限（MB）。環境変数で変更できます。
+DEFAULT_DISK_MAX_MB = int(os.environ.get('TEK_DISK_CACHE_MAX_MB', '10240'))
+
+# 書き込み途中で終了したプロセスの一時ディレクトリを削除するまでの時間（秒）。
+STALE_SECONDS = 3600
+
+# 読み込みと追い出しの状況を出力するロガー。
+logger = logging.getLogger('tek.disk_cache')
+
+
+def _layout():
+    # ピラミッドや統計インデックスの区間の大きさが変わると、保存した配列は使えなくなります。
+    return {
+        'version': CACHE_VERSION,
+        'pyramid': [MinMaxPyramid.BASE_BLOCK, MinMaxPyramid.FACTOR],
+        'stats_block': StatsIndex.BLOCK,
+    }
+
+
+def _dir_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path):
+    """
+    この関数はディレクトリを一時的な名前に変えてから削除します。
+    名前の変更は一瞬で終わるため、他のセッションが削除途中のエントリを読むことはありません。
+    :return: 削除した場合はTrue。他のセッションが先に削除していた場合はFalse。
+    """
+    trash = os.path.join(os.path.dirname(path), f'.trash-{os.getpid()}-{time.monotonic_ns()}')
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+class DiskCache:
+    """
+    このクラスは解析済みのデータをディスクに保持するキャッシュです。サーバーを再起動しても残ります。
+    内容のハッシュごとに1つのディレクトリを作り、チャンネルの配列とプリアンブルなどのメタデータ、
+    統計インデックス、最小値・最大値のピラミッドを保存します。配列はメモリマップで開くので、開くのはすぐに終わります。
+    書き込みは一時ディレクトリに行ってから名前を変えるため、複数のセッションやプロセスが同時に使っても、
+    書き込み途中のエントリを読むことはありません。合計サイズが上限を超えると、最も長く使われていないものから削除します。
+    """
+
+    def __init__(self, directory=None, max_mb=DEFAULT_DISK_MAX_MB):
+        """
+        :param directory: キャッシュのディレクトリ。Noneの場合は何も保存しません。
+        :param max_mb: ディスクに保持するエントリの合計サイズの上限（MB）。
+        """
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self._counts = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    @property
+    def version_dir(self):
+        return os.path.join(self.directory, f'v{STORE_VERSION}.{CACHE_VERSION}')
+
+    def _entry_dir(self, key):
+        return os.path.join(self.version_dir, key)
+
+    def load(self, key):
+        """
+        この関数はキーに対応するエントリを開きます。
+        :param key: データセットを表すキー（内容のハッシュ）。
+        :return: (ChannelStore, チャンネルの位置をキーとするMinMaxPyramidの辞書, StatsIndex)。
+                 エントリがない場合や形式が異なる場合はNone。
+        """
+        if not self.enabled:
+            return None
+        directory = self._entry_dir(key)
+        meta = read_store_meta(directory)
+        if meta is None or meta.get('cache') != _layout():
+            self._counts['misses'] += 1
+            return None
+        try:
+            store = ChannelStore.load(directory, mmap=True)
+            pyramids = {}
+            for i, channel in enumerate(store.channels):
+                with np.load(os.path.join(directory, f'pyramid_{i}.npz')) as arrays:
+                    pyramids[i] = MinMaxPyramid.from_arrays(channel, dict(arrays))
+            with np.load(os.path.join(directory, 'stats.npz')) as arrays:
+                stats = StatsIndex.from_arrays(store.channels, dict(arrays))
+        except (OSError, ValueError, KeyError):
+            # 読み込み中に他のセッションが追い出した場合は、見つからなかったものとして扱います。
+            self._counts['misses'] += 1
+            return None
+        # 最終更新時刻を最後に使った時刻として、追い出す順番に使います。
+        try:
+            os.utime(directory)
+        except OSError:
+            pass
+        self._counts['hits'] += 1
+        logger.info('loaded %s from %s', key, directory)
+        return store, pyramids, stats
+
+    def save(self, key, store, pyramids, stats):
+        """
+        この関数は解析済みのデータをエントリとして保存し、上限を超えた分を古い順に削除します。
+        他のセッションが先に同じエントリを保存していた場合は、書き込んだものを捨てます。
+        :param key: データセットを表すキー（内容のハッシュ）。
+        :param store: ChannelStore。
+        :param pyramids: チャンネルの位置をキーとするMinMaxPyramidの辞書。
+        :param stats: StatsIndex。
+        """
+        if not self.enabled:
+            return
+        # 上限より大きいデータは保存しません。
+        if store.nbytes > self.max_bytes:
+            return
+        directory = self._entry_dir(key)
+        if os.path.isdir(directory):
+            return
+        os.makedirs(self.version_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.version_dir)
+        try:
+            store.save(tmp, cache=_layout())
+            for i, pyramid in pyramids.items():
+                np.savez(os.path.join(tmp, f'pyramid_{i}.npz'), **pyramid.to_arrays())
+            np.savez(os.path.join(tmp, 'stats.npz'), **stats.to_arrays())
+            os.rename(tmp, directory)
+        except OSError:
+            # 同じ名前のディレクトリがある場合は、他のセッションが先に保存しています。
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._counts['writes'] += 1
+        logger.info('saved %s to %s', key, directory)
+        self.evict()
+
+    def entries(self):
+        """
+        この関数は現在の形式のエントリを、最後に使った時刻の古い順に返します。
+        :return: (最後に使った時刻, バイト数, ディレクトリ)のリスト。
+        """
+        entries = []
+        try:
+            scan = list(os.scandir(self.version_dir))
+        except OSError:
+            return entries
+        for entry in scan:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, _dir_size(entry.path), entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        この関数は古い形式のエントリと、書き込み途中で残った一時ディレクトリを削除し、
+        合計サイズが上限以下になるまで、最も長く使われていないエントリから削除します。
+        """
+        if not self.enabled:
+            return
+        current = os.path.basename(self.version_dir)
+        try:
+            versions = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in versions:
+            if entry.is_dir() and entry.name.startswith('v') and entry.name != current:
+                if _remove(entry.path):
+                    logger.info('removed old format %s', entry.path)
+
+        now = time.time()
+        try:
+            leftovers = [e for e in os.scandir(self.version_dir) if e.name.startswith('.')]
+        except OSError:
+            leftovers = []
+        for entry in leftovers:
+            try:
+                stale = now - entry.stat().st_mtime > STALE_SECONDS
+            except OSError:
+                continue
+            if entry.name.startswith('.trash-') or stale:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        entries = self.entries()
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, path in entries:
+            if total <= self.max_bytes:
+                break
+            # メモリマップで開いているセッションは、削除した後もそのまま読み続けられます。
+            if _remove(path):
+                self._counts['evictions'] += 1
+                logger.info('evicted %s (%d bytes)', path, nbytes)
+            total -= nbytes
+
+    def metrics(self):
+        """
+        この関数はキャッシュの状況を返します。
+        :return: ヒット・ミス・書き込み・削除の回数、エントリの数、ディスク上のバイト数の辞書。
+        """
+        entries = self.entries() if self.enabled else []
+        return {
+            **self._counts,
+            'entries': len(entries),
+            'disk_mb': sum(nbytes for _, nbytes, _ in entries) / 1024 / 1024,
+            'max_mb': self.max_bytes / 1024 / 1024,
+        }
+
+
+# TEK_CACHE_DIRを指定すると、解析済みのデータをそのディレクトリに保存し、再起動後も使います。
+disk_cache = DiskCache(os.environ.get('TEK_CACHE_DIR'))
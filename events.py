@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+from tek_cache import ParseCache
+
+# イベントの種類。
+EVENT_KINDS = ['Rising edge', 'Falling edge', 'Runt', 'Pulse width']
+
+# 一度に処理するサンプル数。一時配列の大きさを抑えます。
+CHUNK_SAMPLES = 1 << 22
+
+# チャンネルごとのイベントインデックスを保持するキャッシュ。
+event_cache = ParseCache(max_mb=64)
+
+
+def _level_runs(y, low, high, start=0, prev=None):
+    """
+    この関数はデータを3つのレベル（0: low以下, 1: lowとhighの間, 2: high以上）に分け、
+    同じレベルが続く区間（ラン）の開始位置とレベルを返します。
+    チャンクごとに処理しますが、データ全体を1回だけ走査します。
+    :param start: 走査を始める位置。これより前は走査済みとします。
+    :param prev: start - 1のサンプルのレベル。Noneの場合はstartから新しいランを始めます。
+    :return: (ランの開始位置の配列, ランのレベルの配列)
+    """
+    starts = []
+    levels = []
+    for offset in range(start, len(y), CHUNK_SAMPLES):
+        chunk = np.asarray(y[offset:offset + CHUNK_SAMPLES])
+        level = (chunk > low).astype(np.int8) + (chunk >= high)
+        change = np.flatnonzero(level[1:] != level[:-1]) + 1
+        if prev is None or level[0] != prev:
+            change = np.concatenate([[0], change])
+        starts.append(offset + change)
+        levels.append(level[change])
+        prev = level[-1]
+    if not starts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+    return np.concatenate(starts).astype(np.int64), np.concatenate(levels)
+
+
+class EventIndex:
+    """
+    このクラスは1つのチャンネルのイベント（ヒステリシス付きのしきい値交差、立ち上がり・立ち下がりエッジ、
+    ラントパルス）の位置を保持します。作成はデータを1回走査するだけで、検索は二分探索で行います。
+    """
+
+    def __init__(self, y, low, high):
+        """
+        :param y: チャンネルのデータ（1次元のNumPy配列）。
+        :param low: 下側のしきい値。
+        :param high: 上側のしきい値。lowより小さい場合は入れ替えます。
+        """
+        self.low, self.high = sorted((float(low), float(high)))
+        self.n = 0
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._levels = np.zeros(0, dtype=np.int8)
+        self.extend(y)
+
+    def extend(self, y):
+        """
+        この関数は末尾にデータが追加されたチャンネルに合わせてインデックスを更新します。
+        追加されたサンプルだけを走査するため、計算量は追加されたサンプル数とイベントの数に比例します。
+        :param y: 追加後のチャンネルのデータ。追加前のデータと先頭部分が同じである必要があります。
+        """
+        prev = self._levels[-1] if len(self._levels) else None
+        starts, levels = _level_runs(y, self.low, self.high, self.n, prev)
+        self._starts = np.concatenate([self._starts, starts])
+        self._levels = np.concatenate([self._levels, levels])
+        self.n = len(y)
+        self._find_events(self._starts, self._levels)
+
+    def _find_events(self, starts, levels):
+        # 中間のレベルを除くと、ヒステリシス付きのエッジが残ります。
+        # エッジの位置は、反対側のしきい値を越えた最初のサンプルです。
+        outer = np.flatnonzero(levels != 1)
+        lv = levels[outer]
+        edges = outer[np.flatnonzero(lv[1:] != lv[:-1]) + 1]
+        rising = edges[levels[edges] == 2]
+        falling = edges[levels[edges] == 0]
+        self.rising = starts[rising]
+        self.falling = starts[falling]
+
+        # エッジの直前のランが中間のレベルなら、その開始位置が遷移の始まり（最初のしきい値を越えた位置）です。
+        # 1サンプルで両方のしきい値を越えた場合は、エッジの位置と同じにします。
+        self.rise_start = np.where(levels[rising - 1] == 1, starts[rising - 1], self.rising)
+        self.fall_start = np.where(levels[falling - 1] == 1, starts[falling - 1], self.falling)
+
+        # 片方のしきい値を越えたのに、もう片方のしきい値に届かずに戻ったパルスがラントです。
+        # 正のラントは0→1→0、負のラントは2→1→2のレベルの並びです。
+        mid = np.flatnonzero(levels[1:-1] == 1) + 1
+        runt = mid[levels[mid - 1] == levels[mid + 1]]
+        self.runt = starts[runt]
+        self.runt_end = starts[runt + 1]
+
+    @property
+    def nbytes(self):
+        arrays = (self._starts, self._levels, self.rising, self.falling, self.rise_start, self.fall_start, self.runt,
+                  self.runt_end)
+        return sum(a.nbytes for a in arrays)
+
+    def pulse_widths(self):
+        """
+        この関数は正のパルス（立ち上がりエッジから次の立ち下がりエッジまで）の開始位置と終了位置を返します。
+        :return: (開始位置の配列, 終了位置の配列)
+        """
+        if len(self.rising) == 0:
+            return self.rising, self.rising
+        # エッジは交互に並ぶため、最初の立ち上がりより後の立ち下がりを順に対応させます。
+        falling = self.falling[np.searchsorted(self.falling, self.rising[0]):]
+        m = min(len(self.rising), len(falling))
+        return self.rising[:m], falling[:m]
+
+    def positions(self, kind, time=None, min_width=None, max_width=None):
+        """
+        この関数は指定した種類のイベントの位置を返します。
+        :param kind: EVENT_KINDSのいずれか。
+        :param time: TIMEの配列。Pulse widthで幅を秒で比べるときに使います。
+        :param min_width: これより短いパルスを違反とします（秒）。
+        :param max_width: これより長いパルスを違反とします（秒）。
+        :return: イベントの位置（昇順）。
+        """
+        if kind == 'Rising edge':
+            return self.rising
+        if kind == 'Falling edge':
+            return self.falling
+        if kind == 'Runt':
+            return self.runt
+        if kind == 'Pulse width':
+            start, stop = self.pulse_widths()
+            width = time[stop] - time[start]
+            bad = np.zeros(len(start), dtype=bool)
+            if min_width:
+                bad |= width < min_width
+            if max_width:
+                bad |= width > max_width
+            return start[bad]
+        raise ValueError(f'不明なイベントの種類です: {kind}')
+
+    def table(self, kind, time, min_width=None, max_width=None):
+        """
+        この関数はイベントの一覧の表を返します。
+        :return: 位置、時刻、パルス幅（Pulse widthとRuntの場合）を持つDataFrame。
+        """
+        pos = self.positions(kind, time, min_width, max_width)
+        df = pd.DataFrame({'index': pos, 'time': time[pos]})
+        if kind == 'Pulse width':
+            start, stop = self.pulse_widths()
+            ends = stop[np.searchsorted(start, pos)]
+            df['width'] = time[ends] - time[pos]
+        elif kind == 'Runt':
+            df['width'] = time[self.runt_end] - time[pos]
+        return df
+
+
+def nearest(positions, position, direction=0):
+    """
+    この関数はイベントの位置の中から、指定した位置に最も近いもの、または次・前のものを二分探索で探します。
+    :param positions: イベントの位置（昇順）。
+    :param position: 基準の位置。
+    :param direction: 1なら次、-1なら前、0なら最も近いイベント。
+    :return: イベントの番号。見つからない場合はNone。
+    """
+    if len(positions) == 0:
+        return None
+    if direction > 0:
+        k = int(np.searchsorted(positions, position, 'right'))
+        return k if k < len(positions) else None
+    if direction < 0:
+        k = int(np.searchsorted(positions, position, 'left')) - 1
+        return k if k >= 0 else None
+    k = int(np.searchsorted(positions, position))
+    candidates = [c for c in (k - 1, k) if 0 <= c < len(positions)]
+    return min(candidates, key=lambda c: abs(int(positions[c]) - position))
+
+
+def build_events(channel, low, high, cache_key=None):
+    """
+    この関数はチャンネルのEventIndexを作成します。
+    cache_keyを指定した場合、作成したインデックスをキャッシュします。
+    監視中のファイルのように行が追加された場合は、キャッシュしたインデックスを追加された行の分だけ更新します。
+    :param channel: チャンネルの配列。
+    :param low: 下側のしきい値。
+    :param high: 上側のしきい値。
+    :param cache_key: (データセット, チャンネル)を表すキー。
+    :return: EventIndex。
+    """
+    key = None if cache_key is None else ('events', cache_key, float(low), float(high))
+    events = None if key is None else event_cache.get(key)
+    if events is None or events.n > len(channel):
+        events = EventIndex(channel, low, high)
+    elif events.n < len(channel):
+        events.extend(channel)
+    else:
+        return events
+    if key is not None:
+        # 大きさが変わるので、追加し直して合計サイズを更新します。
+        event_cache.put(key, events)
+    return events
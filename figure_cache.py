@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from tek_cache import ParseCache
+
+# トレースの配列の送り方。Float64は間引いた配列をそのまま送ります。
+# Compactは精度が足りる場合はfloat32にし、等間隔のTIMEは配列の代わりにx0とdxだけを送ります。
+ENCODINGS = ['Float64', 'Compact']
+
+# 検証済みのトレースのデータを保持するキャッシュ。
+trace_cache = ParseCache(max_mb=256)
+
+
+def to_float32(values, tolerance=0.0):
+    """
+    この関数はfloat32にしたときの誤差がtolerance以下であれば、float32の配列を返します。
+    誤差が大きい場合は元の配列をそのまま返します。
+    :param values: 配列。
+    :param tolerance: 許容する誤差の絶対値。
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32 or len(values) == 0:
+        return values
+    compact = values.astype(np.float32)
+    if np.nanmax(np.abs(compact - values)) > tolerance:
+        return values
+    return compact
+
+
+def trace_arrays(x, y, encoding='Float64', tolerance=0.0):
+    """
+    この関数はトレースに渡すx, yの引数を、指定した送り方で作成します。
+    Plotlyは配列を型付きのbase64で送るため、float32にするとデータの大きさが半分になります。
+    :param x: TIMEの配列。
+    :param y: チャンネルの配列。
+    :param encoding: ENCODINGSのいずれか。
+    :param tolerance: TIMEをfloat32や等間隔とみなすときに許容する誤差（秒）。サンプル間隔の半分などを指定します。
+    :return: go.Scatterなどに渡す引数の辞書。
+    """
+    if encoding == 'Float64':
+        return dict(x=x, y=y)
+    if encoding != 'Compact':
+        raise ValueError(f'不明な送り方です: {encoding}')
+    x = np.asarray(x, dtype=np.float64)
+    y = to_float32(y)
+    n = len(x)
+    if n >= 2:
+        # 等間隔であれば、最初の時刻と間隔だけを送ります。
+        dx = (x[-1] - x[0]) / (n - 1)
+        if np.abs(x - (x[0] + np.arange(n) * dx)).max() <= tolerance:
+            return dict(x0=float(x[0]), dx=float(dx), y=y)
+    return dict(x=to_float32(x, tolerance), y=y)
+
+
+def payload_size(fig):
+    """
+    この関数はStreamlitと同じ方法で図をJSONに変換し、ブラウザに送るデータの大きさを求めます。
+    :param fig: go.Figure。
+    :return: (バイト数, 変換にかかった時間（秒）)
+    """
+    t0 = time.perf_counter()
+    spec = pio.to_json(fig, validate=False)
+    return len(spec), time.perf_counter() - t0
+
+
+def cached_traces(key, build):
+    """
+    この関数は(データセット, 表示範囲, チャンネル)などのキーごとに、検証済みのトレースの辞書をキャッシュします。
+    トレースの作成と検証はデータの大きさに比例して時間がかかるため、キーが変わったときだけ行います。
+    表示名やY軸の割り当ては含めないので、名前を変更したり軸の範囲を変えたりしても作り直しません。
+    :param key: キャッシュのキー。Noneの場合はキャッシュしません。
+    :param build: トレース（go.Scatterなど）のリストを返す関数。
+    :return: トレースの辞書のリスト。
+    """
+    traces = None if key is None else trace_cache.get(key)
+    if traces is None:
+        traces = [trace.to_plotly_json() for trace in build()]
+        if key is not None:
+            trace_cache.put(key, traces)
+    return traces
+
+
+def assemble(traces, names, yaxes, **layout):
+    """
+    この関数はキャッシュしたトレースに表示名とY軸を当て、レイアウトを設定した図を作成します。
+    トレースは検証済みなので検証を省略し、配列はコピーせずに共有します。検証するのはレイアウトだけです。
+    :param traces: cached_tracesで作成したトレースの辞書のリスト。
+    :param names: 各トレースの表示名のリスト。
+    :param yaxes: 各トレースを表示するY軸（'y'または'y2'）のリスト。
+    :param layout: go.Layoutに渡すレイアウトの設定。
+    :return: go.Figure。
+    """
+    data = [dict(trace, name=name, yaxis=yaxis) for trace, name, yaxis in zip(traces, names, yaxes)]
+    return go.Figure(dict(data=data, layout=go.Layout(**layout)), _validate=False)
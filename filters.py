@@ -0,0 +1,213 @@
+import numpy as np
+from scipy import ndimage, signal
+
+from channel_store import CHANNEL_DTYPE, ChannelStore
+from decimation import MinMaxPyramid
+from spectrum import sample_rate
+from tek_cache import ParseCache
+
+# フィルタの種類。
+FILTER_KINDS = ['Low-pass', 'Band-stop 50 Hz', 'Band-stop 60 Hz', 'Moving average']
+
+# 帯域除去フィルタの中心周波数とQ値。
+NOTCH_FREQUENCIES = {'Band-stop 50 Hz': 50.0, 'Band-stop 60 Hz': 60.0}
+NOTCH_Q = 30.0
+
+# 一度に処理するサンプル数。前後に重ねる部分を加えても、一時配列の大きさはチャンネル数 * (CHUNK_SAMPLES + 2 * 重なり)です。
+CHUNK_SAMPLES = 1 << 20
+# 重ねる部分の上限。インパルス応答がこれより長いフィルタでは、チャンクの境界にわずかな誤差が残ります。
+MAX_OVERLAP = 1 << 20
+# インパルス応答がこの割合まで減衰する長さを、チャンクの前後に重ねる長さにします。
+DECAY_TOLERANCE = 1e-9
+
+# フィルタを掛けたチャンネルを保持するキャッシュ。
+# 大きなデータセットでは結果が上限を超えることがあるため、最後に作成した結果は上限に関わらず保持し、
+# フィルタの設定を変えない限り、再実行のたびにフィルタを掛け直さないようにします。
+filter_cache = ParseCache(max_mb=256, keep_latest=True)
+
+
+def design_sos(kind, fs, cutoff=None, order=4):
+    """
+    この関数はフィルタの係数を2次セクション（SOS）の形式で設計します。
+    :param kind: Low-pass, Band-stop 50 Hz, Band-stop 60 Hz のいずれか。
+    :param fs: サンプリング周波数（Hz）。
+    :param cutoff: Low-passの遮断周波数（Hz）。
+    :param order: Low-passの次数。
+    :return: SOSの係数の配列。
+    """
+    if kind == 'Low-pass':
+        if cutoff is None or not 0 < cutoff < fs / 2:
+            raise ValueError(f'遮断周波数はナイキスト周波数（{fs / 2:.6g} Hz）より小さくしてください。')
+        return signal.butter(order, cutoff, 'lowpass', fs=fs, output='sos')
+    if kind in NOTCH_FREQUENCIES:
+        f0 = NOTCH_FREQUENCIES[kind]
+        if not f0 < fs / 2:
+            raise ValueError(f'サンプリング周波数が低すぎるため、{f0:g} Hzを除去できません。')
+        b, a = signal.iirnotch(f0, NOTCH_Q, fs=fs)
+        return signal.tf2sos(b, a)
+    raise ValueError(f'不明なフィルタの種類です: {kind}')
+
+
+def sos_overlap(sos):
+    """
+    この関数はチャンクの前後に重ねるサンプル数を、インパルス応答が十分に減衰する長さから求めます。
+    :param sos: SOSの係数の配列。
+    """
+    _, poles, _ = signal.sos2zpk(sos)
+    radius = np.abs(poles).max() if len(poles) else 0.0
+    if radius <= 0:
+        return 2 * len(sos)
+    if radius >= 1:
+        return MAX_OVERLAP
+    return int(min(np.ceil(np.log(DECAY_TOLERANCE) / np.log(radius)), MAX_OVERLAP))
+
+
+def _chunked(channels, overlap, func, first=0, out=None):
+    """
+    この関数は全チャンネルを2次元配列にまとめ、前後をoverlapだけ重ねたチャンクごとにfuncを適用します。
+    重ねた部分は捨てるため、チャンクの境界でも全体に一度で適用した場合とほぼ同じ結果になります。
+    :param channels: 各チャンネルの配列のリスト（同じ長さ）。
+    :param overlap: チャンクの前後に重ねるサンプル数。
+    :param func: (チャンネル数, サンプル数)のfloat64の配列を受け取り、同じ形の配列を返す関数。
+    :param first: 結果を計算する最初のサンプル。これより前のサンプルは、重ねる部分としてだけ使います。
+    :param out: 結果を書き込む配列のリスト。Noneの場合は新しく作成します。
+    :return: 各チャンネルの結果（float32）のリスト。
+    """
+    n = len(channels[0]) if channels else 0
+    if out is None:
+        out = [np.empty(n, dtype=CHANNEL_DTYPE) for _ in channels]
+    for start in range(first, n, CHUNK_SAMPLES):
+        stop = min(start + CHUNK_SAMPLES, n)
+        lo = max(start - overlap, 0)
+        hi = min(stop + overlap, n)
+        block = np.stack([np.asarray(ch[lo:hi], dtype=np.float64) for ch in channels])
+        result = func(block)
+        for dst, row in zip(out, result):
+            dst[start:stop] = row[start - lo:stop - lo]
+    return out
+
+
+def filter_channels(channels, fs, kind, cutoff=None, order=4, length=101):
+    """
+    この関数は全チャンネルに位相遅れのない（ゼロ位相の）フィルタを掛けます。
+    Low-passと帯域除去はSOSフィルタを前後両方向に掛け（sosfiltfilt）、移動平均は中心をそろえて計算します。
+    :param channels: 各チャンネルの配列のリスト（同じ長さ）。
+    :param fs: サンプリング周波数（Hz）。
+    :param kind: FILTER_KINDSのいずれか。
+    :param cutoff: Low-passの遮断周波数（Hz）。
+    :param order: Low-passの次数。
+    :param length: 移動平均のサンプル数。
+    :return: 各チャンネルの結果（float32）のリスト。
+    """
+    overlap, func = _filter_func(fs, kind, cutoff, order, length)
+    return _chunked(channels, overlap, func)
+
+
+def _filter_func(fs, kind, cutoff=None, order=4, length=101):
+    """
+    この関数はフィルタを2次元配列に適用する関数と、チャンクの前後に重ねるサンプル数を返します。
+    :return: (重ねるサンプル数, 関数)。
+    """
+    if kind == 'Moving average':
+        length = max(int(length), 1)
+        return length, lambda block: ndimage.uniform_filter1d(block, length, axis=-1, mode='nearest')
+    sos = design_sos(kind, fs, cutoff, order)
+    return sos_overlap(sos), lambda block: signal.sosfiltfilt(sos, block, axis=-1)
+
+
+def filter_label(kind, cutoff=None, order=4, length=101):
+    """
+    この関数はフィルタを掛けたトレースの表示名に付ける説明を返します。
+    """
+    if kind == 'Low-pass':
+        return f'LPF {cutoff:.3g} Hz, order {order}'
+    if kind == 'Moving average':
+        return f'MA {int(length)}'
+    return kind
+
+
+class IncrementalFilter:
+    """
+    このクラスはフィルタを掛けたチャンネルとそのピラミッドを保持し、行が追加されたときに末尾だけを計算し直します。
+    ゼロ位相のフィルタでは、各サンプルの結果はその後ろのoverlapサンプルにも依存するため、
+    追加前の末尾overlapサンプルと追加された行だけを計算し直せば、全体を計算し直した場合とほぼ同じ結果になります。
+    監視モードで再実行のたびにファイル全体にフィルタを掛け直さないようにするために使います。
+    """
+
+    def __init__(self, fs, kind, cutoff=None, order=4, length=101):
+        """
+        :param fs: サンプリング周波数（Hz）。
+        :param kind: FILTER_KINDSのいずれか。
+        :param cutoff: Low-passの遮断周波数（Hz）。
+        :param order: Low-passの次数。
+        :param length: 移動平均のサンプル数。
+        """
+        self.overlap, self._func = _filter_func(fs, kind, cutoff, order, length)
+        self.label = filter_label(kind, cutoff, order, length)
+        self.n = 0
+        # フィルタを掛けたチャンネル。TIMEは元のデータセットの配列なので、追い出されたデータセットを
+        # このオブジェクトが参照し続けないように保持せず、extendのたびに渡されたものを使います。
+        self.channels = None
+        self.pyramids = {}
+        # 行が追加されるたびに確保し直さないように、容量に余裕を持たせた配列です。
+        self._buffers = []
+
+    @property
+    def nbytes(self):
+        return (sum(b.nbytes for b in self._buffers)
+                + sum(p.nbytes for p in self.pyramids.values()))
+
+    def extend(self, store):
+        """
+        この関数は前回から追加された行にフィルタを掛け、結果とピラミッドを更新します。
+        :param store: 前回と同じデータセットのChannelStore。前回より行が増えていることがあります。
+        :return: フィルタを掛けたChannelStore。meta['filter']にフィルタの説明が入ります。
+        """
+        n = len(store)
+        if self.channels is not None and n == self.n:
+            return ChannelStore(store.time, self.channels, store.names, {'filter': self.label})
+        # 追加前の末尾overlapサンプルは、追加された行によって結果が変わります。
+        first = max(self.n - self.overlap, 0)
+        capacity = len(self._buffers[0]) if self._buffers else 0
+        if n > capacity:
+            # 最初は必要な分だけ確保し、行が追加されたときは2倍ずつ増やします。
+            size = n if not self._buffers else max(n, 2 * capacity)
+            buffers = [np.empty(size, dtype=CHANNEL_DTYPE) for _ in store.channels]
+            for dst, src in zip(buffers, self._buffers):
+                dst[:first] = src[:first]
+            self._buffers = buffers
+        _chunked(store.channels, self.overlap, self._func, first, self._buffers)
+        self.channels = [b[:n] for b in self._buffers]
+        for i, channel in enumerate(self.channels):
+            if i in self.pyramids:
+                self.pyramids[i].truncate(first)
+                self.pyramids[i].extend(channel)
+            else:
+                self.pyramids[i] = MinMaxPyramid(channel)
+        self.n = n
+        return ChannelStore(store.time, self.channels, store.names, {'filter': self.label})
+
+
+def apply_filter(store, kind, cutoff=None, order=4, length=101, cache_key=None):
+    """
+    この関数はChannelStoreの全チャンネルにフィルタを掛け、同じTIMEを持つChannelStoreと、そのピラミッドを返します。
+    cache_keyを指定した場合、結果をキャッシュします。監視モードで行が追加された場合は、追加された部分だけを計算します。
+    :param store: ChannelStore。
+    :param kind: FILTER_KINDSのいずれか。
+    :param cutoff: Low-passの遮断周波数（Hz）。
+    :param order: Low-passの次数。
+    :param length: 移動平均のサンプル数。
+    :param cache_key: データセットを表すキー。
+    :return: (フィルタを掛けたChannelStore, チャンネルの位置をキーとするMinMaxPyramidの辞書)。
+             ChannelStoreのmeta['filter']にフィルタの説明が入ります。
+    """
+    key = None if cache_key is None else ('filter', cache_key, kind, cutoff, order, length)
+    incremental = None if key is None else filter_cache.get(key)
+    if incremental is None or incremental.n > len(store):
+        incremental = IncrementalFilter(sample_rate(store.time), kind, cutoff, order, length)
+    n = incremental.n
+    filtered = incremental.extend(store)
+    if key is not None and incremental.n != n:
+        # 追加された行の分だけ大きさが変わるので、入れ直して合計サイズを更新します。
+        filter_cache.put(key, incremental)
+    return filtered, incremental.pyramids
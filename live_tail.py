@@ -0,0 +1,184 @@
+import io
+import os
+
+import numpy as np
+
+from channel_store import CHANNEL_DTYPE, TIME_DTYPE, ChannelStore
+from decimation import MinMaxPyramid
+from stats_index import StatsIndex
+from tek_loader import _read_body, find_header
+from tek_preamble import Preamble
+
+# プリアンブルにレコード長がない場合に最初に確保する行数。足りなくなったら2倍ずつ大きくします。
+INITIAL_CAPACITY = 64 * 1024
+
+
+def _grow(array, capacity, rows):
+    """
+    この関数は配列を大きくし、先頭のrows行をコピーした新しい配列を返します。
+    """
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:rows] = array[:rows]
+    return grown
+
+
+class ChannelAppender:
+    """
+    このクラスはCSVのデータ部分をバイト列で少しずつ受け取り、配列の末尾に追加します。
+    まだ改行が書き込まれていない最後の行は、次のバイト列まで持ち越します。
+    ピラミッドと統計インデックスも、追加された部分だけを計算して更新します。
+    TailReaderと、アップロードを少しずつ読み込むChunkedLoaderで使います。
+    """
+
+    def _reset(self):
+        self.partial = b''
+        self.columns = None
+        self.meta = {}
+        self.capacity = INITIAL_CAPACITY
+        self.rows = 0
+        self._time = None
+        self._channels = None
+        self.store = None
+        self.pyramids = None
+        self.stats = None
+
+    def _set_header(self, header_row, columns, preamble):
+        """
+        この関数はヘッダー行の情報を覚えます。プリアンブルにレコード長があれば、その行数の配列を最初に確保します。
+        """
+        self.columns = columns
+        self.meta = {'header_row': header_row, 'preamble': preamble}
+        self.capacity = Preamble.parse(preamble).record_length or INITIAL_CAPACITY
+
+    def _feed(self, data, final=False):
+        """
+        この関数はデータ部分のバイト列を受け取り、改行で終わる行までを解析して追加します。
+        :param data: 前回の続きのバイト列。
+        :param final: Trueの場合、改行で終わっていない最後の行も解析します。
+        :return: 追加された行数。
+        """
+        # 改行で終わっていない最後の行は、次のバイト列まで持ち越します。
+        data = self.partial + data
+        end = len(data) if final else data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        if not data[:end].strip():
+            return 0
+
+        df = _read_body(io.BytesIO(data[:end]), self.columns, 0, CHANNEL_DTYPE)
+        self._append(df)
+        return len(df)
+
+    def _append(self, df):
+        """
+        この関数は読み込んだ行を配列の末尾に追加し、ピラミッドと統計インデックスを更新します。
+        配列は2倍ずつ大きくするため、1行あたりのコピーの回数は平均して一定です。
+        """
+        rows = self.rows + len(df)
+        if self._time is None:
+            capacity = max(rows, self.capacity)
+            self._time = np.empty(capacity, dtype=TIME_DTYPE)
+            self._channels = [np.empty(capacity, dtype=CHANNEL_DTYPE) for _ in self.columns[1:]]
+        elif rows > len(self._time):
+            capacity = max(rows, 2 * len(self._time))
+            self._time = _grow(self._time, capacity, self.rows)
+            self._channels = [_grow(ch, capacity, self.rows) for ch in self._channels]
+
+        self._time[self.rows:rows] = df.iloc[:, 0].to_numpy(dtype=TIME_DTYPE)
+        for channel, col in zip(self._channels, self.columns[1:]):
+            channel[self.rows:rows] = df[col].to_numpy(dtype=CHANNEL_DTYPE)
+        self.rows = rows
+
+        # 配列のうち読み込んだ部分だけのビューを渡します。
+        self.attach(ChannelStore(self._time[:rows], [ch[:rows] for ch in self._channels], self.columns[1:],
+                                 self.meta))
+
+    def attach(self, store):
+        """
+        この関数はstoreを現在のデータとし、ピラミッドと統計インデックスを追加された部分だけ更新します。
+        行数が同じstore（ディスクに書き出したものなど）を渡した場合は、その配列を参照するように切り替えるだけです。
+        :param store: ChannelStore。
+        """
+        self.store = store
+        if self.pyramids is None:
+            self.pyramids = {i: MinMaxPyramid(ch) for i, ch in enumerate(store.channels)}
+            self.stats = StatsIndex(store.channels)
+        else:
+            for i, ch in enumerate(store.channels):
+                self.pyramids[i].extend(ch)
+            self.stats.extend(store.channels)
+
+
+class TailReader(ChannelAppender):
+    """
+    このクラスは書き込み中のCSVファイルを監視し、追加された行だけを読み込みます。
+    読み込んだバイト位置と、まだ改行が書き込まれていない最後の行を覚えておくことで、
+    ポーリングのたびの計算量はファイル全体ではなく、追加された行数に比例します。
+    """
+
+    def __init__(self, path, encoding='shift-jis', header_marker='TIME'):
+        """
+        :param path: 監視するCSVファイルへのパス。
+        :param encoding: CSVファイルのエンコーディング。
+        :param header_marker: ヘッダー行の先頭の文字列。
+        """
+        self.path = path
+        self.encoding = encoding
+        self.header_marker = header_marker
+        # ファイルが作り直されるたびに増やし、キャッシュのキーに使います。
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        super()._reset()
+        self.offset = 0
+
+    @property
+    def key(self):
+        """
+        この関数はデータセットを表すキーを返します。データは末尾に追加されるだけなので、
+        同じ行の範囲の間引きの結果は、ファイルが作り直されるまで使い回せます。
+        """
+        return f'tail:{os.path.abspath(self.path)}:{self.generation}'
+
+    def poll(self):
+        """
+        この関数は前回から追加された行を読み込みます。
+        :return: 追加された行数。
+        :raises ValueError: 追加された行を解析できない場合。読み込み位置は進めないので、次のポーリングで読み直します。
+        """
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            # ファイルが小さくなった場合は、新しいファイルに置き換えられたとみなして最初から読み直します。
+            self.generation += 1
+            self._reset()
+
+        with open(self.path, 'rb') as f:
+            if self.columns is None and not self._read_header(f):
+                return 0
+            f.seek(self.offset)
+            data = f.read()
+        partial = self.partial
+        try:
+            added = self._feed(data)
+        except ValueError:
+            # 解析できなかったバイト列は読まなかったことにして、これまでに読み込んだデータはそのまま残します。
+            self.partial = partial
+            raise
+        self.offset += len(data)
+        return added
+
+    def _read_header(self, f):
+        """
+        この関数はヘッダー行を探し、見つかればデータ部分の開始位置を覚えます。
+        ヘッダー行がまだ書き込まれていない、または書き込み途中の場合はFalseを返します。
+        """
+        try:
+            header_row, columns, body_offset, preamble = find_header(f, self.encoding, self.header_marker)
+        except ValueError:
+            return False
+        f.seek(body_offset - 1)
+        if f.read(1) != b'\n':
+            return False
+        self._set_header(header_row, columns, preamble)
+        self.offset = body_offset
+        return True
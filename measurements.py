@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+
+from events import build_events
+from tek_cache import ParseCache
+
+# 測定項目。
+MEASUREMENTS = ['frequency', 'period', 'rise time', 'fall time', 'overshoot %', 'Vpp', 'RMS', 'duty %']
+
+# ベースとトップのレベルを求めるヒストグラムのビンの数。
+HISTOGRAM_BINS = 256
+# ヒストグラムを作るときに一度に処理するサンプル数。
+CHUNK_SAMPLES = 1 << 22
+# 立ち上がり・立ち下がり時間の基準レベル（振幅に対する割合）。
+LOW_REFERENCE = 0.1
+HIGH_REFERENCE = 0.9
+
+# 1つの範囲で立ち上がり時間などを求めるのに使うエッジの数の上限。多い場合は等間隔に選んだエッジで求めます。
+MAX_EDGES = 10000
+
+# 表示範囲ごとの測定結果を保持するキャッシュ。
+measurement_cache = ParseCache(max_mb=16)
+
+
+def _histogram(channel, lo, hi, start=0):
+    """
+    この関数はchannel[start:]のヒストグラムを、[lo, hi]をHISTOGRAM_BINS個に分けたビンで求めます。
+    """
+    counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    for offset in range(start, len(channel), CHUNK_SAMPLES):
+        counts += np.histogram(channel[offset:offset + CHUNK_SAMPLES], HISTOGRAM_BINS, (lo, hi))[0]
+    return counts
+
+
+def _levels(counts, lo, hi):
+    """
+    この関数はヒストグラムの下半分と上半分で最も多いビンの中心を、ベースとトップとして返します。
+    """
+    centers = lo + (np.arange(HISTOGRAM_BINS) + 0.5) * (hi - lo) / HISTOGRAM_BINS
+    half = HISTOGRAM_BINS // 2
+    return float(centers[counts[:half].argmax()]), float(centers[half + counts[half:].argmax()])
+
+
+def base_top(channel, lo, hi):
+    """
+    この関数はオシロスコープと同じように、ヒストグラムの下半分と上半分で最も多い値をベースとトップにします。
+    矩形波ではオーバーシュートやリンギングの影響を受けにくく、正弦波ではほぼ最小値と最大値になります。
+    :param channel: チャンネルの配列。
+    :param lo: チャンネルの最小値。
+    :param hi: チャンネルの最大値。
+    :return: (ベース, トップ)
+    """
+    if not hi > lo:
+        return float(lo), float(hi)
+    return _levels(_histogram(channel, lo, hi), lo, hi)
+
+
+def _select(count):
+    """
+    この関数は0からcount - 1までの番号から、最初と最後を含めて最大MAX_EDGES個を等間隔に選びます。
+    """
+    if count <= MAX_EDGES:
+        return np.arange(count)
+    return np.unique(np.linspace(0, count - 1, MAX_EDGES).astype(np.int64))
+
+
+class ChannelMeasurer:
+    """
+    このクラスは1つのチャンネルの測定に使う、ベース・トップのレベルと10%・90%のしきい値のイベントインデックスを保持します。
+    レベルはチャンネル全体から求めるため、表示範囲を変えても作り直しません。
+    監視中のファイルで行が追加された場合は、追加された行だけでヒストグラムとイベントインデックスを更新します。
+    チャンネルの配列は保持せず、測定のたびに受け取ります。データをディスクに書き出した後に元の配列を解放できるようにするためです。
+    """
+
+    def __init__(self, channel, total, cache_key=None):
+        """
+        :param channel: チャンネルの配列。
+        :param total: StatsIndexのチャンネル全体の統計量。
+        :param cache_key: (データセット, チャンネル)を表すキー。イベントインデックスのキャッシュに使います。
+        """
+        self.cache_key = cache_key
+        self.n = 0
+        self._range = None
+        self._counts = None
+        self.extend(channel, total)
+
+    def extend(self, channel, total):
+        """
+        この関数は末尾にデータが追加されたチャンネルに合わせて、レベルとイベントインデックスを更新します。
+        最小値か最大値が変わった場合はヒストグラムのビンが変わるため、チャンネル全体から作り直します。
+        :param channel: 追加後のチャンネルの配列。
+        :param total: StatsIndexの追加後のチャンネル全体の統計量。
+        """
+        lo, hi = total['min'], total['max']
+        if (lo, hi) != self._range:
+            self._range = (lo, hi)
+            self._counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+            self.n = 0
+        if hi > lo:
+            self._counts += _histogram(channel, lo, hi, self.n)
+            self.base, self.top = _levels(self._counts, lo, hi)
+        else:
+            self.base, self.top = float(lo), float(hi)
+        self.n = len(channel)
+        amplitude = self.top - self.base
+        self.low = self.base + LOW_REFERENCE * amplitude
+        self.high = self.base + HIGH_REFERENCE * amplitude
+        self.mid = (self.low + self.high) / 2
+        # しきい値が変わらなければ、キャッシュしたイベントインデックスを追加された行の分だけ更新します。
+        self.events = build_events(channel, self.low, self.high, self.cache_key) if amplitude > 0 else None
+
+    @staticmethod
+    def _crossing_times(channel, time, idx, level):
+        """
+        この関数はidxの直前のサンプルとidxのサンプルを直線で補間し、levelを横切った時刻を求めます。
+        """
+        prev = np.maximum(idx - 1, 0)
+        y0 = channel[prev].astype(np.float64)
+        y1 = channel[idx].astype(np.float64)
+        dy = y1 - y0
+        safe = np.where(dy == 0, 1.0, dy)
+        frac = np.where(dy == 0, 1.0, np.clip((level - y0) / safe, 0.0, 1.0))
+        t0 = time[prev]
+        return t0 + frac * (time[idx] - t0)
+
+    def measure(self, channel, time, stats, start, stop):
+        """
+        この関数は[start, stop)の範囲の測定値を求めます。
+        VppとRMSはブロックの統計量から、周期や立ち上がり時間などは範囲内のエッジから求めます。
+        エッジがMAX_EDGESより多い場合は、等間隔に選んだエッジで立ち上がり時間などの中央値や平均を求めるため、
+        計算量は範囲のサンプル数ではなく、ブロックの数とMAX_EDGESに比例します。
+        :param channel: チャンネルの配列。
+        :param time: TIMEの配列。
+        :param stats: StatsIndexのこのチャンネルの範囲の統計量。
+        :param start: 範囲の最初のインデックス。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        :return: MEASUREMENTSをキーとする辞書。
+        """
+        result = dict.fromkeys(MEASUREMENTS, np.nan)
+        result['Vpp'] = stats['max'] - stats['min']
+        result['RMS'] = stats['rms']
+        amplitude = self.top - self.base
+        if self.events is None or np.isnan(stats['max']):
+            return result
+        result['overshoot %'] = max(stats['max'] - self.top, 0.0) / amplitude * 100
+        events = self.events
+
+        # 遷移の始まりがstart以降で、終わりがstopより前のエッジだけを使います。
+        ri, rj = int(np.searchsorted(events.rise_start, start)), int(np.searchsorted(events.rising, stop))
+        fi, fj = int(np.searchsorted(events.fall_start, start)), int(np.searchsorted(events.falling, stop))
+        rise = ri + _select(max(rj - ri, 0))
+        fall = fi + _select(max(fj - fi, 0))
+
+        # 立ち上がりは10%から90%、立ち下がりは90%から10%を横切るまでの時間です。
+        rise_10 = self._crossing_times(channel, time, events.rise_start[rise], self.low)
+        rise_90 = self._crossing_times(channel, time, events.rising[rise], self.high)
+        fall_90 = self._crossing_times(channel, time, events.fall_start[fall], self.high)
+        fall_10 = self._crossing_times(channel, time, events.falling[fall], self.low)
+        if len(rise):
+            result['rise time'] = float(np.median(rise_90 - rise_10))
+        if len(fall):
+            result['fall time'] = float(np.median(fall_10 - fall_90))
+
+        # 周期は50%を横切る時刻の間隔から求めます。50%の時刻は10%と90%の時刻の中点で近似します。
+        # 選んだエッジには最初と最後のエッジが含まれるので、周期は範囲内のすべてのエッジから求めたものと同じです。
+        n_rise = rj - ri
+        if n_rise >= 2:
+            rise_mid = (rise_10 + rise_90) / 2
+            period = (rise_mid[-1] - rise_mid[0]) / (n_rise - 1)
+            result['period'] = float(period)
+            result['frequency'] = 1 / period if period > 0 else np.nan
+
+            # デューティ比は、立ち上がりから次の立ち下がりまでの平均の幅を周期で割ったものです。
+            nxt = fi + np.searchsorted(events.falling[fi:fj], events.rising[rise])
+            valid = nxt < fj
+            if valid.any() and period > 0:
+                nxt = nxt[valid]
+                fall_mid = (self._crossing_times(channel, time, events.fall_start[nxt], self.high)
+                            + self._crossing_times(channel, time, events.falling[nxt], self.low)) / 2
+                result['duty %'] = float(np.mean(fall_mid - rise_mid[valid]) / period * 100)
+        return result
+
+
+def build_measurers(store, stats, cache_key=None):
+    """
+    この関数は各チャンネルのChannelMeasurerを作成します。
+    cache_keyを指定した場合、作成したものをキャッシュします。
+    監視中のファイルのように行が追加された場合は、キャッシュしたものを追加された行の分だけ更新します。
+    :param store: ChannelStore。
+    :param stats: StatsIndex。
+    :param cache_key: データセットを表すキー。
+    :return: チャンネルごとのChannelMeasurerのリスト。
+    """
+    key = None if cache_key is None else ('measurers', cache_key)
+    measurers = None if key is None else measurement_cache.get(key)
+    if measurers is None or any(m.n > len(store) for m in measurers):
+        measurers = [
+            ChannelMeasurer(channel, total, None if cache_key is None else (cache_key, i))
+            for i, (channel, total) in enumerate(zip(store.channels, stats.totals))
+        ]
+        if key is not None:
+            measurement_cache.put(key, measurers)
+    else:
+        for measurer, channel, total in zip(measurers, store.channels, stats.totals):
+            if measurer.n < len(channel):
+                measurer.extend(channel, total)
+    return measurers
+
+
+def measurement_table(store, stats, labels, start=None, stop=None, cache_key=None):
+    """
+    この関数は各チャンネルの[start, stop)の範囲の測定値の表を返します。
+    :param store: ChannelStore。
+    :param stats: StatsIndex。
+    :param labels: 各チャンネルの表示名のリスト。
+    :param start: 範囲の最初のインデックス。Noneの場合は最初から。
+    :param stop: 範囲の最後のインデックス（含みません）。Noneの場合は最後まで。
+    :param cache_key: データセットを表すキー。
+    :return: チャンネルごとの測定値を持つDataFrame。
+    """
+    start = 0 if start is None else start
+    stop = len(store) if stop is None else stop
+    # 監視中のファイルは行が増えるとレベルが変わるため、結果のキーには行数を含めます。
+    key = None if cache_key is None else ('measurements', cache_key, len(store), start, stop)
+    rows = None if key is None else measurement_cache.get(key)
+    if rows is None:
+        measurers = build_measurers(store, stats, cache_key)
+        rows = [m.measure(channel, store.time, stats.window(i, start, stop), start, stop)
+                for i, (m, channel) in enumerate(zip(measurers, store.channels))]
+        if key is not None:
+            measurement_cache.put(key, rows)
+    return pd.DataFrame(rows, index=labels, columns=MEASUREMENTS)
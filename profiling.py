@@ -0,0 +1,141 @@
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# 計測結果を構造化ログ（1行1つのJSON）として出力するロガー。
+# TEK_PROFILE_LOGにファイルのパスを指定するとそのファイルに追記し、指定しない場合は標準エラー出力に書き出します。
+# ルートロガーの設定（既定ではWARNING以上）に関わらず出力されるように、専用のハンドラーとレベルを設定します。
+logger = logging.getLogger('tek.profile')
+if not logger.handlers:
+    _log_path = os.environ.get('TEK_PROFILE_LOG')
+    _handler = logging.FileHandler(_log_path, encoding='utf-8') if _log_path else logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Streamlitではセッションごとに別のスレッドでスクリプトが実行されるため、スレッドごとに保持します。
+_local = threading.local()
+
+# tracemallocはプロセス全体で1つなので、計測中のセッションの数を数えて、最後のセッションが終わったら止めます。
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class Profiler:
+    """
+    このクラスは1回の再実行の各段階について、経過時間・確保したメモリ・ポイント数を記録します。
+    """
+
+    def __init__(self, enabled=False):
+        """
+        :param enabled: 計測するかどうか。Falseの場合、stageは何もしません。
+        """
+        self.enabled = enabled
+        self.records = []
+        self._tracing = False
+        if enabled:
+            _start_tracing()
+            self._tracing = True
+
+    def stage(self, name):
+        """
+        この関数は段階を計測するコンテキストマネージャーを返します。
+        withで受け取った辞書の'points'にポイント数を設定できます。
+        :param name: 段階の名前。
+        """
+        if not self.enabled:
+            # 呼び出し側が辞書に書き込んでも他の呼び出しに影響しないように、毎回新しい辞書を渡します。
+            return contextlib.nullcontext({})
+        return self._measure(name)
+
+    @contextlib.contextmanager
+    def _measure(self, name):
+        # 他のセッションと同時に計測している場合、メモリの値には他のセッションの分も含まれます。
+        record = {'stage': name, 'points': None}
+        tracemalloc.reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_ms'] = (time.perf_counter() - t0) * 1e3
+            current, peak = tracemalloc.get_traced_memory()
+            record['alloc_mb'] = (current - mem_before) / 1e6
+            record['peak_mb'] = (peak - mem_before) / 1e6
+            self.records.append(record)
+
+    def merge(self, records, prefix=''):
+        """
+        この関数は他のスレッドで計測した結果を、この再実行の結果に加えます。
+        :param records: 他のProfilerのrecords。
+        :param prefix: 段階の名前の前に付ける文字列。
+        """
+        if self.enabled:
+            self.records.extend(dict(record, stage=prefix + record['stage']) for record in records)
+
+    def close(self):
+        """
+        この関数はメモリの計測を止めます。
+        """
+        if self._tracing:
+            _stop_tracing()
+            self._tracing = False
+
+    def finish(self):
+        """
+        この関数は計測を終了し、結果をログに出力します。
+        :return: 段階ごとの計測結果のDataFrame。計測が無効の場合はNone。
+        """
+        self.close()
+        if not self.enabled:
+            return None
+        logger.info(json.dumps({'event': 'rerun', 'time': time.time(), 'stages': self.records}))
+        return pd.DataFrame(self.records, columns=['stage', 'wall_ms', 'alloc_mb', 'peak_mb', 'points'])
+
+
+def begin(enabled):
+    """
+    この関数は現在のスレッドの再実行の計測を開始します。
+    :param enabled: 計測するかどうか。
+    :return: Profiler。
+    """
+    # 前回の再実行が例外で終わった場合でも、メモリの計測が残らないようにします。
+    previous = getattr(_local, 'profiler', None)
+    if previous is not None:
+        previous.close()
+    _local.profiler = Profiler(enabled)
+    return _local.profiler
+
+
+def current():
+    """
+    この関数は現在のスレッドのProfilerを返します。beginが呼ばれていない場合は無効なProfilerを返します。
+    """
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        profiler = _local.profiler = Profiler(False)
+    return profiler
@@ -0,0 +1,36 @@
+import plotly.graph_objects as go
+
+# 描画方法。Autoではトレースのポイント数が閾値を超えるとWebGLを使います。
+RENDERERS = ['Auto', 'SVG', 'WebGL']
+
+# SVGで描画するトレースのポイント数の上限。これを超えるとSVGの描画が極端に遅くなります。
+DEFAULT_GL_THRESHOLD = 100_000
+
+
+def use_webgl(n_points, renderer='Auto', threshold=DEFAULT_GL_THRESHOLD):
+    """
+    この関数はWebGL（Scattergl）で描画するかどうかを判定します。
+    :param n_points: 最も長いトレースのポイント数。
+    :param renderer: 描画方法（RENDERERSのいずれか）。
+    :param threshold: AutoのときにWebGLに切り替えるポイント数。
+    :return: WebGLで描画する場合はTrue。
+    """
+    if renderer == 'WebGL':
+        return True
+    if renderer == 'SVG':
+        return False
+    if renderer == 'Auto':
+        return n_points > threshold
+    raise ValueError(f'不明な描画方法です: {renderer}')
+
+
+def scatter_class(n_points, renderer='Auto', threshold=DEFAULT_GL_THRESHOLD):
+    """
+    この関数は描画方法に応じたトレースのクラスを返します。
+    SVGとWebGLのトレースを混在させると重なり順が崩れるため、図全体で同じクラスを使います。
+    :param n_points: 最も長いトレースのポイント数。
+    :param renderer: 描画方法（RENDERERSのいずれか）。
+    :param threshold: AutoのときにWebGLに切り替えるポイント数。
+    :return: go.Scatterまたはgo.Scattergl。
+    """
+    return go.Scattergl if use_webgl(n_points, renderer, threshold) else go.Scatter
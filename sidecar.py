@@ -0,0 +1,100 @@
+import os
+import shutil
+import sys
+
+from channel_store import ChannelStore, read_store_meta
+from tek_loader import read_channel_store
+
+
+def sidecar_path(path):
+    """
+    この関数はCSVファイルに対応するサイドカーのディレクトリのパスを返します。
+    :param path: CSVファイルへのパス。
+    """
+    return os.fspath(path) + '.cache'
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return {'source_size': st.st_size, 'source_mtime_ns': st.st_mtime_ns}
+
+
+def convert_capture(path, encoding='shift-jis', header_marker='TIME', workers=None):
+    """
+    この関数はCSVファイルを一度だけ解析し、列ごとの.npyファイルとメタデータに変換します。
+    :param path: CSVファイルへのパス。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :param workers: 解析に使うスレッドの数。read_channel_storeに渡します。
+    :return: サイドカーのディレクトリのパス。
+    """
+    store = read_channel_store(path, encoding, header_marker, workers)
+
+    # 一時ディレクトリに書き込んでから名前を変えることで、書き込み途中のサイドカーを読まないようにします。
+    dst = sidecar_path(path)
+    tmp = dst + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    store.save(tmp, encoding=encoding, header_marker=header_marker, **_source_stat(path))
+    shutil.rmtree(dst, ignore_errors=True)
+    os.replace(tmp, dst)
+    return dst
+
+
+def read_meta(path):
+    """
+    この関数はCSVファイルに対応するサイドカーのメタデータを読み込みます。
+    サイドカーがない場合、形式が古い場合、元のファイルが変更されている場合はNoneを返します。
+    :param path: CSVファイルへのパス。
+    """
+    meta = read_store_meta(sidecar_path(path))
+    if meta is None:
+        return None
+    stat = _source_stat(path)
+    if meta.get('source_size') != stat['source_size'] or meta.get('source_mtime_ns') != stat['source_mtime_ns']:
+        return None
+    return meta
+
+
+def load_sidecar(path):
+    """
+    この関数はサイドカーの.npyファイルをメモリマップで開きます。
+    データは必要になったときにディスクから読み込まれるため、ファイル全体がメモリに載ることはありません。
+    :param path: CSVファイルへのパス。
+    :return: ChannelStore。サイドカーが使えない場合はNone。
+    """
+    if read_meta(path) is None:
+        return None
+    return ChannelStore.load(sidecar_path(path), mmap=True)
+
+
+def read_capture(path, encoding='shift-jis', header_marker='TIME', workers=None):
+    """
+    この関数はサイドカーがあればそこから読み込み、なければCSVファイルを変換してから読み込みます。
+    :param path: CSVファイルへのパス。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :param workers: 解析に使うスレッドの数。read_channel_storeに渡します。
+    :return: ChannelStore。
+    """
+    store = load_sidecar(path)
+    if store is None:
+        convert_capture(path, encoding, header_marker, workers)
+        store = load_sidecar(path)
+    return store
+
+
+def main(paths):
+    """
+    メイン関数。指定されたCSVファイルをサイドカーに変換します。
+    :param paths: CSVファイルへのパスのリスト。
+    """
+    for path in paths:
+        if read_meta(path) is not None:
+            print(f'{path}: 変換済みです。')
+            continue
+        dst = convert_capture(path)
+        print(f'{path} -> {dst}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
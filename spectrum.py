@@ -0,0 +1,166 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft, signal
+
+from tek_cache import ParseCache
+
+# 周波数領域の表示の種類。
+SPECTRUM_KINDS = ['FFT', 'Welch PSD', 'Spectrogram']
+
+# 窓関数。scipy.signal.get_windowに渡す名前です。
+WINDOW_FUNCTIONS = ['hann', 'hamming', 'blackman', 'flattop', 'boxcar']
+
+# NFFT（1区間のサンプル数）の選択肢。
+NFFT_CHOICES = [256, 1024, 4096, 16384, 65536]
+
+# 一度にFFTする区間の数。長い範囲でも一時配列の大きさがNFFT * SEGMENT_CHUNKで抑えられます。
+SEGMENT_CHUNK = 64
+
+# スペクトログラムの時間方向と周波数方向の最大の点数。超える場合は区間を間引き、周波数は最大値でまとめます。
+MAX_SPECTROGRAM_COLUMNS = 512
+MAX_SPECTROGRAM_ROWS = 512
+
+# 計算したスペクトルを保持するキャッシュ。
+spectrum_cache = ParseCache(max_mb=128)
+
+
+def sample_rate(time):
+    """
+    この関数はTIMEの配列からサンプリング周波数（Hz）を求めます。
+    :param time: TIMEの配列、またはUniformTime。
+    :return: サンプリング周波数。2点未満の場合は1.0。
+    """
+    n = len(time)
+    if n < 2:
+        return 1.0
+    duration = float(time[n - 1]) - float(time[0])
+    return (n - 1) / duration if duration > 0 else 1.0
+
+
+def _segment_starts(n, nperseg, step):
+    return np.arange(0, n - nperseg + 1, step)
+
+
+def _power_chunks(y, nperseg, window, starts):
+    """
+    この関数は区間をSEGMENT_CHUNK個ずつFFTし、区間ごとのパワー（窓で補正する前）を順に返します。
+    区間はsliding_window_viewで作るため、データはFFTするときまでコピーされません。
+    """
+    win = signal.get_window(window, nperseg).astype(np.float64)
+    segments = sliding_window_view(y, nperseg)
+    for i in range(0, len(starts), SEGMENT_CHUNK):
+        chunk = segments[starts[i:i + SEGMENT_CHUNK]].astype(np.float64)
+        chunk -= chunk.mean(axis=1, keepdims=True)
+        spec = fft.rfft(chunk * win, axis=1)
+        yield spec.real ** 2 + spec.imag ** 2
+
+
+def _one_sided(power, nperseg):
+    # 片側スペクトルにするため、直流とナイキスト周波数以外を2倍します。
+    power[..., 1:] *= 2
+    if nperseg % 2 == 0:
+        power[..., -1] /= 2
+    return power
+
+
+def averaged_spectrum(y, fs, nfft, window='hann', scaling='density'):
+    """
+    この関数はWelch法で平均したスペクトルを求めます。scipy.signal.welchと同じ結果になりますが、
+    区間をSEGMENT_CHUNK個ずつ処理するため、範囲が長くてもメモリの使用量は一定です。
+    :param y: データ（1次元のNumPy配列）。
+    :param fs: サンプリング周波数（Hz）。
+    :param nfft: 1区間のサンプル数。データより長い場合はデータ全体を1区間にします。
+    :param window: 窓関数の名前。
+    :param scaling: 'density'ならパワースペクトル密度（V²/Hz）、'spectrum'ならパワースペクトル（V²）。
+    :return: (周波数の配列, スペクトルの配列)。
+    """
+    n = len(y)
+    nperseg = min(int(nfft), n)
+    freqs = fft.rfftfreq(nperseg, 1 / fs)
+    if nperseg < 2:
+        return freqs, np.zeros(len(freqs))
+    starts = _segment_starts(n, nperseg, nperseg - nperseg // 2)
+    total = np.zeros(len(freqs))
+    for power in _power_chunks(y, nperseg, window, starts):
+        total += power.sum(axis=0)
+
+    win = signal.get_window(window, nperseg)
+    scale = 1 / (fs * (win * win).sum()) if scaling == 'density' else 1 / win.sum() ** 2
+    return freqs, _one_sided(total * scale / len(starts), nperseg)
+
+
+def fft_magnitude(y, fs, nfft, window='hann'):
+    """
+    この関数は振幅スペクトル（V）を求めます。範囲がnfftより長い場合は、区間ごとのパワーを平均します。
+    :param y: データ（1次元のNumPy配列）。
+    :param fs: サンプリング周波数（Hz）。
+    :param nfft: 1区間のサンプル数。
+    :param window: 窓関数の名前。
+    :return: (周波数の配列, 振幅の配列)。
+    """
+    freqs, power = averaged_spectrum(y, fs, nfft, window, scaling='spectrum')
+    return freqs, np.sqrt(power)
+
+
+def spectrogram(y, fs, nfft, window='hann'):
+    """
+    この関数はスペクトログラム（dB）を求めます。
+    区間が多い場合は等間隔に選んだMAX_SPECTROGRAM_COLUMNS個の区間だけをFFTし、
+    周波数の点が多い場合は隣り合う周波数の最大値でまとめるため、表示する大きさは一定です。
+    :param y: データ（1次元のNumPy配列）。
+    :param fs: サンプリング周波数（Hz）。
+    :param nfft: 1区間のサンプル数。
+    :param window: 窓関数の名前。
+    :return: (周波数の配列, 区間の中心のサンプル位置の配列, パワー密度(dB)の2次元配列[周波数, 区間])。
+    """
+    n = len(y)
+    nperseg = min(int(nfft), n)
+    if nperseg < 2:
+        return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros((0, 0))
+    starts = _segment_starts(n, nperseg, nperseg - nperseg // 2)
+    if len(starts) > MAX_SPECTROGRAM_COLUMNS:
+        starts = np.linspace(0, n - nperseg, MAX_SPECTROGRAM_COLUMNS).astype(np.int64)
+    power = np.concatenate(list(_power_chunks(y, nperseg, window, starts)))
+
+    win = signal.get_window(window, nperseg)
+    power = _one_sided(power / (fs * (win * win).sum()), nperseg)
+    freqs = fft.rfftfreq(nperseg, 1 / fs)
+
+    # 周波数の点が多すぎる場合は、隣り合う点の最大値でまとめます。ピークは失われません。
+    group = -(-len(freqs) // MAX_SPECTROGRAM_ROWS)
+    if group > 1:
+        m = len(freqs) // group * group
+        power = power[:, :m].reshape(len(starts), -1, group).max(axis=2)
+        freqs = freqs[:m:group]
+
+    db = 10 * np.log10(np.maximum(power, np.finfo(np.float64).tiny))
+    return freqs, starts + nperseg // 2, db.T.astype(np.float32)
+
+
+def compute_spectrum(y, fs, kind, nfft, window='hann', cache_key=None):
+    """
+    この関数は指定した種類の周波数領域の表示を計算します。
+    cache_keyを指定した場合、結果をキャッシュします。軸の範囲などを変えても計算し直しません。
+    :param y: データ（1次元のNumPy配列）。
+    :param fs: サンプリング周波数（Hz）。
+    :param kind: SPECTRUM_KINDSのいずれか。
+    :param nfft: 1区間のサンプル数。
+    :param window: 窓関数の名前。
+    :param cache_key: (データセット, 表示範囲, チャンネル)を表すキャッシュのキー。
+    :return: FFTとWelch PSDは(周波数, 値)、Spectrogramは(周波数, 区間の中心の位置, dB)。
+    """
+    key = None if cache_key is None else (cache_key, kind, int(nfft), window)
+    result = None if key is None else spectrum_cache.get(key)
+    if result is None:
+        y = np.asarray(y)
+        if kind == 'FFT':
+            result = fft_magnitude(y, fs, nfft, window)
+        elif kind == 'Welch PSD':
+            result = averaged_spectrum(y, fs, nfft, window)
+        elif kind == 'Spectrogram':
+            result = spectrogram(y, fs, nfft, window)
+        else:
+            raise ValueError(f'不明な表示の種類です: {kind}')
+        if key is not None:
+            spectrum_cache.put(key, result)
+    return result
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+from tek_cache import ParseCache
+
+# チャンネルごとの統計インデックスを保持するキャッシュ。
+stats_cache = ParseCache(max_mb=64)
+
+
+class StatsIndex:
+    """
+    このクラスは各チャンネルの統計量（最小値・最大値・平均・RMS）のインデックスです。
+    読み込み時にBLOCKサンプルごとの最小値・最大値・和・二乗和を一度だけ計算しておくことで、
+    任意の範囲の統計量を、全サンプルではなくブロックの数に比例する計算量で求められます。
+    """
+
+    # ブロックのサンプル数。
+    BLOCK = 4096
+    # ブロックを計算するときに一度に処理するブロック数。一時配列の大きさを抑えます。
+    CHUNK_BLOCKS = 256
+
+    def __init__(self, channels):
+        """
+        :param channels: 各チャンネルの配列のリスト。
+        """
+        channels = list(channels)
+        self.channels = []
+        self.block_min = [np.empty(0, ch.dtype) for ch in channels]
+        self.block_max = [np.empty(0, ch.dtype) for ch in channels]
+        self.block_sum = [np.empty(0) for _ in channels]
+        self.block_sumsq = [np.empty(0) for _ in channels]
+        self.extend(channels)
+
+    def extend(self, channels):
+        """
+        この関数は末尾にデータが追加されたチャンネルに合わせてインデックスを更新します。
+        端数だった最後のブロックと新しいブロックだけを計算するため、計算量は追加されたサンプル数に比例します。
+        :param channels: 追加後の各チャンネルの配列のリスト。追加前のデータと先頭部分が同じである必要があります。
+        """
+        first = min((len(ch) for ch in self.channels), default=0) // self.BLOCK
+        self.channels = list(channels)
+        for i, channel in enumerate(self.channels):
+            parts = {'min': [], 'max': [], 'sum': [], 'sumsq': []}
+            step = self.BLOCK * self.CHUNK_BLOCKS
+            for offset in range(first * self.BLOCK, len(channel), step):
+                chunk = channel[offset:offset + step]
+                local = np.arange(0, len(chunk), self.BLOCK)
+                parts['min'].append(np.minimum.reduceat(chunk, local))
+                parts['max'].append(np.maximum.reduceat(chunk, local))
+                parts['sum'].append(np.add.reduceat(chunk, local, dtype=np.float64))
+                chunk = chunk.astype(np.float64)
+                parts['sumsq'].append(np.add.reduceat(chunk * chunk, local))
+            self.block_min[i] = np.concatenate([self.block_min[i][:first]] + parts['min'])
+            self.block_max[i] = np.concatenate([self.block_max[i][:first]] + parts['max'])
+            self.block_sum[i] = np.concatenate([self.block_sum[i][:first]] + parts['sum'])
+            self.block_sumsq[i] = np.concatenate([self.block_sumsq[i][:first]] + parts['sumsq'])
+
+        # 全体の統計量は何度も使うので、先に求めておきます。
+        self.totals = [self.window(i, 0, len(ch)) for i, ch in enumerate(self.channels)]
+
+    @property
+    def nbytes(self):
+        arrays = self.block_min + self.block_max + self.block_sum + self.block_sumsq
+        return sum(a.nbytes for a in arrays)
+
+    def to_arrays(self):
+        """
+        この関数はファイルに保存するために、各チャンネルのブロックの統計量を辞書で返します。
+        :return: min_0, max_0, sum_0, sumsq_0, min_1, ... をキーとする配列の辞書。
+        """
+        arrays = {}
+        for i in range(len(self.channels)):
+            arrays[f'min_{i}'] = self.block_min[i]
+            arrays[f'max_{i}'] = self.block_max[i]
+            arrays[f'sum_{i}'] = self.block_sum[i]
+            arrays[f'sumsq_{i}'] = self.block_sumsq[i]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, channels, arrays):
+        """
+        この関数はto_arraysで保存した配列から統計インデックスを復元します。ブロックの計算はやり直しません。
+        :param channels: 各チャンネルの配列のリスト。
+        :param arrays: to_arraysが返した辞書、またはそれを保存した.npzファイル。
+        :return: StatsIndex。
+        """
+        stats = cls.__new__(cls)
+        stats.channels = list(channels)
+        n = len(stats.channels)
+        stats.block_min = [arrays[f'min_{i}'] for i in range(n)]
+        stats.block_max = [arrays[f'max_{i}'] for i in range(n)]
+        stats.block_sum = [arrays[f'sum_{i}'] for i in range(n)]
+        stats.block_sumsq = [arrays[f'sumsq_{i}'] for i in range(n)]
+        stats.totals = [stats.window(i, 0, len(ch)) for i, ch in enumerate(stats.channels)]
+        return stats
+
+    def window(self, i, start, stop):
+        """
+        この関数はチャンネルiの[start, stop)の範囲の統計量を返します。
+        範囲に完全に含まれるブロックは事前に計算した値を使い、両端の端数だけを生のデータから計算します。
+        :param i: チャンネルの位置（0始まり）。
+        :param start: 範囲の最初のインデックス。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        :return: min, max, mean, rmsをキーとする辞書。
+        """
+        channel = self.channels[i]
+        start = max(int(start), 0)
+        stop = min(int(stop), len(channel))
+        count = stop - start
+        if count <= 0:
+            return {'min': np.nan, 'max': np.nan, 'mean': np.nan, 'rms': np.nan}
+
+        # 範囲に完全に含まれるブロックは[first, last)です。最後のブロックは端数でも、範囲が末尾まであれば含まれます。
+        first = -(-start // self.BLOCK)
+        last = len(self.block_min[i]) if stop == len(channel) else stop // self.BLOCK
+        pieces = []
+        if first < last:
+            pieces.append(channel[start:first * self.BLOCK])
+            pieces.append(channel[min(last * self.BLOCK, stop):stop])
+            lo = [self.block_min[i][first:last].min()]
+            hi = [self.block_max[i][first:last].max()]
+            total = self.block_sum[i][first:last].sum()
+            total_sq = self.block_sumsq[i][first:last].sum()
+        else:
+            pieces.append(channel[start:stop])
+            lo, hi, total, total_sq = [], [], 0.0, 0.0
+
+        for piece in pieces:
+            if len(piece):
+                piece = piece.astype(np.float64)
+                lo.append(piece.min())
+                hi.append(piece.max())
+                total += piece.sum()
+                total_sq += np.dot(piece, piece)
+
+        return {
+            'min': float(min(lo)),
+            'max': float(max(hi)),
+            'mean': float(total / count),
+            'rms': float(np.sqrt(total_sq / count)),
+        }
+
+    def value_range(self, indices, start=None, stop=None):
+        """
+        この関数は指定したチャンネル全体での最小値と最大値を返します。
+        :param indices: チャンネルの位置のリスト。
+        :param start: 範囲の最初のインデックス。Noneの場合は全体を使います。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        :return: (最小値, 最大値)。チャンネルがない場合は(0.0, 1.0)。
+        """
+        if start is None:
+            stats = [self.totals[i] for i in indices]
+        else:
+            stats = [self.window(i, start, stop) for i in indices]
+        stats = [s for s in stats if not np.isnan(s['min'])]
+        if not stats:
+            return 0.0, 1.0
+        return min(s['min'] for s in stats), max(s['max'] for s in stats)
+
+    def table(self, labels, start=None, stop=None):
+        """
+        この関数は各チャンネルの統計量の表を返します。
+        :param labels: 各チャンネルの表示名のリスト。
+        :param start: 範囲の最初のインデックス。Noneの場合は全体を使います。
+        :param stop: 範囲の最後のインデックス（含みません）。
+        :return: チャンネルごとの統計量を持つDataFrame。
+        """
+        if start is None:
+            rows = self.totals
+        else:
+            rows = [self.window(i, start, stop) for i in range(len(self.channels))]
+        return pd.DataFrame(rows, index=labels, columns=['min', 'max', 'mean', 'rms'])
+
+
+def build_stats(channels, cache_key=None, prebuilt=None):
+    """
+    この関数は各チャンネルの統計インデックスを作成します。
+    cache_keyを指定した場合、作成したインデックスをキャッシュします。
+    :param channels: 各チャンネルの配列のリスト。
+    :param cache_key: データセットを表すキー。
+    :param prebuilt: 読み込みながら作成したStatsIndex。指定すると作り直さずにキャッシュに登録します。
+    :return: StatsIndex。
+    """
+    stats = None if cache_key is None else stats_cache.get(cache_key)
+    if stats is None:
+        stats = StatsIndex(channels) if prebuilt is None else prebuilt
+        if cache_key is not None:
+            stats_cache.put(cache_key, stats)
+    return stats
+
+
+def rebind_stats(channels, cache_key):
+    """
+    この関数はキャッシュにある統計インデックスが、channelsの配列を参照するように切り替えます。
+    :param channels: 同じデータを持つ各チャンネルの配列のリスト。
+    :param cache_key: データセットを表すキー。
+    """
+    stats = stats_cache.get(cache_key)
+    if stats is not None:
+        stats.extend(channels)
@@ -0,0 +1,123 @@
+import io
+import os
+
+import numpy as np
+
+from channel_store import CHANNEL_DTYPE, ChannelStore
+from live_tail import ChannelAppender
+from tek_loader import _open, _read_columns, _uniform_time, find_header
+from tek_preamble import Preamble
+
+# 一度に読み込むバイト数。解析の一時的なメモリ使用量はこの大きさに比例します。
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# 読み込み中に表示するプレビューの行数。
+PREVIEW_ROWS = 4000
+
+
+class ChunkedLoader(ChannelAppender):
+    """
+    このクラスはCSVファイルのデータ部分を一定の大きさずつ読み込み、ChannelStoreに追加します。
+    ファイル全体を一度に解析しないため、解析の一時的なメモリ使用量はファイルの大きさではなくCHUNK_SIZEで決まります。
+    ピラミッドと統計インデックスは読み込みながら更新するので、読み込みの途中でも間引いた表示ができます。
+    """
+
+    def __init__(self, file, encoding='shift-jis', header_marker='TIME', chunk_size=CHUNK_SIZE):
+        """
+        :param file: CSVファイルへのパス、またはバイナリのファイルオブジェクト。
+        :param encoding: CSVファイルのエンコーディング。
+        :param header_marker: ヘッダー行の先頭の文字列。
+        :param chunk_size: 一度に読み込むバイト数。
+        """
+        self._reset()
+        self.chunk_size = chunk_size
+        self.file, self._should_close = _open(file)
+        header_row, columns, body_offset, preamble = find_header(self.file, encoding, header_marker)
+        self._set_header(header_row, columns, preamble)
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.offset = self.file.seek(body_offset)
+        self.done = False
+
+    @property
+    def progress(self):
+        """
+        この関数は読み込んだ割合（0から1）を返します。
+        """
+        return 1.0 if self.done or self.size == 0 else min(self.offset / self.size, 1.0)
+
+    def read(self):
+        """
+        この関数は次のチャンクを読み込みます。ファイルの最後まで読んだら、改行のない最後の行も解析します。
+        :return: 追加された行数。
+        """
+        if self.done:
+            return 0
+        self.file.seek(self.offset)
+        data = self.file.read(self.chunk_size)
+        self.offset += len(data)
+        final = len(data) < self.chunk_size
+        rows = self._feed(data, final)
+        if final:
+            self.done = True
+            self.close()
+        return rows
+
+    def close(self):
+        if self._should_close:
+            self.file.close()
+            self._should_close = False
+
+    def finish(self):
+        """
+        この関数は残りをすべて読み込み、ChannelStoreを返します。
+        read_channel_storeと同じように、TIMEがプリアンブルのサンプル間隔どおりであればUniformTimeにして、
+        TIMEの配列のメモリを解放します。
+        :return: ChannelStore。
+        """
+        while not self.done:
+            self.read()
+        if self.store is None:
+            raise ValueError('データ行がありませんでした。')
+        time = _uniform_time(float(self._time[0]), float(self._time[self.rows - 1]),
+                             Preamble.parse(self.meta['preamble']).sample_interval, self.rows)
+        if time is not None:
+            self._time = None
+            self.store = ChannelStore(time, self.store.channels, self.store.names, self.meta)
+        return self.store
+
+
+def read_preview(file, rows=PREVIEW_ROWS, encoding='shift-jis', header_marker='TIME'):
+    """
+    この関数はデータ部分の全体から等間隔に行を抜き出し、粗いプレビューのChannelStoreを作成します。
+    抜き出す位置はバイト単位で決めるため、ファイルの大きさによらず、rows回の読み込みと小さな解析だけで終わります。
+    :param file: CSVファイルへのパス、またはバイナリのファイルオブジェクト。
+    :param rows: 抜き出す行数。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :return: ChannelStore。
+    """
+    f, should_close = _open(file)
+    try:
+        header_row, columns, body_offset, preamble = find_header(f, encoding, header_marker)
+        size = f.seek(0, os.SEEK_END)
+        lines = []
+        last = -1
+        for offset in np.linspace(body_offset, size, rows, endpoint=False).astype(np.int64):
+            f.seek(offset)
+            if offset > body_offset:
+                # 行の途中から始まるので、次の行の先頭まで読み飛ばします。
+                f.readline()
+            start = f.tell()
+            if start == last or start >= size:
+                continue
+            last = start
+            line = f.readline()
+            lines.append(line if line.endswith(b'\n') else line + b'\n')
+    finally:
+        if should_close:
+            f.close()
+    if not lines:
+        raise ValueError('データ行がありませんでした。')
+    arrays = _read_columns(io.BytesIO(b''.join(lines)), columns, 0, CHANNEL_DTYPE, workers=1)
+    return ChannelStore(arrays[columns[0]], [arrays[col] for col in columns[1:]], columns[1:],
+                        meta={'header_row': header_row, 'preamble': preamble})
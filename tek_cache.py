@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# キャッシュに保持する解析結果の合計サイズの上限（MB）。環境変数で変更できます。
+DEFAULT_MAX_MB = int(os.environ.get('TEK_CACHE_MAX_MB', '1024'))
+
+# file_idごとに覚えておくハッシュの数の上限。
+MAX_FILE_KEYS = 256
+
+
+def content_hash(file, *settings):
+    """
+    この関数はアップロードされたファイルの内容と読み込み設定からキーを作成します。
+    :param file: アップロードされたファイル（BytesIO互換のオブジェクト）。
+    :param settings: 解析結果に影響する設定値（エンコーディングなど）。
+    :return: 16進数のハッシュ文字列。
+    """
+    # BytesIOのgetvalue()は元のbytesをそのまま返します。getbuffer()は共有しているbytesを書き換え可能にするため、
+    # ファイル全体をコピーしてしまいます。
+    h = hashlib.blake2b(file.getvalue(), digest_size=16)
+    for setting in settings:
+        h.update(repr(setting).encode('utf-8'))
+    return h.hexdigest()
+
+
+def estimate_nbytes(value):
+    """
+    この関数はキャッシュするオブジェクトのおおよそのメモリ使用量を返します。
+    :param value: DataFrameやNumPy配列、またはそれらのタプルや辞書などのキャッシュするオブジェクト。
+    :return: バイト数。
+    """
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    return 0
+
+
+class ParseCache:
+    """
+    このクラスは解析済みのデータをキーごとに保持するLRUキャッシュです。
+    合計サイズがmax_bytesを超えると、最も長く使われていないエントリから削除します。
+    モジュールのインスタンスは複数のセッションや読み込みのスレッドから使われるため、操作はロックで保護します。
+    """
+
+    def __init__(self, max_mb=DEFAULT_MAX_MB, keep_latest=False):
+        """
+        :param max_mb: キャッシュに保持する合計サイズの上限（MB）。
+        :param keep_latest: Trueの場合、最後に追加した値は上限より大きくても、他のエントリを削除して保持します。
+        """
+        self.max_bytes = max_mb * 1024 * 1024
+        self.keep_latest = keep_latest
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        # file_idごとのハッシュを覚えておき、再実行のたびにハッシュを計算しないようにします。
+        self._file_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, key):
+        """
+        この関数はキーに対応する値を返します。見つからない場合はNoneを返します。
+        :param key: キャッシュのキー。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        この関数は値をキャッシュに追加し、上限を超えた分を古い順に削除します。
+        :param key: キャッシュのキー。
+        :param value: キャッシュする値。
+        """
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            # 上限より大きい値はキャッシュしません。keep_latestの場合は、その値だけを保持します。
+            if nbytes > self.max_bytes and not self.keep_latest:
+                return
+            self._entries[key] = (value, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_nbytes
+
+    def discard_dataset(self, dataset_key):
+        """
+        この関数はキーにデータセットのキーを含むエントリをすべて削除します。
+        ('pyramid', (データセット, 行数, フィルタ...), i)のように、タプルの中に含まれる場合も削除します。
+        :param dataset_key: データセットを表すキー。
+        :return: 削除したエントリの数。
+        """
+        def refers(key):
+            return key == dataset_key or (isinstance(key, tuple) and any(refers(k) for k in key))
+
+        with self._lock:
+            keys = [key for key in self._entries if refers(key)]
+            for key in keys:
+                self._total_bytes -= self._entries.pop(key)[1]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._file_keys.clear()
+            self._total_bytes = 0
+
+    def key_for(self, file, **settings):
+        """
+        この関数はアップロードされたファイルのキャッシュキーを返します。
+        同じアップロード（file_idが同じ）であればハッシュを再計算しません。
+        :param file: アップロードされたファイル。
+        :param settings: 解析結果に影響する設定値。
+        """
+        settings = tuple(sorted(settings.items()))
+        file_id = getattr(file, 'file_id', None)
+        memo_key = (file_id, settings)
+        if file_id is not None:
+            with self._lock:
+                key = self._file_keys.get(memo_key)
+                if key is not None:
+                    self._file_keys.move_to_end(memo_key)
+                    return key
+        # ハッシュの計算は時間がかかるので、ロックの外で行います。
+        key = content_hash(file, *settings)
+        if file_id is not None:
+            with self._lock:
+                self._file_keys[memo_key] = key
+                while len(self._file_keys) > MAX_FILE_KEYS:
+                    self._file_keys.popitem(last=False)
+        return key
+
+    def load(self, file, loader, **settings):
+        """
+        この関数はキャッシュがあればそれを返し、なければloaderで解析してキャッシュします。
+        :param file: アップロードされたファイル。
+        :param loader: file, **settingsを受け取って解析結果を返す関数。
+        :param settings: loaderに渡す読み込み設定。キーにも含まれます。
+        :return: 解析結果。
+        """
+        key = self.key_for(file, **settings)
+        value = self.get(key)
+        if value is None:
+            file.seek(0)
+            value = loader(file, **settings)
+            self.put(key, value)
+        return value
+
+
+# Streamlitの再実行ではインポート済みのモジュールは再読み込みされないため、
+# このインスタンスは再実行をまたいで保持されます。
+parse_cache = ParseCache()
@@ -0,0 +1,352 @@
+import io
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from channel_store import CHANNEL_DTYPE, TIME_DTYPE, ChannelStore, UniformTime
+from tek_preamble import Preamble
+
+# pyarrowがあれば、マルチスレッドで高速に数値を解析できるpyarrowエンジンを使います。
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    pa_csv = None
+    CSV_ENGINE = 'c'
+
+# ヘッダー行を探すときに一度に読み込むバイト数。
+PREAMBLE_CHUNK_SIZE = 64 * 1024
+
+# 最後の行を探すときにファイルの末尾から読み込むバイト数。
+TAIL_CHUNK_SIZE = 4096
+
+# データ部分を並列に解析するときのスレッドの数。環境変数で変更できます。1の場合は並列にしません。
+PARSE_WORKERS = int(os.environ.get('TEK_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+
+# 並列に解析するときの1つの範囲の最小のバイト数。小さいファイルは範囲の数を減らします。
+MIN_RANGE_SIZE = 4 * 1024 * 1024
+
+# 解析を取り消せるようにしたときの1つの範囲の最大のバイト数。範囲ごとに取り消されていないかを確認します。
+CANCEL_RANGE_SIZE = 32 * 1024 * 1024
+
+# 改行を数えるときに一度に調べるバイト数。
+COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class ParseCancelled(Exception):
+    """
+    この例外はshould_stopがTrueを返したため、解析を途中でやめたときに送出します。
+    """
+
+
+def _open(file):
+    """
+    この関数はファイルパスが渡された場合にファイルを開きます。
+    :param file: CSVファイルへのパス、またはバイナリのファイルオブジェクト。
+    :return: (ファイルオブジェクト, 呼び出し側で閉じる必要があるかどうか)
+    """
+    if isinstance(file, (str, os.PathLike)):
+        return open(file, 'rb'), True
+    return file, False
+
+
+def find_header(file, encoding='shift-jis', header_marker='TIME', chunk_size=PREAMBLE_CHUNK_SIZE):
+    """
+    この関数はファイルの先頭部分だけを読み込み、ヘッダー行を探します。
+    :param file: バイナリのファイルオブジェクト。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :param chunk_size: 一度に読み込むバイト数。
+    :return: (ヘッダー行の行番号(1始まり), 列名のリスト, データ部分の開始バイト位置, ヘッダーより前のテキスト)
+    """
+    marker = header_marker.encode(encoding)
+    file.seek(0)
+    buf = b''
+    search_from = 0
+    while True:
+        chunk = file.read(chunk_size)
+        buf += chunk
+
+        # 行頭にあるheader_markerを探します。
+        # Shift-JISの2バイト目に改行コードは現れないため、バイト列のまま検索できます。
+        if buf.startswith(marker):
+            start = 0
+        else:
+            pos = buf.find(b'\n' + marker, search_from)
+            start = pos + 1 if pos >= 0 else -1
+
+        if start >= 0:
+            end = buf.find(b'\n', start)
+            if end >= 0 or not chunk:
+                if end < 0:
+                    end = len(buf)
+                header_line = buf[start:end].decode(encoding).strip()
+                preamble = buf[:start].decode(encoding)
+                header_row = buf.count(b'\n', 0, start) + 1
+                columns = [name.strip() or f'Unnamed: {i}' for i, name in enumerate(header_line.split(','))]
+                return header_row, columns, end + 1, preamble
+        elif not chunk:
+            raise ValueError('ヘッダー行が見つかりませんでした。')
+        else:
+            # 次の検索はチャンクの境界をまたぐ部分から始めます。
+            search_from = max(len(buf) - len(marker), 0)
+
+
+def _read_body(f, columns, body_offset, dtype=None, usecols=None, use_threads=True):
+    """
+    この関数はヘッダー行の次の行からデータ部分を一度で解析します。
+    :param f: バイナリのファイルオブジェクト。
+    :param columns: 列名のリスト。
+    :param body_offset: データ部分の開始バイト位置。
+    :param dtype: TIME以外の列のデータ型。Noneの場合はfloat64になります。
+    :param usecols: 解析する列名のリスト。Noneの場合はすべての列を解析します。
+    :param use_threads: pyarrowの内部で複数のスレッドを使うかどうか。
+    """
+    f.seek(body_offset)
+    dtypes = None if dtype is None else {col: dtype for col in columns[1:]}
+    if usecols is not None and pa_csv is not None:
+        # pandasのpyarrowエンジンはnamesとusecolsを同時に指定すると列がずれるため、pyarrowを直接使います。
+        types = {col: pa.from_numpy_dtype(dtype) for col in dtypes or {}}
+        table = pa_csv.read_csv(
+            f,
+            read_options=pa_csv.ReadOptions(column_names=columns, use_threads=use_threads),
+            convert_options=pa_csv.ConvertOptions(include_columns=usecols, column_types=types),
+        )
+        return table.to_pandas()
+    return pd.read_csv(f, header=None, names=columns, dtype=dtypes, usecols=usecols, engine=CSV_ENGINE)
+
+
+def _file_buffer(f):
+    """
+    この関数はファイル全体をコピーせずに参照するバッファを返します。
+    アップロードされたファイル（BytesIO）はその内容のbytesを、ディスク上のファイルはメモリマップを使います。
+    :return: memoryview。どちらも使えない場合はNone。
+    """
+    if hasattr(f, 'getvalue'):
+        # getbuffer()は他と共有しているbytesを書き換え可能にするためにコピーするので、getvalue()のbytesを参照します。
+        return memoryview(f.getvalue())
+    try:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _split_ranges(buf, start, n_ranges):
+    """
+    この関数はbuf[start:]をほぼ同じ大きさのn_ranges個の範囲に分けます。
+    範囲の境界は改行の直後にそろえるため、1つの行が2つの範囲にまたがることはありません。
+    最後の範囲の末尾の空白と改行は除きます。
+    :return: (開始位置, 終了位置)のリスト。
+    """
+    end = len(buf)
+    while end > start and buf[end - 1] in b' \t\r\n':
+        end -= 1
+    bounds = [start]
+    for k in range(1, n_ranges):
+        pos = max(start + (end - start) * k // n_ranges, bounds[-1])
+        newline = bytes(buf[pos:min(pos + TAIL_CHUNK_SIZE, end)]).find(b'\n')
+        while newline < 0 and pos + TAIL_CHUNK_SIZE < end:
+            pos += TAIL_CHUNK_SIZE
+            newline = bytes(buf[pos:min(pos + TAIL_CHUNK_SIZE, end)]).find(b'\n')
+        bounds.append(end if newline < 0 else pos + newline + 1)
+    bounds.append(end)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _count_rows(buf, start, end):
+    """
+    この関数は範囲に含まれる行数を、改行の数から求めます。最後の行に改行がなくても1行と数えます。
+    """
+    data = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+    count = 0
+    for offset in range(0, len(data), COUNT_CHUNK_SIZE):
+        count += int(np.count_nonzero(data[offset:offset + COUNT_CHUNK_SIZE] == ord('\n')))
+    return count + (data[-1] != ord('\n'))
+
+
+def _parse_range(buf, start, end, columns, dtype, usecols):
+    """
+    この関数は1つの範囲を1つのスレッドで解析します。直列の場合と同じ_read_bodyを使うため、結果は同じになります。
+    """
+    if pa_csv is not None:
+        source = pa.BufferReader(pa.py_buffer(buf[start:end]))
+    else:
+        source = io.BytesIO(buf[start:end])
+    return _read_body(source, columns, 0, dtype, usecols, use_threads=False)
+
+
+def _read_columns_parallel(buf, columns, body_offset, dtype, usecols, workers, should_stop=None):
+    """
+    この関数はデータ部分を改行でそろえた範囲に分け、スレッドで並列に解析します。
+    先に各範囲の行数を数えて列ごとに1つの配列を確保し、各スレッドは自分の範囲の結果をその配列に直接書き込みます。
+    pyarrowとpandasの解析器は解析中にGILを解放するため、スレッドでも複数のコアを使えます。
+    :param should_stop: 引数なしで呼び出し、Trueを返したら解析をやめる関数。Noneの場合は最後まで解析します。
+    :return: 列名をキーとする配列の辞書。
+    :raises ParseCancelled: should_stopがTrueを返した場合。
+    """
+    n_ranges = max(min(workers, (len(buf) - body_offset) // MIN_RANGE_SIZE), 1)
+    if should_stop is not None:
+        # 取り消されてからすぐに止まるように、範囲を小さく分けて範囲ごとに確認します。
+        n_ranges = max(n_ranges, -(-(len(buf) - body_offset) // CANCEL_RANGE_SIZE))
+    ranges = _split_ranges(buf, body_offset, n_ranges)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(lambda r: _count_rows(buf, *r), ranges))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        out = {col: np.empty(int(offsets[-1]), dtype=TIME_DTYPE if col == columns[0] or dtype is None else dtype)
+               for col in usecols}
+
+        def parse(k):
+            if should_stop is not None and should_stop():
+                raise ParseCancelled()
+            df = _parse_range(buf, *ranges[k], columns, dtype, usecols)
+            if len(df) != counts[k]:
+                raise ValueError('空行などのため、行数が改行の数と一致しませんでした。')
+            for col in usecols:
+                out[col][offsets[k]:offsets[k + 1]] = df[col].to_numpy()
+
+        for _ in pool.map(parse, range(len(ranges))):
+            pass
+    return out
+
+
+def _read_columns(f, columns, body_offset, dtype=None, usecols=None, workers=None, should_stop=None):
+    """
+    この関数はデータ部分の指定した列を解析し、列ごとの配列として返します。
+    workersが2以上で、ファイル全体をコピーせずに参照できる場合は並列に解析し、そうでない場合は一度に解析します。
+    should_stopを指定した場合は、workersが1でも範囲に分けて解析し、範囲ごとに取り消されていないかを確認します。
+    どちらの方法でも同じ解析器と型を使うため、結果は同じです。
+    :param f: バイナリのファイルオブジェクト。
+    :param columns: 列名のリスト。
+    :param body_offset: データ部分の開始バイト位置。
+    :param dtype: TIME以外の列のデータ型。Noneの場合はfloat64になります。
+    :param usecols: 解析する列名のリスト。Noneの場合はすべての列を解析します。
+    :param workers: スレッドの数。Noneの場合はPARSE_WORKERSを使います。
+    :param should_stop: 引数なしで呼び出し、Trueを返したら解析をやめる関数。
+    :return: 列名をキーとする配列の辞書。
+    :raises ParseCancelled: should_stopがTrueを返した場合。
+    """
+    usecols = list(columns if usecols is None else usecols)
+    workers = PARSE_WORKERS if workers is None else workers
+    buf = _file_buffer(f) if workers > 1 or should_stop is not None else None
+    if buf is not None:
+        try:
+            if len(buf) - body_offset >= 2 * MIN_RANGE_SIZE:
+                return _read_columns_parallel(buf, columns, body_offset, dtype, usecols, workers, should_stop)
+        except ValueError:
+            # 行数が改行の数から求められない場合は、一度に解析する方法に切り替えます。
+            pass
+    if should_stop is not None and should_stop():
+        raise ParseCancelled()
+    df = _read_body(f, columns, body_offset, dtype, usecols)
+    return {col: df[col].to_numpy() for col in usecols}
+
+
+def _first_field(line):
+    """
+    この関数はCSVの1行から先頭の列の値を数値として返します。数値でない場合はNoneを返します。
+    """
+    try:
+        return float(line.split(b',', 1)[0])
+    except ValueError:
+        return None
+
+
+def _end_times(f, body_offset):
+    """
+    この関数はデータ部分の最初の行と最後の行のTIMEだけを読み込みます。
+    ファイルの先頭と末尾を少し読むだけなので、ファイルの大きさによらずすぐに終わります。
+    :param f: バイナリのファイルオブジェクト。
+    :param body_offset: データ部分の開始バイト位置。
+    :return: (最初の行のTIME, 最後の行のTIME)。読み取れない場合はNone。
+    """
+    f.seek(body_offset)
+    first = _first_field(f.readline())
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(body_offset, size - TAIL_CHUNK_SIZE))
+    lines = f.read().rstrip().splitlines()
+    last = _first_field(lines[-1]) if lines else None
+    if first is None or last is None:
+        return None
+    return first, last
+
+
+def _uniform_time(t0, t_last, dt, n_rows):
+    """
+    この関数は最初と最後の時刻、サンプル間隔、行数が一致する場合に、TIME列をUniformTimeとして返します。
+    一致しない場合（サンプル間隔が一定でない、ゲートで一部を書き出したなど）はNoneを返します。
+    """
+    if n_rows == 0 or dt is None:
+        return None
+    # CSVの時刻は有効数字が限られるため、サンプル間隔の半分までのずれは許容します。
+    if abs(t0 + (n_rows - 1) * dt - t_last) > dt / 2:
+        return None
+    return UniformTime(t0, dt, n_rows)
+
+
+def read_csv_file(file, encoding='shift-jis', header_marker='TIME'):
+    """
+    この関数は特定の構造を持つCSVファイルを読み込みます。
+    ヘッダー行の検索には先頭部分だけをデコードし、数値部分はデコードせずに一度で解析します。
+    :param file: CSVファイルへのパス、またはバイナリのファイルオブジェクト。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :return: CSVファイルの内容を含むpandasのDataFrame。
+    """
+    f, should_close = _open(file)
+    try:
+        # ヘッダー行を探します。
+        _, columns, body_offset, _ = find_header(f, encoding, header_marker)
+
+        # データ部分だけをファイルから直接解析します。
+        df = _read_body(f, columns, body_offset)
+    finally:
+        if should_close:
+            f.close()
+
+    return df
+
+
+def read_channel_store(file, encoding='shift-jis', header_marker='TIME', workers=None, should_stop=None):
+    """
+    この関数はCSVファイルを読み込み、チャンネルをfloat32で保持するChannelStoreとして返します。
+    チャンネルは解析の時点でfloat32にするため、float64の列を一度作ってから変換することはありません。
+    プリアンブルにサンプル間隔があり、最初と最後の時刻と行数が一致する場合は、TIME列は解析せずに
+    t0 + i * dtとして計算します。一致しない場合だけTIME列を解析します。
+    大きなファイルはデータ部分を範囲に分けて、複数のスレッドで並列に解析します。
+    :param file: CSVファイルへのパス、またはバイナリのファイルオブジェクト。
+    :param encoding: CSVファイルのエンコーディング。
+    :param header_marker: ヘッダー行の先頭の文字列。
+    :param workers: 解析に使うスレッドの数。Noneの場合はPARSE_WORKERS、1の場合は並列にしません。
+    :param should_stop: 引数なしで呼び出し、Trueを返したら解析をやめる関数。読み込みを取り消せるようにするときに指定します。
+    :return: ChannelStore。
+    :raises ParseCancelled: should_stopがTrueを返した場合。
+    """
+    profiler = profiling.current()
+    f, should_close = _open(file)
+    try:
+        with profiler.stage('header scan'):
+            header_row, columns, body_offset, preamble_text = find_header(f, encoding, header_marker)
+            preamble = Preamble.parse(preamble_text)
+            ends = _end_times(f, body_offset) if preamble.sample_interval else None
+        with profiler.stage('csv parse') as record:
+            if ends is None:
+                arrays = _read_columns(f, columns, body_offset, CHANNEL_DTYPE, workers=workers, should_stop=should_stop)
+                time = arrays[columns[0]]
+            else:
+                arrays = _read_columns(f, columns, body_offset, CHANNEL_DTYPE, columns[1:], workers, should_stop)
+                time = _uniform_time(*ends, preamble.sample_interval, len(arrays[columns[1]]))
+                if time is None:
+                    time = _read_columns(f, columns, body_offset, usecols=columns[:1], workers=workers,
+                                         should_stop=should_stop)[columns[0]]
+            channels = [arrays[col] for col in columns[1:]]
+            record['points'] = sum(len(ch) for ch in channels)
+    finally:
+        if should_close:
+            f.close()
+
+    return ChannelStore(time, channels, columns[1:], meta={'header_row': header_row, 'preamble': preamble_text})
@@ -0,0 +1,119 @@
+import math
+
+# プリアンブルの項目名。英語版と日本語版のファームウェアのどちらの名前でも読めるようにします。
+FIELD_NAMES = {
+    'model': ['Model', 'モデル'],
+    'record_length': ['Record Length', 'レコード長'],
+    'sample_interval': ['Sample Interval', 'サンプル間隔'],
+    'trigger_point': ['Trigger Point', 'トリガ・ポイント', 'トリガポイント'],
+    'trigger_time': ['Trigger Time', 'トリガ時間'],
+    'horizontal_units': ['Horizontal Units', '水平単位'],
+    'vertical_units': ['Vertical Units', '垂直単位'],
+    'vertical_scale': ['Vertical Scale', '垂直スケール'],
+    'vertical_offset': ['Vertical Offset', '垂直オフセット'],
+    'vertical_position': ['Vertical Position', '垂直位置'],
+    'probe_attenuation': ['Probe Attenuation', 'プローブ減衰'],
+}
+
+# チャンネルごとに値を持つ項目。
+CHANNEL_FIELDS = ['vertical_units', 'vertical_scale', 'vertical_offset', 'vertical_position', 'probe_attenuation']
+
+_ALIASES = {alias.lower(): field for field, aliases in FIELD_NAMES.items() for alias in aliases}
+
+
+def _to_number(text):
+    """
+    この関数は文字列を数値に変換します。数値でない場合は元の文字列を、空の場合はNoneを返します。
+    """
+    text = text.strip()
+    if not text:
+        return None
+    if text.lstrip('+-').isdigit():
+        return int(text)
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _to_count(value):
+    """
+    この関数は行数やサンプル番号を整数に変換します。古い機種では1.00000E+04のように指数表記で書かれます。
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value if isinstance(value, int) else None
+
+
+class Preamble:
+    """
+    このクラスはTIMEのヘッダー行より前にある、Tektronixのプリアンブルの項目を保持します。
+    レコード長やサンプル間隔がわかれば、TIME列を解析せずに作成したり、配列の大きさを前もって決めたりできます。
+    """
+
+    def __init__(self, fields=None, raw=None):
+        """
+        :param fields: 項目名（FIELD_NAMESのキー）と値の辞書。
+        :param raw: プリアンブルのすべての行の、項目名と値のリストの辞書。
+        """
+        self.fields = dict(fields or {})
+        self.raw = dict(raw or {})
+
+    @classmethod
+    def parse(cls, text):
+        """
+        この関数はプリアンブルのテキストを解析します。知らない項目はrawにだけ残します。
+        :param text: find_headerが返したヘッダー行より前のテキスト。
+        :return: Preamble。
+        """
+        fields = {}
+        raw = {}
+        for line in text.splitlines():
+            name, _, rest = line.partition(',')
+            name = name.strip()
+            if not name:
+                continue
+            values = [_to_number(v) for v in rest.split(',')] if rest else []
+            raw[name] = values
+            field = _ALIASES.get(name.lower())
+            if field is None:
+                continue
+            if field in CHANNEL_FIELDS:
+                fields[field] = values
+            else:
+                fields[field] = values[0] if values else None
+        return cls(fields, raw)
+
+    @property
+    def record_length(self):
+        """
+        この関数はレコード長（行数）を返します。わからない場合はNoneです。
+        """
+        value = _to_count(self.fields.get('record_length'))
+        return value if value is not None and value > 0 else None
+
+    @property
+    def sample_interval(self):
+        """
+        この関数はサンプル間隔（秒）を返します。わからない場合はNoneです。
+        """
+        value = self.fields.get('sample_interval')
+        if isinstance(value, (int, float)) and math.isfinite(value) and value > 0:
+            return float(value)
+        return None
+
+    @property
+    def trigger_point(self):
+        """
+        この関数はトリガ位置のサンプル番号を返します。わからない場合はNoneです。
+        """
+        return _to_count(self.fields.get('trigger_point'))
+
+    def channel_values(self, field, n_channels):
+        """
+        この関数はチャンネルごとの項目の値を、チャンネルの数にそろえたリストで返します。
+        :param field: CHANNEL_FIELDSのいずれか。
+        :param n_channels: チャンネルの数。
+        """
+        values = list(self.fields.get(field) or [])
+        return (values + [None] * n_channels)[:n_channels]
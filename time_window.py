@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def window_indices(time, t_start=None, t_stop=None):
+    """
+    この関数は時刻の範囲[t_start, t_stop]に含まれる行の範囲を返します。
+    TIMEは単調増加なので、二分探索によりO(log n)で求められます。
+    :param time: TIMEの配列（単調増加）。
+    :param t_start: 範囲の開始時刻（秒）。Noneの場合は最初から。
+    :param t_stop: 範囲の終了時刻（秒）。Noneの場合は最後まで。
+    :return: 行の範囲(start, stop)。stopは含みません。
+    """
+    start = 0 if t_start is None else int(np.searchsorted(time, t_start, 'left'))
+    stop = len(time) if t_stop is None else int(np.searchsorted(time, t_stop, 'right'))
+    return start, max(start, stop)
+
+
+def split_window(time, n_parts, part):
+    """
+    この関数は時間軸をn_parts個の等しい長さに分けたときの、part番目の行の範囲を返します。
+    行数ではなく時刻で分けるため、サンプル間隔が一定でないデータでも同じ時間幅になります。
+    :param time: TIMEの配列（単調増加）。
+    :param n_parts: 分割数。
+    :param part: 何番目の部分か（0始まり）。
+    :return: 行の範囲(start, stop)。stopは含みません。
+    """
+    if len(time) == 0:
+        return 0, 0
+    t0 = float(time[0])
+    t1 = float(time[-1])
+    width = (t1 - t0) / n_parts
+    start = 0 if part == 0 else int(np.searchsorted(time, t0 + part * width, 'left'))
+    stop = len(time) if part == n_parts - 1 else int(np.searchsorted(time, t0 + (part + 1) * width, 'left'))
+    return start, stop
+
+
+def part_labels(n_parts):
+    """
+    この関数は分割した部分の表示名のリストを返します。
+    :param n_parts: 分割数。
+    """
+    names = {2: ['First half', 'Second half'], 3: ['First part', 'Second part', 'Third part']}
+    return names.get(n_parts, [f'Part {i + 1}' for i in range(n_parts)])